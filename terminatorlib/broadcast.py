@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+# Terminator by Chris Jones <cmsj@tenshu.net>
+# GPL v2 only
+"""broadcast.py - sending keys typed into one terminal to many others"""
+
+from gi.repository import Gdk
+
+from tmux.control import keypress_keys
+
+# function keys whose bytes don't depend on the terminal they go to
+TEXT_FUNCTION_KEYS = frozenset([Gdk.KEY_Return, Gdk.KEY_Tab, Gdk.KEY_Escape,
+                                Gdk.KEY_Linefeed])
+# keyvals of function, cursor, keypad and modifier keys
+FUNCTION_KEYS_START = 0xff00
+FUNCTION_KEYS_END = 0xffff
+
+
+def eventkey2gdkevent(eventkey):  # FIXME FOR GTK3: is there a simpler way of casting from specific EventKey to generic (union) GdkEvent?
+    gdkevent = Gdk.Event.new(eventkey.type)
+    gdkevent.key.window = eventkey.window
+    gdkevent.key.send_event = eventkey.send_event
+    gdkevent.key.time = eventkey.time
+    gdkevent.key.state = eventkey.state
+    gdkevent.key.keyval = eventkey.keyval
+    gdkevent.key.length = eventkey.length
+    gdkevent.key.string = eventkey.string
+    gdkevent.key.hardware_keycode = eventkey.hardware_keycode
+    gdkevent.key.group = eventkey.group
+    gdkevent.key.is_modifier = eventkey.is_modifier
+    return gdkevent
+
+
+def pty_bytes(event):
+    """The bytes VTE writes to the pty for a key press, '' for none, or None
+    if they depend on the terminal: its cursor and keypad modes, its
+    backspace and delete bindings, or how it sends Alt"""
+    if event.is_modifier:
+        return ''
+    if event.state & Gdk.ModifierType.MOD1_MASK:
+        return None
+    keyval = event.keyval
+    if FUNCTION_KEYS_START <= keyval <= FUNCTION_KEYS_END and \
+       keyval not in TEXT_FUNCTION_KEYS:
+        return None
+    return event.string or None
+
+
+class Broadcaster(object):
+    """Sends a key press to many terminals at once.
+
+    The key is translated once: to bytes written straight to the pty of
+    every local terminal, or to keys queued for every tmux pane, which
+    go out as one send-keys per pane when the main loop goes idle. Only
+    keys whose bytes depend on the receiving terminal are still emitted
+    as key-press-event to each of them.
+    """
+
+    def __init__(self):
+        # counters
+        self.keys = 0
+        self.direct = 0
+        self.emitted = 0
+
+    def broadcast(self, source, targets, event, tmux=False):
+        """Send event, pressed in source, to targets other than source"""
+        self.keys += 1
+        if tmux:
+            keys = keypress_keys(event)
+            if keys is None:
+                return
+            # only the source echoes keys ahead of tmux, the targets are
+            # not being looked at
+            for target in targets:
+                if target is not source and target.control is not None:
+                    target.control.queue_keys(keys, target.pane_id)
+                    self.direct += 1
+            return
+
+        data = pty_bytes(event)
+        if data is None:
+            gdkevent = eventkey2gdkevent(event)
+            for target in targets:
+                if target is not source:
+                    target.vte.emit('key-press-event', gdkevent)
+                    self.emitted += 1
+            return
+        if not data:
+            return
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        length = len(data)
+        for target in targets:
+            if target is source:
+                continue
+            vte = target.vte
+            vte.feed_child(data, length)
+            if vte.get_scroll_on_keystroke():
+                adjustment = vte.get_vadjustment()
+                adjustment.set_value(adjustment.get_upper() -
+                                     adjustment.get_page_size())
+            self.direct += 1
+
+    def stats(self):
+        return {
+            'keys': self.keys,
+            'direct': self.direct,
+            'emitted': self.emitted,
+        }
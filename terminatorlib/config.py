@@ -35,6 +35,15 @@ Classes relating to configuration
 'click'
 >>> config['focus']
 'click'
+>>> generation = config.base.generation
+>>> config['focus'] is config.base.get_view('default')['focus']
+True
+>>> config['focus'] = 'sloppy'
+>>> config.base.generation > generation
+True
+>>> config2['focus']
+'sloppy'
+>>> config['focus'] = 'click'
 >>> config['geometry_hinting'].__class__.__name__
 'bool'
 >>> plugintest = {}
@@ -77,7 +86,8 @@ from copy import copy
 from configobj.configobj import ConfigObj, flatten_errors
 from configobj.validate import Validator
 from borg import Borg
-from util import dbg, err, DEBUG, get_config_dir, dict_diff
+import util
+from util import dbg, err, get_config_dir, dict_diff
 
 from gi.repository import Gio
 
@@ -120,6 +130,17 @@ DEFAULTS = {
             'title_font'            : 'Sans 9',
             'putty_paste_style'     : False,
             'smart_copy'            : True,
+            'tmux_output_max_bytes_per_tick': 131072,
+            'tmux_command_timeout'  : 10,
+            'tmux_reader'           : 'thread',
+            'tmux_pause_after'      : 5,
+            'tmux_throttle_age'     : 1000,
+            'tmux_scrollback_tail'  : 1000,
+            'tmux_scrollback_chunk' : 5000,
+            'tmux_scrollback_hydration': 'idle',
+            'tmux_reconnect_attempts': 6,
+            'tmux_reconnect_delay'  : 500,
+            'tmux_predictive_echo'  : False,
         },
         'keybindings': {
             'zoom_in'          : '<Control>plus',
@@ -280,7 +301,10 @@ class Config(object):
 
     def __getitem__(self, key, default=None):
         """Look up a configuration item"""
-        return(self.base.get_item(key, self.profile, default=default))
+        try:
+            return(self.base.views[self.profile][key])
+        except KeyError:
+            return(self.base.get_item(key, self.profile, default=default))
 
     def __setitem__(self, key, value):
         """Set a particular configuration item"""
@@ -301,6 +325,7 @@ class Config(object):
         if not self.base.profiles.has_key(profile):
             dbg('Config::set_profile: %s does not exist, creating' % profile)
             self.base.profiles[profile] = copy(DEFAULTS['profiles']['default'])
+            self.base.invalidate()
 
     def add_profile(self, profile):
         """Add a new profile"""
@@ -315,6 +340,7 @@ class Config(object):
             self.set_profile('default')
         if self.base.profiles.has_key(profile):
             del(self.base.profiles[profile])
+            self.base.invalidate()
         options = self.options_get()
         if options and options.profile == profile:
             options.profile = None
@@ -325,6 +351,7 @@ class Config(object):
         if self.base.profiles.has_key(profile):
             self.base.profiles[newname] = self.base.profiles[profile]
             del(self.base.profiles[profile])
+            self.base.invalidate()
             if profile == self.profile:
                 self.profile = newname
 
@@ -483,6 +510,8 @@ class ConfigBase(Borg):
     plugins = None
     layouts = None
     command_line_options = None
+    generation = None
+    views = None
 
     def __init__(self):
         """Class initialiser"""
@@ -516,6 +545,10 @@ class ConfigBase(Borg):
             self.layouts = {}
             for layout in DEFAULTS['layouts']:
                 self.layouts[layout] = copy(DEFAULTS['layouts'][layout])
+        if self.generation is None:
+            self.generation = 0
+        if self.views is None:
+            self.views = {}
 
     def defaults_to_configspec(self):
         """Convert our tree of default values into a ConfigObj validation
@@ -584,7 +617,7 @@ class ConfigBase(Borg):
         configspecdata['plugins'] = {}
 
         configspec = ConfigObj(configspecdata)
-        if DEBUG == True:
+        if util.DEBUG == True:
             configspec.write(open('/tmp/terminator_configspec_debug.txt', 'w'))
         return(configspec)
 
@@ -673,6 +706,7 @@ class ConfigBase(Borg):
                     dbg('ConfigBase::load: skipping missing section %s' %
                             section_name)
 
+        self.invalidate()
         self.loaded = True
 
     def reload(self):
@@ -715,25 +749,39 @@ class ConfigBase(Borg):
         except Exception, ex:
             err('ConfigBase::save: Unable to save config: %s' % ex)
 
-    def get_item(self, key, profile='default', plugin=None, default=None):
-        """Look up a configuration item"""
+    def invalidate(self):
+        """Start a new generation of the config, dropping the views built
+        from the previous one"""
+        self.generation += 1
+        self.views = {}
+
+    def get_view(self, profile='default'):
+        """The globals, the keybindings and the items of profile in one
+        read-only dict, built once per generation"""
+        try:
+            return(self.views[profile])
+        except KeyError:
+            pass
         if not self.profiles.has_key(profile):
             # Hitting this generally implies a bug
-            profile = 'default'
+            view = self.get_view('default')
+        else:
+            dbg('ConfigBase::get_view: building view of profile %s for '
+                'generation %d', profile, self.generation)
+            view = dict(self.profiles[profile])
+            view.update(self.global_config)
+            view['keybindings'] = self.keybindings
+        self.views[profile] = view
+        return(view)
 
-        if self.global_config.has_key(key):
-            dbg('ConfigBase::get_item: %s found in globals: %s' %
-                    (key, self.global_config[key]))
-            return(self.global_config[key])
-        elif self.profiles[profile].has_key(key):
-            dbg('ConfigBase::get_item: %s found in profile %s: %s' % (
-                    key, profile, self.profiles[profile][key]))
-            return(self.profiles[profile][key])
-        elif key == 'keybindings':
-            return(self.keybindings)
+    def get_item(self, key, profile='default', plugin=None, default=None):
+        """Look up a configuration item"""
+        view = self.get_view(profile)
+        if key in view:
+            return(view[key])
         elif plugin and plugin in self.plugins and key in self.plugins[plugin]:
-            dbg('ConfigBase::get_item: %s found in plugin %s: %s' % (
-                    key, plugin, self.plugins[plugin][key]))
+            dbg('ConfigBase::get_item: %s found in plugin %s: %s', key,
+                plugin, self.plugins[plugin][key])
             return(self.plugins[plugin][key])
         elif default:
             return default
@@ -742,8 +790,8 @@ class ConfigBase(Borg):
 
     def set_item(self, key, value, profile='default', plugin=None):
         """Set a configuration item"""
-        dbg('ConfigBase::set_item: Setting %s=%s (profile=%s, plugin=%s)' %
-                (key, value, profile, plugin))
+        dbg('ConfigBase::set_item: Setting %s=%s (profile=%s, plugin=%s)',
+            key, value, profile, plugin)
 
         if self.global_config.has_key(key):
             self.global_config[key] = value
@@ -758,6 +806,7 @@ class ConfigBase(Borg):
         else:
             raise KeyError('ConfigBase::set_item: unknown key %s' % key)
 
+        self.invalidate()
         return(True)
 
     def get_plugin(self, plugin):
@@ -779,6 +828,7 @@ class ConfigBase(Borg):
         if profile in self.profiles:
             return(False)
         self.profiles[profile] = copy(DEFAULTS['profiles']['default'])
+        self.invalidate()
         return(True)
 
     def add_layout(self, name, layout):
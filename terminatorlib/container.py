@@ -76,8 +76,10 @@ class Container(object):
         """Split this container vertically"""
         return(self.split_axis(widget, False, cwd))
 
-    def split_axis(self, widget, vertical=True, cwd=None, sibling=None, siblinglast=None):
-        """Default axis splitter. This should be implemented by subclasses"""
+    def split_axis(self, widget, vertical=True, cwd=None, sibling=None,
+            siblinglast=None, focus=True):
+        """Default axis splitter, focus the new sibling if focus is True.
+        This should be implemented by subclasses"""
         raise NotImplementedError('split_axis')
 
     def rotate(self, widget, clockwise):
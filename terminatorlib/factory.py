@@ -90,7 +90,7 @@ class Factory(Borg):
             err('Factory::make: requested object does not exist: %s' % product)
             return(None)
 
-        dbg('Factory::make: created a %s' % product)
+        dbg('Factory::make: created a %s', product)
         output = func(**kwargs)
         inject_uuid(output)
         return(output)
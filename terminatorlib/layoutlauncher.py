@@ -101,7 +101,7 @@ class LayoutLauncher:
 
 if __name__ == '__main__':
     import util
-    util.DEBUG = True
+    util.set_debug()
     import terminal
     LAYOUTLAUNCHER = LayoutLauncher()
 
@@ -139,7 +139,8 @@ class Notebook(Container, Gtk.Notebook):
         else:
             self.set_current_page(0)
 
-    def split_axis(self, widget, vertical=True, cwd=None, sibling=None, widgetfirst=True):
+    def split_axis(self, widget, vertical=True, cwd=None, sibling=None,
+            widgetfirst=True, focus=True):
         """Split the axis of a terminal inside us"""
         dbg('called for widget: %s' % widget)
         order = None
@@ -193,7 +194,8 @@ class Notebook(Container, Gtk.Notebook):
             Gtk.main_iteration_do(False)
         self.get_toplevel().set_pos_by_ratio = False
 
-        GObject.idle_add(terminal.ensure_visible_and_focussed)
+        if focus:
+            GObject.idle_add(terminal.ensure_visible_and_focussed)
 
     def add(self, widget, metadata=None):
         """Add a widget to the container"""
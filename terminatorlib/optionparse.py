@@ -73,8 +73,12 @@ def parse_options():
                 callback=execute_cb, 
                 help=_('Use the rest of the command line as a command to '
                        'execute inside the terminal, and its arguments'))
-    parser.add_option('--remote', dest='remote',
-            help=_('Specify a remote server for tmux to connect to'))
+    parser.add_option('--remote', dest='remote', action='append',
+            help=_('Specify a remote server for tmux to connect to, may be '
+                   'repeated; an empty name stands for the local server'))
+    parser.add_option('--tmux-session', dest='tmux_session', action='append',
+            help=_('Specify a tmux session to attach to, may be repeated '
+                   '(default: terminator)'))
     parser.add_option('-g', '--config', dest='config', 
                       help=_('Specify a config file'))
     parser.add_option('-x', '--execute', dest='execute', action='callback',
@@ -101,6 +105,10 @@ icon for the window (by file or name)'))
             help=_('Comma separated list of classes to limit debugging to'))
     parser.add_option('--debug-methods', action='store', dest='debug_methods',
             help=_('Comma separated list of methods to limit debugging to'))
+    parser.add_option('--debug-format', action='store', dest='debug_format',
+            type='choice', choices=['text', 'json'], default='text',
+            help=_('Write debugging information as text or as JSON lines '
+                   'with timestamps'))
     parser.add_option('--new-tab', action='store_true', dest='new_tab',
             help=_('If Terminator is already running, just open a new tab'))
     for item in ['--sm-client-id', '--sm-config-prefix', '--screen', '-n',
@@ -122,17 +130,16 @@ icon for the window (by file or name)'))
             options.debug = 1
 
     if options.debug:
-        util.DEBUG = True
-        if options.debug > 1:
-            util.DEBUGFILES = True
+        classes = methods = []
         if options.debug_classes:
-            classes = options.debug_classes.split(',')
-            for item in classes:
-                util.DEBUGCLASSES.append(item.strip())
+            classes = [item.strip()
+                       for item in options.debug_classes.split(',')]
         if options.debug_methods:
-            methods = options.debug_methods.split(',')
-            for item in methods:
-                util.DEBUGMETHODS.append(item.strip())
+            methods = [item.strip()
+                       for item in options.debug_methods.split(',')]
+        util.set_debug(files=options.debug > 1, classes=classes,
+                       methods=methods,
+                       structured=options.debug_format == 'json')
 
     if options.working_directory:
         if os.path.exists(os.path.expanduser(options.working_directory)):
@@ -152,7 +159,6 @@ icon for the window (by file or name)'))
 
     configobj.options_set(options)
 
-    if util.DEBUG == True:
-        dbg('OptionParse::parse_options: command line options: %s' % options)
+    dbg('OptionParse::parse_options: command line options: %s', options)
 
     return(options)
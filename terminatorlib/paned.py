@@ -36,7 +36,7 @@ class Paned(Container):
 
     # pylint: disable-msg=W0613
     def split_axis(self, widget, vertical=True, cwd=None, sibling=None,
-            widgetfirst=True):
+            widgetfirst=True, focus=True):
         """Default axis splitter. This should be implemented by subclasses"""
         order = None
 
@@ -72,7 +72,8 @@ class Paned(Container):
             container.add(terminal)
 
         self.show_all()
-        sibling.grab_focus()
+        if focus:
+            sibling.grab_focus()
         
         while Gtk.events_pending():
             Gtk.main_iteration_do(False)
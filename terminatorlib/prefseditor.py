@@ -1690,7 +1690,7 @@ class LayoutEditor:
 
 if __name__ == '__main__':
     import util
-    util.DEBUG = True
+    util.set_debug()
     import terminal
     TERM = terminal.Terminal()
     PREFEDIT = PrefsEditor(TERM)
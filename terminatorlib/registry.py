@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+# Terminator by Chris Jones <cmsj@tenshu.net>
+# GPL v2 only
+"""registry.py - indexes of the terminals and windows of Terminator"""
+
+from collections import OrderedDict
+
+
+def indexed_property(name, update):
+    """A property for an attribute the Registry indexes by, having the
+    Registry method update called whenever it is set"""
+    attribute = '_' + name
+    def getter(self):
+        return getattr(self, attribute, None)
+    def setter(self, value):
+        setattr(self, attribute, value)
+        if self.terminator:
+            getattr(self.terminator.registry, update)(self)
+    return property(getter, setter)
+
+
+class Registry(object):
+    """The terminals and windows of Terminator, indexed by what they are
+    looked up by: terminals by uuid urn, tmux connection and pane id and
+    group name, windows by uuid urn. Pane ids are only unique within
+    one tmux server, so every connection has its own.
+
+    The terminals and windows lists keep registration order, Terminator
+    hands them out as Terminator.terminals and Terminator.windows. Terminal
+    and Window call update_terminal()/update_window() whenever an indexed
+    value changes; the keys every object was last indexed under are kept,
+    so that moving it costs a few dict operations.
+    """
+
+    def __init__(self):
+        self.terminals = []
+        self.windows = []
+        # terminal -> (uuid urn, (control, pane id), group) it is indexed
+        # under, window -> uuid urn
+        self.terminal_keys = {}
+        self.window_keys = {}
+        self.terminal_by_uuid = {}
+        # (control, pane id) -> terminal
+        self.terminal_by_pane_id = {}
+        # group name (or None) -> OrderedDict of its terminals
+        self.terminals_by_group = {}
+        self.window_by_uuid = {}
+
+    def add_terminal(self, terminal):
+        """Add a terminal, return False if it was already there"""
+        if terminal in self.terminal_keys:
+            return False
+        self.terminals.append(terminal)
+        self.terminal_keys[terminal] = (None, None, None)
+        self.update_terminal(terminal)
+        return True
+
+    def remove_terminal(self, terminal):
+        """Remove a terminal, return False if it wasn't there"""
+        keys = self.terminal_keys.pop(terminal, None)
+        if keys is None:
+            return False
+        self.terminals.remove(terminal)
+        self._unindex_terminal(terminal, keys)
+        return True
+
+    def update_terminal(self, terminal):
+        """Move a terminal to the keys its attributes have now"""
+        old = self.terminal_keys.get(terminal)
+        if old is None:
+            return
+        pane = None
+        if terminal.pane_id is not None:
+            pane = (terminal.control, terminal.pane_id)
+        new = (terminal.uuid.urn if terminal.uuid else None, pane,
+               terminal.group)
+        if new == old:
+            return
+        self._unindex_terminal(terminal, old)
+        self.terminal_keys[terminal] = new
+        uuid, pane, group = new
+        if uuid is not None:
+            self.terminal_by_uuid[uuid] = terminal
+        if pane is not None:
+            self.terminal_by_pane_id[pane] = terminal
+        self.terminals_by_group.setdefault(group, OrderedDict())[terminal] = \
+            None
+
+    def _unindex_terminal(self, terminal, keys):
+        uuid, pane, group = keys
+        if self.terminal_by_uuid.get(uuid) is terminal:
+            del self.terminal_by_uuid[uuid]
+        if self.terminal_by_pane_id.get(pane) is terminal:
+            del self.terminal_by_pane_id[pane]
+        members = self.terminals_by_group.get(group)
+        if members is not None:
+            members.pop(terminal, None)
+            if not members:
+                del self.terminals_by_group[group]
+
+    def add_window(self, window):
+        """Add a window, return False if it was already there"""
+        if window in self.window_keys:
+            return False
+        self.windows.append(window)
+        self.window_keys[window] = None
+        self.update_window(window)
+        return True
+
+    def remove_window(self, window):
+        """Remove a window, return False if it wasn't there"""
+        if window not in self.window_keys:
+            return False
+        uuid = self.window_keys.pop(window)
+        self.windows.remove(window)
+        if self.window_by_uuid.get(uuid) is window:
+            del self.window_by_uuid[uuid]
+        return True
+
+    def update_window(self, window):
+        if window not in self.window_keys:
+            return
+        uuid = window.uuid.urn if window.uuid else None
+        old = self.window_keys[window]
+        if uuid == old:
+            return
+        if self.window_by_uuid.get(old) is window:
+            del self.window_by_uuid[old]
+        self.window_keys[window] = uuid
+        if uuid is not None:
+            self.window_by_uuid[uuid] = window
+
+    def group_terminals(self, group):
+        """The terminals of a group, None being all ungrouped terminals"""
+        return list(self.terminals_by_group.get(group, ()))
+
+    def has_group(self, group):
+        """Whether any terminal is in the group"""
+        return group in self.terminals_by_group
@@ -4,7 +4,6 @@
 """terminal.py - classes necessary to provide Terminal widgets"""
 
 from __future__ import division
-from pipes import quote
 import os
 import signal
 import gi
@@ -14,12 +13,13 @@ from gi.repository import Vte
 import subprocess
 import urllib
 
-from util import dbg, err, spawn_new_terminator, make_uuid, manual_lookup, display_manager, get_column_row_count
+from util import dbg, err, spawn_new_terminator, make_uuid, manual_lookup, display_manager
 import util
 from config import Config
 from cwd import get_default_cwd
 from factory import Factory
 from terminator import Terminator
+from registry import indexed_property
 from titlebar import Titlebar
 from terminal_popup_menu import TerminalPopupMenu
 from searchbar import Searchbar
@@ -82,7 +82,6 @@ class Terminal(Gtk.VBox):
     titlebar = None
     searchbar = None
 
-    group = None
     cwd = None
     origcwd = None
     command = None
@@ -109,8 +108,7 @@ class Terminal(Gtk.VBox):
     cnxids = None
     targets_for_new_group = None
 
-    control = None
-    pane_id = None
+    pane_title = None
 
     def __init__(self):
         """Class initialiser"""
@@ -180,7 +178,14 @@ class Terminal(Gtk.VBox):
         self.reconfigure()
         self.vte.set_size(80, 24)
 
-        self.control = self.terminator.tmux_control
+        self.control = self.terminator.current_tmux_control()
+
+    # Terminator finds terminals by these
+    uuid = indexed_property('uuid', 'update_terminal')
+    group = indexed_property('group', 'update_terminal')
+    pane_id = indexed_property('pane_id', 'update_terminal')
+    # the tmux connection of pane_id
+    control = indexed_property('control', 'update_terminal')
 
     def get_vte(self):
         """This simply returns the vte widget we are using"""
@@ -222,6 +227,9 @@ class Terminal(Gtk.VBox):
 
     def get_cwd(self):
         """Return our cwd"""
+        if self.terminator.tmux_control:
+            # kept up to date by tmux
+            return(self.cwd)
         vte_cwd = self.vte.get_current_directory_uri()
         if vte_cwd:
             # OSC7 pwd gives an answer
@@ -587,9 +595,8 @@ class Terminal(Gtk.VBox):
     def ungroup(self, _widget, data):
         """Remove a group"""
         # FIXME: Could we emit and have Terminator do this?
-        for term in self.terminator.terminals:
-            if term.group == data:
-                term.set_group(None, None)
+        for term in self.terminator.registry.group_terminals(data):
+            term.set_group(None, None)
         self.terminator.group_hoover()
 
     def set_groupsend(self, _widget, value):
@@ -814,7 +821,8 @@ class Terminal(Gtk.VBox):
 
     def get_window_title(self):
         """Return the window title"""
-        return(self.vte.get_window_title() or str(self.command))
+        return(self.pane_title or self.vte.get_window_title() or
+               str(self.command))
 
     def on_group_button_press(self, widget, event):
         """Handler for the group button"""
@@ -992,7 +1000,10 @@ class Terminal(Gtk.VBox):
                 return (True)
 
         if self.terminator.tmux_control:
-            return self.control.send_mousewheel(event, pane_id=self.pane_id)
+            return self.control.send_mousewheel(
+                event, pane_id=self.pane_id,
+                column=int(event.x / self.vte.get_char_width()) + 1,
+                row=int(event.y / self.vte.get_char_height()) + 1)
         return(False)
 
     def popup_menu(self, widget, event=None):
@@ -1234,6 +1245,8 @@ class Terminal(Gtk.VBox):
                 self.get_toplevel().last_active_term = None
             else:
                 self.get_toplevel().last_active_term = self.uuid
+        if self.terminator.tmux_control and self.pane_id:
+            self.control.notifications_handler.resume_pane(self.pane_id)
         self.emit('focus-in')
 
     def on_vte_focus_out(self, _widget, _event):
@@ -1279,14 +1292,9 @@ class Terminal(Gtk.VBox):
         self.titlebar.update_terminal_size(column_count, row_count)
 
         if self.terminator.tmux_control:
-            # self.terminator.tmux_control.resize_pane(self.pane_id, row_count, column_count)
-            # FIXME: probably not the best place for this, update tmux client size to match the window geometry
-            window = self.terminator.get_windows()[0]
-            column_count, row_count = map(int, get_column_row_count(window))
-            # dbg("{}::{}: {}x{}".format("NotificationsHandler", "list_panes_size_result", column_count, row_count))
-            size_up_to_date = bool(column_count == self.terminator.tmux_control.width and row_count == self.terminator.tmux_control.height)
-            if not size_up_to_date:
-                self.terminator.tmux_control.refresh_client(column_count, row_count)
+            window = self.get_toplevel()
+            if window.is_toplevel():
+                window.deferred_tmux_resize(self)
 
         if self.config['geometry_hinting']:
             window = self.get_toplevel()
@@ -1452,7 +1460,8 @@ class Terminal(Gtk.VBox):
 
         dbg('Forking shell: "%s" with args: %s' % (shell, args))
         if self.terminator.tmux_control:
-            if self.terminator.initial_layout:
+            if self.pane_id:
+                # attached to an existing pane
                 pass
             else:
                 command = ' '.join(args)
@@ -1543,8 +1552,8 @@ class Terminal(Gtk.VBox):
         """Paste one of the two clipboards"""
         if self.terminator.tmux_control:
             def callback(_, content):
-                content = quote(content.replace('\n',  '\r'))
-                self.control.send_quoted_content(content, self.pane_id)
+                self.control.send_paste(content.replace('\n', '\r'),
+                                        self.pane_id)
             self.clipboard.request_text(callback)
         else:
             for term in self.terminator.get_target_terms(self):
@@ -1690,9 +1699,14 @@ class Terminal(Gtk.VBox):
             self.uuid = make_uuid(layout['uuid'])
         if layout.has_key('tmux'):
             tmux = layout['tmux']
-            self.pane_id = tmux['pane_id']
-            self.terminator.pane_id_to_terminal[self.pane_id] = self
-            self.control.initial_output(self.pane_id)
+            if tmux.has_key('connection'):
+                self.control = self.terminator.tmux_controls[tmux['connection']]
+            if tmux.has_key('pane_id'):
+                self.pane_id = tmux['pane_id']
+                self.control.pane_id_to_terminal[self.pane_id] = self
+                self.control.notifications_handler.pane_registered(
+                    self.pane_id)
+                self.control.initial_output(self.pane_id)
 
     def scroll_by_page(self, pages):
         """Scroll up or down in pages"""
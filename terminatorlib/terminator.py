@@ -16,24 +16,13 @@ from config import Config
 from keybindings import Keybindings
 from util import dbg, err, enumerate_descendants
 from factory import Factory
+from registry import Registry
+from broadcast import Broadcaster, eventkey2gdkevent
 from cwd import get_pid_cwd
 from version import APP_NAME, APP_VERSION
 import tmux.control
 import tmux.notifications
-
-def eventkey2gdkevent(eventkey):  # FIXME FOR GTK3: is there a simpler way of casting from specific EventKey to generic (union) GdkEvent?
-    gdkevent = Gdk.Event.new(eventkey.type)
-    gdkevent.key.window = eventkey.window
-    gdkevent.key.send_event = eventkey.send_event
-    gdkevent.key.time = eventkey.time
-    gdkevent.key.state = eventkey.state
-    gdkevent.key.keyval = eventkey.keyval
-    gdkevent.key.length = eventkey.length
-    gdkevent.key.string = eventkey.string
-    gdkevent.key.hardware_keycode = eventkey.hardware_keycode
-    gdkevent.key.group = eventkey.group
-    gdkevent.key.is_modifier = eventkey.is_modifier
-    return gdkevent
+import tmux.startup
 
 class Terminator(Borg):
     """master object for the application"""
@@ -43,6 +32,8 @@ class Terminator(Borg):
     windowtitle = None
     terminals = None
     groups = None
+    registry = None
+    broadcaster = None
     config = None
     keybindings = None
     style_providers = None
@@ -68,7 +59,8 @@ class Terminator(Borg):
     gtk_settings = None
 
     tmux_control = None
-    pane_id_to_terminal = None
+    tmux_controls = None
+    tmux_startup = None
     initial_layout = None
 
     def __init__(self):
@@ -80,12 +72,14 @@ class Terminator(Borg):
     def prepare_attributes(self):
         """Initialise anything that isn't already"""
 
-        if not self.windows:
-            self.windows = []
+        if not self.registry:
+            self.registry = Registry()
+            self.windows = self.registry.windows
+            self.terminals = self.registry.terminals
+        if not self.broadcaster:
+            self.broadcaster = Broadcaster()
         if not self.launcher_windows:
             self.launcher_windows = []
-        if not self.terminals:
-            self.terminals = []
         if not self.groups:
             self.groups = []
         if not self.config:
@@ -103,8 +97,8 @@ class Terminator(Borg):
             self.pid_cwd = get_pid_cwd()
         if self.gnome_client is None:
             self.attempt_gnome_client()
-        if self.pane_id_to_terminal is None:
-            self.pane_id_to_terminal = {}
+        if self.tmux_controls is None:
+            self.tmux_controls = []
 
         self.connect_signals()
 
@@ -121,15 +115,62 @@ class Terminator(Borg):
             os.chdir(cwd)
         self.origcwd = cwd
 
-    def start_tmux(self, remote=None):
-        """Store the command line argument intended for tmux and start the process"""
+    def start_tmux(self, remote=None, session_name='terminator'):
+        """Connect to a tmux session, locally or on a remote host over ssh.
+        Each connection has its own reader, requests and pane ids; the
+        first one is used for terminals not belonging to any other"""
+        handler = tmux.notifications.NotificationsHandler(self)
+        control = tmux.control.TmuxControl(session_name=session_name,
+                                           notifications_handler=handler,
+                                           remote=remote)
+        self.tmux_controls.append(control)
         if self.tmux_control is None:
-            handler = tmux.notifications.NotificationsHandler(self)
-            self.tmux_control = tmux.control.TmuxControl(
-                session_name='terminator',
-                notifications_handler=handler)
-        self.tmux_control.remote = remote
-        self.tmux_control.attach_session()
+            self.tmux_control = control
+        control.attach_session()
+        return control
+
+    def begin_tmux_startup(self, layoutname):
+        """Build layoutname, or the layout of the tmux sessions, once
+        tmux has answered; call before start_tmux()"""
+        self.tmux_startup = tmux.startup.TmuxStartup(
+            self, layoutname, timeout=self.config['tmux_command_timeout'])
+        self.tmux_startup.start()
+
+    def collect_tmux_layouts(self):
+        """Once every tmux connection has reported its windows, merge
+        them into initial_layout, one Terminator window per connection"""
+        controls = self.tmux_controls
+        if any(control.initial_layout is None for control in controls):
+            return
+        if not any(control.initial_layout for control in controls):
+            # nothing to attach to, start from the configured layout
+            self.initial_layout = {}
+        else:
+            self.initial_layout = self.merge_tmux_layouts()
+        if self.tmux_startup is not None:
+            self.tmux_startup.layout_ready()
+
+    def merge_tmux_layouts(self):
+        layout = {}
+        for index, control in enumerate(self.tmux_controls):
+            prefix = '{}.'.format(index)
+            items = control.initial_layout or {
+                'window0': {'type': 'Window', 'parent': ''},
+                'terminal0': {'type': 'Terminal', 'parent': 'window0',
+                              'tmux': {}}}
+            for name, item in items.iteritems():
+                item = dict(item)
+                if item['parent']:
+                    item['parent'] = prefix + item['parent']
+                if item['type'] == 'Terminal':
+                    item['tmux'] = dict(item['tmux'], connection=index)
+                layout[prefix + name] = item
+        return layout
+
+    def current_tmux_control(self):
+        """The tmux connection new terminals should be created on"""
+        control = getattr(self.last_focused_term, 'control', None)
+        return control or self.tmux_control
 
     def set_dbus_data(self, dbus_service):
         """Store the DBus bus details, if they are available"""
@@ -167,18 +208,15 @@ class Terminator(Borg):
 
     def register_window(self, window):
         """Register a new window widget"""
-        if window not in self.windows:
+        if self.registry.add_window(window):
             dbg('Terminator::register_window: registering %s:%s' % (id(window),
                 type(window)))
-            self.windows.append(window)
 
     def deregister_window(self, window):
         """de-register a window widget"""
         dbg('Terminator::deregister_window: de-registering %s:%s' %
                 (id(window), type(window)))
-        if window in self.windows:
-            self.windows.remove(window)
-        else:
+        if not self.registry.remove_window(window):
             err('%s is not in registered window list' % window)
 
         if len(self.windows) == 0:
@@ -209,16 +247,15 @@ class Terminator(Borg):
 
     def register_terminal(self, terminal):
         """Register a new terminal widget"""
-        if terminal not in self.terminals:
+        if self.registry.add_terminal(terminal):
             dbg('Terminator::register_terminal: registering %s:%s' %
                     (id(terminal), type(terminal)))
-            self.terminals.append(terminal)
 
     def deregister_terminal(self, terminal):
         """De-register a terminal widget"""
         dbg('Terminator::deregister_terminal: de-registering %s:%s' %
                 (id(terminal), type(terminal)))
-        self.terminals.remove(terminal)
+        self.registry.remove_terminal(terminal)
 
         if len(self.terminals) == 0:
             dbg('no terminals remain, destroying all windows')
@@ -229,31 +266,17 @@ class Terminator(Borg):
                     len(self.terminals))
 
     def find_terminal_by_uuid(self, uuid):
-        """Search our terminals for one matching the supplied UUID"""
-        dbg('searching self.terminals for: %s' % uuid)
-        for terminal in self.terminals:
-            dbg('checking: %s (%s)' % (terminal.uuid.urn, terminal))
-            if terminal.uuid.urn == uuid:
-                return terminal
-        return None
+        """Return our terminal with the supplied UUID urn, or None"""
+        return self.registry.terminal_by_uuid.get(uuid)
 
     def find_window_by_uuid(self, uuid):
-        """Search our terminals for one matching the supplied UUID"""
-        dbg('searching self.terminals for: %s' % uuid)
-        for window in self.windows:
-            dbg('checking: %s (%s)' % (window.uuid.urn, window))
-            if window.uuid.urn == uuid:
-                return window
-        return None
-
-    def find_terminal_by_pane_id(self, pane_id):
-        """Search our terminals for one matching the supplied pane_id"""
-        dbg('searching self.terminals for: %s' % pane_id)
-        for terminal in self.terminals:
-            dbg('checking: %s (%s)' % (terminal.pane_id, terminal))
-            if terminal.pane_id == pane_id:
-                return terminal
-        return None
+        """Return our window with the supplied UUID urn, or None"""
+        return self.registry.window_by_uuid.get(uuid)
+
+    def find_terminal_by_pane_id(self, control, pane_id):
+        """Return our terminal with the supplied tmux pane_id on the tmux
+        connection control, or None"""
+        return self.registry.terminal_by_pane_id.get((control, pane_id))
 
     def new_window(self, cwd=None, profile=None):
         """Create a window with a Terminal in it"""
@@ -270,6 +293,18 @@ class Terminator(Borg):
 
         return(window, terminal)
 
+    def build_layout(self, layoutname):
+        """Create layoutname, or initial_layout if we have one, falling
+        back to a single window"""
+        try:
+            dbg('Creating a terminal with layout: %s' % layoutname)
+            self.create_layout(layoutname)
+        except (KeyError,ValueError), ex:
+            err('layout creation failed, creating a window ("%s")' % ex)
+            self.new_window()
+        self.layout_done()
+        self.initial_layout = None
+
     def create_layout(self, layoutname):
         """Create all the parts necessary to satisfy the specified layout"""
         layout = copy.deepcopy(self.initial_layout)
@@ -615,25 +650,15 @@ class Terminator(Borg):
 
     def closegroupedterms(self, group):
         """Close all terminals in a group"""
-        for terminal in self.terminals[:]:
-            if terminal.group == group:
-                terminal.close()
+        for terminal in self.registry.group_terminals(group):
+            terminal.close()
 
     def group_hoover(self):
         """Clean out unused groups"""
 
         if self.config['autoclean_groups']:
-            inuse = []
-            todestroy = []
-
-            for terminal in self.terminals:
-                if terminal.group:
-                    if not terminal.group in inuse:
-                        inuse.append(terminal.group)
-
-            for group in self.groups:
-                if not group in inuse:
-                    todestroy.append(group)
+            todestroy = [group for group in self.groups
+                         if not self.registry.has_group(group)]
 
             dbg('Terminator::group_hoover: %d groups, hoovering %d' %
                     (len(self.groups), len(todestroy)))
@@ -642,17 +667,26 @@ class Terminator(Borg):
 
     def group_emit(self, terminal, group, type, event):
         """Emit to each terminal in a group"""
-        dbg('Terminator::group_emit: emitting a keystroke for group %s' %
-                group)
-        for term in self.terminals:
-            if term != terminal and term.group == group:
-                term.vte.emit(type, eventkey2gdkevent(event))
+        dbg('Terminator::group_emit: emitting a keystroke for group %s',
+            group)
+        self.emit_to(terminal, self.registry.group_terminals(group), type,
+                     event)
 
     def all_emit(self, terminal, type, event):
         """Emit to all terminals"""
-        for term in self.terminals:
+        self.emit_to(terminal, self.terminals, type, event)
+
+    def emit_to(self, terminal, targets, type, event):
+        """Emit to targets other than terminal, key presses go straight to
+        their ptys or tmux panes"""
+        if type == 'key-press-event':
+            self.broadcaster.broadcast(terminal, targets, event,
+                                       tmux=bool(self.tmux_control))
+            return
+        gdkevent = eventkey2gdkevent(event)
+        for term in targets:
             if term != terminal:
-                term.vte.emit(type, eventkey2gdkevent(event))
+                term.vte.emit(type, gdkevent)
 
     def do_enumerate(self, widget, pad):
         """Insert the number of each terminal in a group, into that terminal"""
@@ -671,11 +705,7 @@ class Terminator(Borg):
             term.feed(numstr % (idx + 1))
 
     def get_sibling_terms(self, widget):
-        termset = []
-        for term in self.terminals:
-            if term.group == widget.group:
-                termset.append(term)
-        return(termset)
+        return(self.registry.group_terminals(widget.group))
 
     def get_target_terms(self, widget):
         """Get the terminals we should currently be broadcasting to"""
@@ -696,7 +726,7 @@ class Terminator(Borg):
     def focus_changed(self, widget):
         """We just moved focus to a new terminal"""
         for terminal in self.terminals:
-            terminal.titlebar.update(widget)
+            terminal.titlebar.update_state(widget)
         return
 
     def focus_left(self, widget):
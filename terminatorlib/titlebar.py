@@ -15,6 +15,64 @@ from terminator import Terminator
 from editablelabel import EditableLabel
 from translation import _
 
+# what a titlebar's title and group label look like
+TRANSMIT = 'transmit'
+RECEIVE = 'receive'
+INACTIVE = 'inactive'
+
+
+def titlebar_state(term, other, groupsend, groupsend_type):
+    """The (title, group label, icon) state of the titlebar of term while
+    the terminal other has focus, or other is 'window-focus-out'"""
+    if other == 'window-focus-out':
+        return(INACTIVE, INACTIVE, '_receive_off')
+    elif term != other and term.group and term.group == other.group:
+        if groupsend == groupsend_type['off']:
+            return(INACTIVE, RECEIVE, '_receive_off')
+        return(RECEIVE, RECEIVE, '_receive_on')
+    elif term != other and not term.group or term.group != other.group:
+        if groupsend == groupsend_type['all']:
+            return(RECEIVE, INACTIVE, '_receive_on')
+        return(INACTIVE, INACTIVE, '_receive_off')
+    # We're the active terminal
+    if groupsend == groupsend_type['all']:
+        icon = '_active_broadcast_all'
+    elif groupsend == groupsend_type['group']:
+        icon = '_active_broadcast_group'
+    else:
+        icon = '_active_broadcast_off'
+    return(TRANSMIT, TRANSMIT, icon)
+
+
+class TitlebarStyle(object):
+    """The title font and the parsed colours of every titlebar state, as
+    configured in one config generation"""
+
+    generation = None
+    current = None
+
+    def __init__(self, config):
+        if (not config['title_use_system_font']) and config['title_font']:
+            self.font = Pango.FontDescription(config['title_font'])
+        else:
+            self.font = Pango.FontDescription(config.get_system_prop_font())
+        self.colors = {}
+        for state in (TRANSMIT, RECEIVE, INACTIVE):
+            self.colors[state] = (
+                Gdk.color_parse(config['title_%s_fg_color' % state]),
+                Gdk.color_parse(config['title_%s_bg_color' % state]))
+
+    @classmethod
+    def get(cls, config):
+        """The style for the generation config is in, built on its first
+        use"""
+        generation = config.base.generation
+        if cls.current is None or cls.generation != generation:
+            cls.current = cls(config)
+            cls.generation = generation
+        return(cls.current)
+
+
 # pylint: disable-msg=R0904
 # pylint: disable-msg=W0613
 class Titlebar(Gtk.EventBox):
@@ -32,6 +90,9 @@ class Titlebar(Gtk.EventBox):
     grouplabel = None
     groupentry = None
     bellicon = None
+    state = None
+    style = None
+    font_style = None
 
     __gsignals__ = {
             'clicked': (GObject.SignalFlags.RUN_LAST, None, ()),
@@ -56,6 +117,8 @@ class Titlebar(Gtk.EventBox):
         self.groupicon = Gtk.Image()
         self.bellicon = Gtk.Image()
         self.bellicon.set_no_show_all(True)
+        self.pausedicon = Gtk.Image()
+        self.pausedicon.set_no_show_all(True)
 
         self.groupentry = Gtk.Entry()
         self.groupentry.set_no_show_all(True)
@@ -81,6 +144,10 @@ class Titlebar(Gtk.EventBox):
         self.ebox.show_all()
 
         self.bellicon.set_from_icon_name('terminal-bell', Gtk.IconSize.MENU)
+        self.pausedicon.set_from_icon_name('media-playback-pause',
+                                           Gtk.IconSize.MENU)
+        self.pausedicon.set_tooltip_text(
+            _('Output paused by tmux, focus the terminal to continue'))
 
         viewport = Gtk.Viewport(hscroll_policy='natural')
         viewport.add(self.label)
@@ -90,6 +157,7 @@ class Titlebar(Gtk.EventBox):
         hbox.pack_start(Gtk.VSeparator(), False, True, 0)
         hbox.pack_start(viewport, True, True, 0)
         hbox.pack_end(self.bellicon, False, False, 2)
+        hbox.pack_end(self.pausedicon, False, False, 2)
 
         self.add(hbox)
         hbox.show_all()
@@ -104,81 +172,45 @@ class Titlebar(Gtk.EventBox):
 
     def update(self, other=None):
         """Update our contents"""
-        default_bg = False
         if self.config['title_hide_sizetext']:
             self.label.set_text("%s" % self.termtext)
         else:
             self.label.set_text("%s %s" % (self.termtext, self.sizetext))
 
-        if (not self.config['title_use_system_font']) and self.config['title_font']:
-            title_font = Pango.FontDescription(self.config['title_font'])
-        else:
-            title_font = Pango.FontDescription(self.config.get_system_prop_font())
-        self.label.modify_font(title_font)
-        self.grouplabel.modify_font(title_font)
-
+        style = TitlebarStyle.get(self.config)
+        if style is not self.font_style:
+            self.label.modify_font(style.font)
+            self.grouplabel.modify_font(style.font)
+            self.font_style = style
         if other:
-            term = self.terminal
-            terminator = self.terminator
-            if other == 'window-focus-out':
-                title_fg = self.config['title_inactive_fg_color']
-                title_bg = self.config['title_inactive_bg_color']
-                icon = '_receive_off'
-                default_bg = True
-                group_fg = self.config['title_inactive_fg_color']
-                group_bg = self.config['title_inactive_bg_color']
-            elif term != other and term.group and term.group == other.group:
-                if terminator.groupsend == terminator.groupsend_type['off']:
-                    title_fg = self.config['title_inactive_fg_color']
-                    title_bg = self.config['title_inactive_bg_color']
-                    icon = '_receive_off'
-                    default_bg = True
-                else:
-                    title_fg = self.config['title_receive_fg_color']
-                    title_bg = self.config['title_receive_bg_color']
-                    icon = '_receive_on'
-                group_fg = self.config['title_receive_fg_color']
-                group_bg = self.config['title_receive_bg_color']
-            elif term != other and not term.group or term.group != other.group:
-                if terminator.groupsend == terminator.groupsend_type['all']:
-                    title_fg = self.config['title_receive_fg_color']
-                    title_bg = self.config['title_receive_bg_color']
-                    icon = '_receive_on'
-                else:
-                    title_fg = self.config['title_inactive_fg_color']
-                    title_bg = self.config['title_inactive_bg_color']
-                    icon = '_receive_off'
-                    default_bg = True
-                group_fg = self.config['title_inactive_fg_color']
-                group_bg = self.config['title_inactive_bg_color']
-            else:
-                # We're the active terminal
-                title_fg = self.config['title_transmit_fg_color']
-                title_bg = self.config['title_transmit_bg_color']
-                if terminator.groupsend == terminator.groupsend_type['all']:
-                    icon = '_active_broadcast_all'
-                elif terminator.groupsend == terminator.groupsend_type['group']:
-                    icon = '_active_broadcast_group'
-                else:
-                    icon = '_active_broadcast_off'
-                group_fg = self.config['title_transmit_fg_color']
-                group_bg = self.config['title_transmit_bg_color']
-
-            self.label.modify_fg(Gtk.StateType.NORMAL,
-                    Gdk.color_parse(title_fg))
-            self.grouplabel.modify_fg(Gtk.StateType.NORMAL,
-                    Gdk.color_parse(group_fg))
-            self.modify_bg(Gtk.StateType.NORMAL, 
-                    Gdk.color_parse(title_bg))
-            if not self.get_desired_visibility():
-                if default_bg == True:
-                    color = term.get_style_context().get_background_color(Gtk.StateType.NORMAL)  # VERIFY FOR GTK3
-                else:
-                    color = Gdk.color_parse(title_bg)
-            self.update_visibility()
-            self.ebox.modify_bg(Gtk.StateType.NORMAL,
-                    Gdk.color_parse(group_bg))
-            self.set_from_icon_name(icon, Gtk.IconSize.MENU)
+            self.update_state(other, style)
+        elif style is not self.style and self.state:
+            self.apply_state(self.state, style)
+
+    def update_state(self, other, style=None):
+        """Recolour us for the terminal other having focus, or the window
+        losing it, if that changes how we look"""
+        if style is None:
+            style = TitlebarStyle.get(self.config)
+        terminator = self.terminator
+        state = titlebar_state(self.terminal, other, terminator.groupsend,
+                               terminator.groupsend_type)
+        if state != self.state or style is not self.style:
+            self.apply_state(state, style)
+
+    def apply_state(self, state, style):
+        """Set our colours and icon for state"""
+        title, group, icon = state
+        title_fg, title_bg = style.colors[title]
+        group_fg, group_bg = style.colors[group]
+        self.label.modify_fg(Gtk.StateType.NORMAL, title_fg)
+        self.grouplabel.modify_fg(Gtk.StateType.NORMAL, group_fg)
+        self.modify_bg(Gtk.StateType.NORMAL, title_bg)
+        self.update_visibility()
+        self.ebox.modify_bg(Gtk.StateType.NORMAL, group_bg)
+        self.set_from_icon_name(icon, Gtk.IconSize.MENU)
+        self.state = state
+        self.style = style
 
     def update_visibility(self):
         """Make the titlebar be visible or not"""
@@ -306,6 +338,10 @@ class Titlebar(Gtk.EventBox):
         self.bellicon.hide()
         return(False)
 
+    def icon_paused(self, paused):
+        """Show whether tmux has stopped sending our output"""
+        self.pausedicon.set_visible(paused)
+
     def get_custom_string(self):
         """If we have a custom string set, return it, otherwise None"""
         if self.label.is_custom():
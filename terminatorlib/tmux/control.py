@@ -1,20 +1,39 @@
 import threading
 import subprocess
-import Queue
+import time
 
+from collections import OrderedDict, namedtuple
 from pipes import quote
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GObject
 
-from terminatorlib.tmux import notifications
+from terminatorlib.tmux.tracker import RequestTracker
+from terminatorlib.tmux.reader import ControlReader, NotificationParser
+from terminatorlib.tmux.modes import MODES_FORMAT
+from terminatorlib.tmux.notifications import PANE_METADATA
+from terminatorlib.config import Config
 from terminatorlib.util import dbg
 
 ESCAPE_CODE = '\033'
 TMUX_BINARY = 'tmux'
+# upper bound of the delay between two attempts to reconnect, in ms
+MAX_RECONNECT_DELAY = 30000
+
+# outcome is 'reattached', 'session gone' or 'gave up'
+ReconnectEvent = namedtuple('ReconnectEvent',
+                            'disconnected_at attempts duration outcome')
 
 def esc(seq):
     return '{}{}'.format(ESCAPE_CODE, seq)
 
 
+HEX_BYTES = ['{:02x}'.format(byte) for byte in xrange(256)]
+
+def hex_keys(content):
+    """Encode content as the space separated hex bytes `send-keys -H` wants,
+    which saves us from having to quote anything for the tmux parser."""
+    return ' '.join([HEX_BYTES[byte] for byte in bytearray(content)])
+
+
 KEY_MAPPINGS = {
     Gdk.KEY_BackSpace: '\b',
     Gdk.KEY_Tab: '\t',
@@ -40,26 +59,84 @@ MOUSE_WHEEL = {
     Gdk.ScrollDirection.UP: "C-y C-y C-y",
     Gdk.ScrollDirection.DOWN: "C-e C-e C-e",
 }
+# mouse report button codes of the wheel, for panes that turned reporting on
+MOUSE_WHEEL_BUTTONS = {
+    Gdk.ScrollDirection.UP: 64,
+    Gdk.ScrollDirection.DOWN: 65,
+}
+PASTE_START = esc('[200~')
+PASTE_END = esc('[201~')
+
+def keypress_keys(event):
+    """The keys to send to a pane for a key press, or None"""
+    keyval = event.keyval
+    state = event.state
+
+    if keyval in KEY_MAPPINGS:
+        key = KEY_MAPPINGS[keyval]
+        if keyval in ARROW_KEYS and state & Gdk.ModifierType.CONTROL_MASK:
+            key = '{}1;5{}'.format(key[:2], key[2:])
+    else:
+        key = event.string
+
+    if state & Gdk.ModifierType.MOD1_MASK:
+        # Hack to have CTRL+SHIFT+Alt PageUp/PageDown/Home/End
+        # work without these silly [... escaped characters
+        if state & (Gdk.ModifierType.CONTROL_MASK |
+                    Gdk.ModifierType.SHIFT_MASK):
+            return None
+        key = esc(key)
+    return key
+
 
 # TODO: implement ssh connection using paramiko
 class TmuxControl(object):
 
-    def __init__(self, session_name, notifications_handler):
+    def __init__(self, session_name, notifications_handler, remote=None):
         self.session_name = session_name
         self.notifications_handler = notifications_handler
+        if notifications_handler is not None:
+            notifications_handler.control = self
+        # pane ids are only unique within one tmux server
+        self.pane_id_to_terminal = {}
+        self.initial_layout = None
         self.tmux = None
         self.output = None
         self.input = None
         self.consumer = None
         self.width = None
         self.height = None
-        self.remote = None
-        self.alternate_on = False
+        self.remote = remote
         self.is_zoomed = False
-        self.requests = Queue.Queue()
+        self.requests = RequestTracker(
+            timeout=Config()['tmux_command_timeout'])
+        self.requests_timer = None
+        self.reader = None
+        self.parser = self.make_parser()
+        self.pending_keys = OrderedDict()
+        self.pending_keys_source = None
+        # reconnecting after losing the control pipe
+        self.reconnecting = False
+        self.reconnect_attempt = 0
+        self.disconnected_at = None
+        self.reconnects = []
 
     def reset(self):
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
         self.tmux = self.input = self.output = self.width = self.height = None
+        self.pending_keys.clear()
+
+    def disconnect(self):
+        """Drop the connection, the next command starts a new one"""
+        tmux = self.tmux
+        self.reset()
+        if tmux is not None and tmux.poll() is None:
+            tmux.kill()
+            tmux.wait()
+        # the answers to what we sent on it won't come
+        self.requests.clear()
 
     def remote_connect(self, command):
         if self.tmux:
@@ -132,9 +209,61 @@ class TmuxControl(object):
                                      stdin=subprocess.PIPE)
             self.input = self.tmux.stdin
             self.output = self.tmux.stdout
-        self.requests.put(notifications.noop)
+        self.requests.add(' '.join(popen_command[2:]), initial=True,
+                          callback=self.reattached if self.reconnecting
+                          else None)
         self.start_notifications_consumer()
-        self.initial_layout()
+        self.enable_flow_control()
+        self.subscribe_pane_metadata()
+        if self.reconnecting:
+            self.reconcile()
+        else:
+            self.initial_layout()
+
+    def reconnect(self):
+        """Schedule another attempt to attach after the control pipe went
+        away, returns False once all attempts are used up"""
+        config = Config()
+        if self.reconnect_attempt >= config['tmux_reconnect_attempts']:
+            if self.reconnecting:
+                self.reconnect_done('gave up')
+            return False
+        if not self.reconnecting:
+            self.reconnecting = True
+            self.disconnected_at = time.time()
+        delay = min(config['tmux_reconnect_delay'] *
+                    2 ** self.reconnect_attempt, MAX_RECONNECT_DELAY)
+        self.reconnect_attempt += 1
+        dbg('Lost the connection to {}, attempt {} to reconnect in {}ms'
+            .format(self, self.reconnect_attempt, delay))
+        GObject.timeout_add(delay, self.do_reconnect)
+        return True
+
+    def do_reconnect(self):
+        self.disconnect()
+        self.notifications_handler.connection_lost()
+        self.attach_session()
+        return False
+
+    def reattached(self, result):
+        self.reconnect_done('reattached')
+
+    def reconnect_done(self, outcome):
+        event = ReconnectEvent(self.disconnected_at, self.reconnect_attempt,
+                               time.time() - self.disconnected_at, outcome)
+        dbg('Reconnecting to {}: {}'.format(self, event))
+        self.reconnects.append(event)
+        self.reconnecting = False
+        self.reconnect_attempt = 0
+
+    def reconcile(self):
+        """Bring the terminals we kept in line with the session we attached
+        to again"""
+        self._run_command(
+            'list-windows -t {} -F "#{{window_id}} #{{window_activity}} '
+            '#{{window_layout}}"'.format(self.session_name),
+            callback=self.notifications_handler.reconcile_result)
+        self.garbage_collect_panes()
 
     def new_session(self, cwd=None, command=None, marker=''):
         popen_command = [TMUX_BINARY, '-2', '-C', 'new-session', '-s', self.session_name,
@@ -154,11 +283,48 @@ class TmuxControl(object):
         # starting a new session, delete any old requests we may have
         # in the queue (e.g. those added while trying to attach to
         # a nonexistant session)
-        with self.requests.mutex:
-            self.requests.queue.clear()
+        self.requests.clear()
 
-        self.requests.put(self.notifications_handler.pane_id_result)
+        self.requests.add(' '.join(popen_command[2:]),
+                          callback=self.notifications_handler.pane_id_result,
+                          initial=True)
         self.start_notifications_consumer()
+        self.enable_flow_control()
+        self.subscribe_pane_metadata()
+
+    def enable_flow_control(self):
+        """Have tmux pause panes whose output is more than tmux_pause_after
+        seconds behind, and send %extended-output with the age of the
+        output (tmux 3.2 or later)"""
+        pause_after = Config()['tmux_pause_after']
+        if pause_after:
+            self._run_command('refresh-client -f pause-after={}'.format(
+                pause_after))
+
+    def subscribe_pane_metadata(self):
+        """Have tmux push PANE_METADATA of every pane as it changes, rather
+        than asking for it (tmux 3.2 or later)"""
+        self._run_commands([
+            ("refresh-client -B '{0}:%*:#{{{0}}}'".format(name), None)
+            for name in PANE_METADATA])
+
+    def pause_pane(self, pane_id):
+        self._run_command("refresh-client -A '{}:pause'".format(pane_id))
+
+    def continue_pane(self, pane_id):
+        self._run_command("refresh-client -A '{}:continue'".format(pane_id))
+
+    def refresh_pane(self, pane_id):
+        """Fetch the visible screen, cursor position and modes of a pane"""
+        self._run_commands([
+            self.pane_modes_command(pane_id),
+            ('display -p -t {0} "#{{cursor_y}} #{{cursor_x}}" ; '
+             'capture-pane -p -t {0} -eC'.format(pane_id),
+             self.notifications_handler.refresh_pane_result(pane_id))])
+
+    def pane_modes_command(self, pane_id):
+        return ('display -p -t {} "{}"'.format(pane_id, MODES_FORMAT),
+                self.notifications_handler.pane_modes_result(pane_id))
 
     def refresh_client(self, width, height):
         dbg('{}::{}: {}x{}'.format("TmuxControl", "refresh_client", width, height))
@@ -173,15 +339,42 @@ class TmuxControl(object):
 
     def initial_layout(self):
         self._run_command(
-            'list-windows -t {} -F "#{{window_layout}}"'
+            'list-windows -t {} -F "#{{window_id}} #{{window_layout}}"'
             .format(self.session_name),
             callback=self.notifications_handler.initial_layout_result)
 
+    def describe_window(self, window_id):
+        self._run_command(
+            'display -p -t {} "#{{window_layout}} #{{window_name}}"'.format(
+                window_id),
+            callback=self.notifications_handler.window_add_result(window_id))
+
+    def list_session_windows(self):
+        self._run_command(
+            'list-windows -t {} -F "#{{window_id}} #{{window_layout}} '
+            '#{{window_name}}"'.format(self.session_name),
+            callback=self.notifications_handler.session_windows_result)
+
     def initial_output(self, pane_id):
+        """Capture the screen and the tail of the history of a pane, the
+        rest is left to the ScrollbackLoader"""
+        self._run_commands([
+            self.pane_modes_command(pane_id),
+            ('display -p -t {0} "#{{history_size}}" ; '
+             'capture-pane -J -p -t {0} -eC -S -{1} -E -'.format(
+                 pane_id, Config()['tmux_scrollback_tail']),
+             self.notifications_handler.scrollback
+             .initial_output_result(pane_id))])
+
+    def capture_history(self, pane_id, start, end, callback):
+        """Capture rows start to end, along with the current history size
+        and the state needed to restore the screen"""
         self._run_command(
-            'capture-pane -J -p -t {} -eC -S - -E -'.format(pane_id),
-            callback=self.notifications_handler.initial_output_result_callback(
-                pane_id))
+            'display -p -t {0} "#{{history_size}} #{{alternate_on}} '
+            '#{{cursor_y}} #{{cursor_x}}" ; '
+            'capture-pane -p -t {0} -eC -S {1} -E {2}'.format(
+                pane_id, start, end),
+            callback=callback)
 
     def toggle_zoom(self, pane_id, zoom=False):
         self.is_zoomed = not self.is_zoomed
@@ -189,111 +382,196 @@ class TmuxControl(object):
             self._run_command('resize-pane -Z -x {} -y {} -t {}'.format(self.width, self.height, pane_id))
 
     def send_keypress(self, event, pane_id):
-        keyval = event.keyval
-        state = event.state
+        self.send_keys(keypress_keys(event), pane_id)
 
-        if keyval in KEY_MAPPINGS:
-            key = KEY_MAPPINGS[keyval]
-            if keyval in ARROW_KEYS and state & Gdk.ModifierType.CONTROL_MASK:
-                key = '{}1;5{}'.format(key[:2], key[2:])
-        else:
-            key = event.string
+    def send_keys(self, key, pane_id):
+        """Send what keypress_keys() made of a key press"""
+        if key is None:
+            return
+        self.notifications_handler.predict_keys(pane_id, key)
+        self.queue_keys(key, pane_id)
+
+    def queue_keys(self, content, pane_id):
+        """Buffer keys for a pane until the main loop goes idle, so that
+        fast typing and broadcast input cost one command per pane instead
+        of one command per key"""
+        if not content:
+            return
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        self.pending_keys.setdefault(pane_id, []).append(content)
+        if self.pending_keys_source is None:
+            self.pending_keys_source = GObject.idle_add(self.on_keys_idle)
+
+    def on_keys_idle(self):
+        self.pending_keys_source = None
+        return self.flush_keys()
+
+    def flush_keys(self):
+        """Send all buffered keys, one `send-keys -H` command per pane"""
+        if self.pending_keys_source is not None:
+            GObject.source_remove(self.pending_keys_source)
+            self.pending_keys_source = None
+        pending = self.pending_keys
+        self.pending_keys = OrderedDict()
+        self._run_commands([
+            ('send-keys -H -t {} {}'.format(pane_id, hex_keys(''.join(keys))),
+             None)
+            for pane_id, keys in pending.iteritems()])
+        return False
 
-        if state & Gdk.ModifierType.MOD1_MASK:
-            # Hack to have CTRL+SHIFT+Alt PageUp/PageDown/Home/End
-            # work without these silly [... escaped characters
-            if state & (Gdk.ModifierType.CONTROL_MASK |
-                        Gdk.ModifierType.SHIFT_MASK):
-                return
+    # Send mouse scrolling events to panes that asked for mouse reports or
+    # have the alternate screen up, otherwise let Terminator scroll
+    def send_mousewheel(self, event, pane_id, column=1, row=1):
+        if event.direction == Gdk.ScrollDirection.SMOOTH:
+            if event.delta_y <= 0.:
+                direction = Gdk.ScrollDirection.UP
             else:
-                key = esc(key)
-
-        if key == ';':
-            key = '\\;'
-
-        self.send_content(key, pane_id)
-
-    # Handle mouse scrolling events if the alternate_screen is visible
-    # otherwise let Terminator handle all the mouse behavior
-    def send_mousewheel(self, event, pane_id):
-        SMOOTH_SCROLL_UP = event.direction == Gdk.ScrollDirection.SMOOTH and event.delta_y <= 0.
-        SMOOTH_SCROLL_DOWN = event.direction == Gdk.ScrollDirection.SMOOTH and event.delta_y > 0.
-        if SMOOTH_SCROLL_UP:
-            wheel = MOUSE_WHEEL[Gdk.ScrollDirection.UP]
-        elif SMOOTH_SCROLL_DOWN:
-            wheel = MOUSE_WHEEL[Gdk.ScrollDirection.DOWN]
+                direction = Gdk.ScrollDirection.DOWN
         else:
-            wheel = MOUSE_WHEEL[event.direction]
-
-        if self.alternate_on:
-            self._run_command("send-keys -t {} {}".format(pane_id, wheel))
+            direction = event.direction
+        if direction not in MOUSE_WHEEL:
+            return False
+
+        modes = self.notifications_handler.modes_of(pane_id)
+        if modes.mouse:
+            button = MOUSE_WHEEL_BUTTONS[direction]
+            if modes.mouse_sgr:
+                report = esc('[<{};{};{}M'.format(button, column, row))
+            else:
+                # the legacy encoding can't go past column or row 223
+                report = esc('[M') + ''.join(
+                    chr(32 + min(value, 223))
+                    for value in (button, column, row))
+            self.queue_keys(report, pane_id)
+            return True
+        if modes.alternate_screen:
+            self.flush_keys()
+            self._run_command("send-keys -t {} {}".format(
+                pane_id, MOUSE_WHEEL[direction]))
             return True
         return False
 
+    def send_paste(self, content, pane_id):
+        """Paste content into a pane, bracketed if the pane asked for it"""
+        if self.notifications_handler.modes_of(pane_id).bracketed_paste:
+            # the pasted text must not be able to end the paste early
+            content = ''.join([PASTE_START, content.replace(PASTE_END, ''),
+                               PASTE_END])
+        self.queue_keys(content, pane_id)
+        self.flush_keys()
+
     def send_content(self, content, pane_id):
+        self.flush_keys()
         key_name_lookup = "-l" if ESCAPE_CODE in content else ""
         quote = "'" if "'" not in content else '"'
         self._run_command("send-keys -t {} {} -- {}{}{}".format(
                 pane_id, key_name_lookup, quote, content, quote))
 
-    def send_quoted_content(self, content, pane_id):
-        key_name_lookup = "-l" if ESCAPE_CODE in content else ""
-        self._run_command("send-keys -t {} {} -- {}".format(
-                pane_id, key_name_lookup, content))
-
     def _run_command(self, command, callback=None):
+        self._run_commands([(command, callback)])
+
+    def _run_commands(self, commands):
+        """Send (command, callback) pairs back to back, in a single write"""
+        if not commands:
+            return
         if not self.input:
-            dbg('No tmux connection. [command={}]'.format(command))
-        else:
-            try:
-                self.input.write('{}\n'.format(command))
-            except IOError:
-                dbg("Tmux server has gone away.")
-                return
-            callback = callback or notifications.noop
-            self.requests.put(callback)
+            dbg('No tmux connection. [commands={}]'.format(commands))
+            return
+        # register first, the answers may arrive before write() returns
+        for command, callback in commands:
+            self.requests.add(command, callback)
+        try:
+            self.input.write(''.join(['{}\n'.format(command)
+                                      for command, _ in commands]))
+        except IOError:
+            dbg("Tmux server has gone away.")
+            return
+        if self.requests_timer is None:
+            self.requests_timer = GObject.timeout_add(1000,
+                                                      self.check_requests)
 
-    @staticmethod
-    def kill_server():
-        command = [TMUX_BINARY, 'kill-session', '-t', 'terminator']
+    def check_requests(self):
+        """Time out requests tmux did not answer"""
+        if self.requests.check_timeouts():
+            return True
+        self.requests_timer = None
+        return False
+
+    def latency_report(self):
+        """Round trip times per command, e.g. for the debug console"""
+        return self.requests.report()
+
+    def local_echo_report(self):
+        """How predictive echo did, e.g. for the debug console"""
+        return self.notifications_handler.local_echo.report()
+
+    def reconnect_report(self):
+        """Past reconnects, e.g. for the debug console"""
+        return '\n'.join(
+            '{} {:<12} after {} attempt(s), {:.1f}s'.format(
+                time.strftime('%H:%M:%S',
+                              time.localtime(event.disconnected_at)),
+                event.outcome, event.attempts, event.duration)
+            for event in self.reconnects)
+
+    def unknown_markers(self):
+        """How many lines of each unknown marker were dropped"""
+        parser = self.reader.parser if self.reader else self.parser
+        return dict(parser.unknown)
+
+    def __str__(self):
+        return '{}:{}'.format(self.remote or 'local', self.session_name)
+
+    def kill_server(self):
+        command = [TMUX_BINARY, 'kill-session', '-t', self.session_name]
+        if self.remote:
+            command = ['ssh', self.remote, ' '.join(map(quote, command))]
         subprocess.call(command)
 
     def start_notifications_consumer(self):
-        self.consumer = threading.Thread(target=self.consume_notifications)
+        if Config()['tmux_reader'] == 'watch':
+            self.reader = ControlReader(self.output,
+                                        self.notifications_handler)
+            self.reader.start()
+            return
+        self.parser = self.make_parser()
+        self.consumer = threading.Thread(target=self.consume_notifications,
+                                         name='tmux {}'.format(self))
         self.consumer.daemon = True
         self.consumer.start()
 
+    def make_parser(self):
+        handler = self.notifications_handler
+        return NotificationParser(handler.dispatch if handler else None)
+
     def consume_notifications(self):
         handler = self.notifications_handler
+        handle = handler.handle
+        parse_line = self.parser.parse_line
+        # a reset may be followed by a new connection before we notice
+        tmux, output = self.tmux, self.output
         while True:
-            try:
-                if self.tmux.poll() is not None:
-                    break
-            except AttributeError as e:
+            if self.tmux is not tmux:
                 dbg("Tmux control instance was reset.")
                 return
-            line = self.output.readline()[:-1]
-            if not line:
+            if tmux.poll() is not None:
+                break
+            notification = parse_line(output.readline()[:-1])
+            if notification is None:
                 continue
-            line = line[1:].split(' ')
-            marker = line[0]
-            line = line[1:]
-            # skip MOTD, anything that isn't coming from tmux control mode
+            # one bad notification must not take the connection down
             try:
-                notification = notifications.notifications_mappings[marker]()
-            except KeyError:
-                dbg("Discarding invalid output from the control terminal.")
-                continue
-            notification.consume(line, self.output)
-            handler.handle(notification)
+                handle(notification)
+            except Exception:
+                handler.handle_failed(notification)
         handler.terminate()
 
-    def display_pane_tty(self, pane_id):
-        tmux_command = 'display -pt "{}" "#D {}"'.format(
-            pane_id, "#{pane_tty}")
-
-        self._run_command(tmux_command,
-                callback=self.notifications_handler.pane_tty_result)
+    def select_layout(self, window_id, window_layout):
+        if self.is_zoomed:
+            return
+        self._run_command("select-layout -t {} '{}'".format(window_id,
+                                                          window_layout))
 
     def resize_pane(self, pane_id, rows, cols):
         if self.is_zoomed:
@@ -1,7 +1,12 @@
-from pyparsing import *
+import re
+from collections import OrderedDict, namedtuple
 
-class LayoutParser():
-    """BNF representation for a Tmux Layout
+ELEMENT = re.compile(r'(\d+)x(\d+),(\d+),(\d+)(?:,(\d+)|([{\[]))?|([}\]])|,')
+CLOSING = {'{': '}', '[': ']'}
+
+
+class LayoutParser(object):
+    """Parser for tmux layout strings
     <layout>        :: <layout_name> <comma> <element>+ ;
     <element>       :: ( <container> | <pane> ) <comma>? ;
     <layout_name>   :: <hexadecimal>{4} ;
@@ -16,83 +21,300 @@ class LayoutParser():
     <decimal-digit> :: "0" | ... | "9" ;
     <hex-digit>     :: <decimal-digit> | "a" | ... | "f" ;
     <comma>         :: "," ;
-    """
-    layout_parser = None
-
-    def __init__(self):
-        decimal = Word(nums)
-
-        comma = Suppress(Literal(','))
-        start_token = Literal('{') | Literal('[')
-        end_token   = Suppress(Literal('}') | Literal(']'))
-
-        layout_name = Suppress(Word(hexnums, min=4, max=4))
-        size        = decimal("width") + Suppress(Literal('x')) + decimal("height")
-
-        preamble    = size + comma + decimal("x") + comma + decimal("y")
-        pane        = Group(preamble + comma + decimal("pane_id"))
-        element     = Forward() # will be defined later
-        container   = Group(preamble + start_token + OneOrMore(element) + end_token)
 
-        element << (container | pane) + Optional(comma)
+    The string is read in a single pass, open containers are kept on a
+    stack. tmux sends the same layout over and over (every %layout-change
+    and list-windows), so results are kept in an LRU cache keyed on the
+    layout_name, which is the checksum of the rest of the string. The
+    returned trees are shared between callers and must not be modified.
+    """
 
-        self.layout_parser = layout_name + comma + OneOrMore(element)
+    def __init__(self, cache_size=64):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
 
     def parse(self, layout):
-        parsed = self.layout_parser.parseString(layout)
-        return parsed.asList()
+        """Return the Container tree described by a tmux layout string"""
+        checksum = layout[:layout.find(',')]
+        cached = self.cache.pop(checksum, None)
+        if cached is None or cached[0] != layout:
+            cached = (layout, parse_layout(layout))
+        self.cache[checksum] = cached
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return cached[1]
+
 
 def parse_layout(layout):
-    """Apply our application logic to the parsed layout.
+    """Parse a tmux layout string, without any caching.
 
     Arguments:
-    layout -- Layout parsed by LayoutParser.parse(),
-              it is represented as a nested list; each nested
-              list has the following format:
-              [0]  : width,
-              [1]  : height,
-              [2]  : position on x axis,
-              [3]  : position on y axis,
-              [4]  : '{' if the current element is a horizontal splits container,
-                     '[' if the current element is a vertical splits container,
-                     '%[0-9]+' if the current element is a pane
-              [5+] : if present, they are nested lists with the same structure
+    layout -- a layout as found in window_layout, e.g.
+              'bb62,159x48,0,0{79x48,0,0,79,79x48,80,0,80}'
 
     """
-    result = []
-
-    children = []
-    for item in layout[5:]:
-        children.extend(parse_layout(item))
-
-    if layout[4] == '{':
-        result.append(Horizontal(
-            layout[0],
-            layout[1],
-            layout[2],
-            layout[3],
-            children
-            ))
-
-    elif layout[4] == '[':
-        result.append(Vertical(
-            layout[0],
-            layout[1],
-            layout[2],
-            layout[3],
-            children
-            ))
+    position = layout.find(',') + 1
+    if not position:
+        raise ValueError('Illegal window layout: {}'.format(layout))
+    end = len(layout)
+    # the children of every open container, plus one list for the result
+    children = [[]]
+    containers = []
+    while position < end:
+        match = ELEMENT.match(layout, position)
+        if match is None:
+            raise ValueError('Illegal window layout at {}: {}'.format(
+                position, layout))
+        position = match.end()
+        width, height, x, y, pane_id, start, stop = match.groups()
+        if start:
+            containers.append((start, int(width), int(height), int(x),
+                               int(y)))
+            children.append([])
+        elif stop:
+            if not containers or CLOSING[containers[-1][0]] != stop:
+                raise ValueError('Unbalanced window layout: {}'.format(
+                    layout))
+            start, width, height, x, y = containers.pop()
+            container_type = Horizontal if start == '{' else Vertical
+            content = children.pop()
+            children[-1].append(container_type(width, height, x, y, content))
+        elif width:
+            if pane_id is None:
+                raise ValueError('Illegal window layout at {}: {}'.format(
+                    position, layout))
+            children[-1].append(Pane(int(width), int(height), int(x), int(y),
+                                     '%' + pane_id))
+    if containers or len(children[0]) != 1:
+        raise ValueError('Unbalanced window layout: {}'.format(layout))
+    return children[0][0]
+
+
+def layout_checksum(layout):
+    """Compute the 4 hex digit checksum tmux puts in front of a layout"""
+    checksum = 0
+    for char in layout:
+        checksum = (checksum >> 1) + ((checksum & 1) << 15)
+        checksum = (checksum + ord(char)) & 0xffff
+    return '{:04x}'.format(checksum)
+
+
+def dump_layout(container):
+    """Return the tmux layout string of a layout tree, checksum included,
+    as select-layout takes it"""
+    body = _dump(container)
+    return '{},{}'.format(layout_checksum(body), body)
+
+
+def _dump(container):
+    preamble = '{}x{},{},{}'.format(container.width, container.height,
+                                    container.x, container.y)
+    if isinstance(container, Pane):
+        return '{},{}'.format(preamble, container.pane_id[1:])
+    opening = '{' if isinstance(container, Horizontal) else '['
+    return '{}{}{}{}'.format(preamble, opening,
+                             ','.join(_dump(child)
+                                      for child in container.children),
+                             CLOSING[opening])
+
+
+def fit_layout(container, width, height, x=0, y=0):
+    """Return a copy of a layout tree laid out over width x height cells.
+
+    Panes keep their sizes where they fit, in every split the difference
+    is made up by the last children, like tmux does when a window is
+    resized. Only the sizes of the panes matter in the tree given, those of
+    the containers and all positions are worked out here.
+    """
+    if isinstance(container, Pane):
+        return Pane(width, height, x, y, container.pane_id)
+    horizontal = isinstance(container, Horizontal)
+    children = container.children
+    sizes = [_natural_size(child)[0 if horizontal else 1]
+             for child in children]
+    # a one cell border between every two children
+    excess = sum(sizes) + len(sizes) - 1 - (width if horizontal else height)
+    for index in reversed(xrange(len(sizes))):
+        if excess <= 0:
+            break
+        taken = min(excess, sizes[index] - 1)
+        sizes[index] -= taken
+        excess -= taken
+    if excess > 0:
+        raise ValueError('{} panes do not fit in {}x{}'.format(
+            len(list(iter_panes(container))), width, height))
+    sizes[-1] -= excess
+    fitted = []
+    offset = x if horizontal else y
+    for child, size in zip(children, sizes):
+        if horizontal:
+            fitted.append(fit_layout(child, size, height, offset, y))
+        else:
+            fitted.append(fit_layout(child, width, size, x, offset))
+        offset += size + 1
+    return type(container)(width, height, x, y, fitted)
+
+
+def layouts_close(container, other, cells=1):
+    """Whether two layout trees split the same panes the same way, with
+    sizes at most cells apart: as close as terminals following a tmux
+    layout get to it, GTK rounding the pane sizes its own way"""
+    if type(container) is not type(other) or \
+       abs(container.width - other.width) > cells or \
+       abs(container.height - other.height) > cells:
+        return False
+    if isinstance(container, Pane):
+        return container.pane_id == other.pane_id
+    return len(container.children) == len(other.children) and \
+        all(layouts_close(child, other_child, cells)
+            for child, other_child in zip(container.children,
+                                          other.children))
+
+
+def _natural_size(container):
+    """The width and height a tree needs to give each pane its size"""
+    if isinstance(container, Pane):
+        return container.width, container.height
+    sizes = [_natural_size(child) for child in container.children]
+    borders = len(sizes) - 1
+    if isinstance(container, Horizontal):
+        return (sum(width for width, _ in sizes) + borders,
+                max(height for _, height in sizes))
+    return (max(width for width, _ in sizes),
+            sum(height for _, height in sizes) + borders)
+
+
+# Operations needed to turn one layout of a window into the next one
+PaneAdded = namedtuple('PaneAdded', 'pane_id neighbour vertical before')
+PaneRemoved = namedtuple('PaneRemoved', 'pane_id')
+PaneResized = namedtuple('PaneResized', 'pane_id width height')
+RatioChanged = namedtuple('RatioChanged', 'first second vertical')
+
+
+def iter_panes(container):
+    """Yield the panes of a layout tree, in order"""
+    if isinstance(container, Pane):
+        yield container
     else:
-        result.append(Pane(
-            layout[0],
-            layout[1],
-            layout[2],
-            layout[3],
-            "%{}".format(layout[4])
-            ))
+        for child in container.children:
+            for pane in iter_panes(child):
+                yield pane
+
+
+def _first_pane(container):
+    while not isinstance(container, Pane):
+        container = container.children[0]
+    return container
+
 
+def _last_pane(container):
+    while not isinstance(container, Pane):
+        container = container.children[-1]
+    return container
+
+
+def _containers(container, result):
+    """Map the pane ids below each split container to that container"""
+    if not isinstance(container, Pane):
+        result[tuple(pane.pane_id for pane in iter_panes(container))] = \
+            container
+        for child in container.children:
+            _containers(child, result)
     return result
 
+
+def _split_sizes(container):
+    if isinstance(container, Vertical):
+        return [child.height for child in container.children]
+    return [child.width for child in container.children]
+
+
+def _split_ratios(container):
+    """Split ratios of the chain of two way Paneds a container turns into"""
+    sizes = _split_sizes(container)
+    ratios = []
+    for index in xrange(len(sizes) - 1):
+        # the rest of the container, with a one cell separator between panes
+        remaining = sum(sizes[index:]) + len(sizes) - index - 1
+        ratios.append(float(sizes[index]) / (remaining - 1))
+    return ratios
+
+
+def diff_layouts(old, new):
+    """Return the operations that turn the old layout tree into the new one.
+
+    A RatioChanged names the first panes on either side of a split whose
+    position moved. They are only reported for splits whose overall size
+    stayed the same; when the whole window is resized tmux just scales the
+    panes and the Paneds follow on their own.
+    """
+    operations = []
+    old_panes = dict((pane.pane_id, pane) for pane in iter_panes(old))
+    new_panes = dict((pane.pane_id, pane) for pane in iter_panes(new))
+
+    for pane_id in old_panes:
+        if pane_id not in new_panes:
+            operations.append(PaneRemoved(pane_id))
+
+    known = set(pane_id for pane_id in old_panes if pane_id in new_panes)
+    while len(known) < len(new_panes):
+        count = len(known)
+        _find_added(new, known, operations)
+        if len(known) == count:
+            break
+
+    for pane_id, pane in new_panes.iteritems():
+        previous = old_panes.get(pane_id)
+        if previous and (previous.width != pane.width or
+                         previous.height != pane.height):
+            operations.append(PaneResized(pane_id, pane.width, pane.height))
+
+    old_containers = _containers(old, {})
+    for key, container in _containers(new, {}).iteritems():
+        previous = old_containers.get(key)
+        vertical = isinstance(container, Vertical)
+        ratios = _split_ratios(container)
+        if previous is not None and type(previous) is type(container):
+            if sum(_split_sizes(previous)) != sum(_split_sizes(container)):
+                continue
+            old_ratios = _split_ratios(previous)
+        else:
+            old_ratios = [None] * len(ratios)
+        children = container.children
+        for index, ratio in enumerate(ratios):
+            if ratio != old_ratios[index]:
+                operations.append(RatioChanged(
+                    _first_pane(children[index]).pane_id,
+                    _first_pane(children[index + 1]).pane_id,
+                    vertical))
+    return operations
+
+
+def _find_added(container, known, operations):
+    """Report the panes not in known, each next to a pane that is"""
+    if isinstance(container, Pane):
+        return
+    children = container.children
+    vertical = isinstance(container, Vertical)
+    for index, child in enumerate(children):
+        if not isinstance(child, Pane):
+            _find_added(child, known, operations)
+            continue
+        if child.pane_id in known:
+            continue
+        neighbour = before = None
+        if index > 0:
+            neighbour = _last_pane(children[index - 1]).pane_id
+            before = False
+        if (neighbour not in known and index + 1 < len(children)):
+            neighbour = _first_pane(children[index + 1]).pane_id
+            before = True
+        if neighbour in known:
+            operations.append(PaneAdded(child.pane_id, neighbour, vertical,
+                                        before))
+            known.add(child.pane_id)
+
+
 def convert_to_terminator_layout(window_layouts):
     assert len(window_layouts) > 0
     result = {}
@@ -0,0 +1,101 @@
+"""Terminal modes of tmux panes, as set by the programs running in them.
+
+Whether the wheel scrolls Terminator's scrollback or is sent to the pane,
+and whether a paste is bracketed, depends on DEC private modes the program
+in the pane turned on with `ESC [ ? Pn h` and off with `ESC [ ? Pn l`.
+PaneModes follows them through the output of one pane, chunk by chunk, and
+is seeded from tmux's own view of the pane (MODES_FORMAT) whenever we
+capture its screen.
+"""
+
+import re
+
+ALTERNATE_SCREEN_MODES = frozenset([47, 1047, 1049])
+MOUSE_REPORTING_MODES = frozenset([9, 1000, 1002, 1003])
+MOUSE_SGR_MODE = 1006
+BRACKETED_PASTE_MODE = 2004
+TRACKED_MODES = ALTERNATE_SCREEN_MODES | MOUSE_REPORTING_MODES | \
+    frozenset([MOUSE_SGR_MODE, BRACKETED_PASTE_MODE])
+
+# `ESC [ ? Pn ; ... h|l`, or `ESC c` which resets everything
+MODE_SEQUENCE = re.compile(r'\033(?:\[\?([0-9;]*)([hl])|c)')
+# the start of one of those, cut off by the end of a chunk
+PARTIAL_SEQUENCE = re.compile(r'\033(?:\[(?:\?[0-9;]*)?)?\Z')
+# longest partial sequence worth holding back
+MAX_PARTIAL = 32
+
+# tmux has no format for bracketed paste, that one is only learnt from output
+MODES_FORMAT = ('#{alternate_on} #{mouse_standard_flag} #{mouse_button_flag} '
+                '#{mouse_any_flag} #{mouse_sgr_flag}')
+
+
+class PaneModes(object):
+    """Modes of one pane, fed its decoded output"""
+
+    __slots__ = ['enabled', 'pending', 'alternate_screen', 'mouse',
+                 'mouse_sgr', 'bracketed_paste']
+
+    def __init__(self):
+        self.enabled = set()
+        self.pending = ''
+        self.alternate_screen = False
+        self.mouse = False
+        self.mouse_sgr = False
+        self.bracketed_paste = False
+
+    def feed(self, data):
+        if self.pending:
+            data = self.pending + data
+            self.pending = ''
+        if '\033[?' in data or '\033c' in data:
+            enabled = self.enabled
+            for match in MODE_SEQUENCE.finditer(data):
+                params, action = match.groups()
+                if action is None:
+                    enabled.clear()
+                    continue
+                for param in params.split(';'):
+                    if not param.isdigit():
+                        continue
+                    mode = int(param)
+                    if mode not in TRACKED_MODES:
+                        continue
+                    if action == 'h':
+                        enabled.add(mode)
+                    else:
+                        enabled.discard(mode)
+            self.update()
+        tail = data.find('\033', max(len(data) - MAX_PARTIAL, 0))
+        while tail != -1:
+            if PARTIAL_SEQUENCE.match(data, tail):
+                self.pending = data[tail:]
+                break
+            tail = data.find('\033', tail + 1)
+
+    def seed(self, flags):
+        """Take the modes from MODES_FORMAT expanded by tmux"""
+        flags = [flag == '1' for flag in flags.split(' ')]
+        alternate_on, standard, button, any_event, sgr = \
+            (flags + [False] * 5)[:5]
+        enabled = self.enabled
+        enabled.difference_update(ALTERNATE_SCREEN_MODES |
+                                  MOUSE_REPORTING_MODES)
+        enabled.discard(MOUSE_SGR_MODE)
+        if alternate_on:
+            enabled.add(1049)
+        for mode, on in ((1000, standard), (1002, button), (1003, any_event),
+                         (MOUSE_SGR_MODE, sgr)):
+            if on:
+                enabled.add(mode)
+        self.update()
+
+    def update(self):
+        enabled = self.enabled
+        self.alternate_screen = not enabled.isdisjoint(ALTERNATE_SCREEN_MODES)
+        self.mouse = not enabled.isdisjoint(MOUSE_REPORTING_MODES)
+        self.mouse_sgr = MOUSE_SGR_MODE in enabled
+        self.bracketed_paste = BRACKETED_PASTE_MODE in enabled
+
+
+# modes of a pane we have not seen any output of yet
+DEFAULT_MODES = PaneModes()
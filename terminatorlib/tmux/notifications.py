@@ -1,18 +1,32 @@
 from gi.repository import GObject
 
-from terminatorlib.util import dbg
+from terminatorlib.util import dbg, err, enumerate_descendants
+from terminatorlib.factory import Factory
 from terminatorlib.tmux import layout
+from terminatorlib.tmux.scrollback import ScrollbackLoader
+from terminatorlib.tmux.modes import PaneModes, DEFAULT_MODES
+from terminatorlib.tmux.prediction import LocalEcho
+from terminatorlib.tmux.output import unescape, parse_output_line, \
+    parse_extended_output_line, OutputQueue
 
 import string
-ATTACH_ERROR_STRINGS = ["can't find session terminator", "no current session", "no sessions"]
-ALTERNATE_SCREEN_ENTER_CODES = [ "\\033[?1049h" ]
-ALTERNATE_SCREEN_EXIT_CODES  = [ "\\033[?1049l" ]
-
+import traceback
+ATTACH_ERROR_STRINGS = ["can't find session", "no current session", "no sessions"]
+# after reconnecting, redraw the panes of windows with output since this many
+# seconds before the connection was lost
+RECONNECT_ACTIVITY_MARGIN = 2
+# formats of every pane tmux pushes to us whenever they change, each one is
+# a subscription of the same name
+PANE_METADATA = ['pane_current_path', 'pane_current_command', 'pane_title',
+                 'pane_pid']
+
+# marker -> Notification class parsing the rest of the line
 notifications_mappings = {}
 
 
 def notification(cls):
     notifications_mappings[cls.marker] = cls
+    cls.handler_name = 'handle_{}'.format(cls.marker.replace('-', '_'))
     return cls
 
 
@@ -20,6 +34,9 @@ class Notification(object):
 
     marker = 'undefined'
     attributes = []
+    __slots__ = attributes
+    # the NotificationsHandler method handling it, set by @notification
+    handler_name = None
 
     def consume(self, line, out):
         pass
@@ -34,29 +51,83 @@ class Notification(object):
 class Result(Notification):
 
     marker = 'begin'
-    attributes = ['begin_timestamp', 'code', 'result', 'end_timestamp',
-                  'error']
+    attributes = ['begin_timestamp', 'code', 'flags', 'result',
+                  'end_timestamp', 'error']
+    __slots__ = attributes + ['embedded']
 
     def consume(self, line, out):
-        timestamp, code, _ = line
-        self.begin_timestamp = timestamp
-        self.code = code
+        self.start(line)
         result = []
         line = out.readline()[:-1]
-        while not (line.startswith('%end') or line.startswith('%error')):
-            result.append(line)
+        while not is_block_end(line):
+            notification = flow_control_notification(line)
+            if notification is None:
+                result.append(line)
+            else:
+                self.embedded.append(notification)
             line = out.readline()[:-1]
+        self.finish(result, line)
+
+    def start(self, line):
+        timestamp, code, flags = line
+        self.begin_timestamp = timestamp
+        self.code = code
+        self.flags = flags
+        # %pause/%continue may show up inside the block of the
+        # refresh-client command that caused them
+        self.embedded = []
+
+    def finish(self, result, line):
         self.result = result
         end, timestamp, code, _ = line.split(' ')
         self.end_timestamp = timestamp
         self.error = end == '%error'
 
 
+def is_block_end(line):
+    return line.startswith('%end') or line.startswith('%error')
+
+
+@notification
+class BlockEnd(Notification):
+    """An %end outside of any block, the %begin before it was lost"""
+
+    marker = 'end'
+    attributes = ['end_timestamp', 'code', 'flags']
+    __slots__ = attributes
+
+    def consume(self, line, *args):
+        timestamp, code, flags = line
+        self.end_timestamp = timestamp
+        self.code = code
+        self.flags = flags
+
+
+@notification
+class BlockError(BlockEnd):
+    """An %error outside of any block"""
+
+    marker = 'error'
+
+
+def flow_control_notification(line):
+    """Parse a %pause/%continue line found inside a result block"""
+    if not (line.startswith('%pause %') or line.startswith('%continue %')):
+        return None
+    line = line[1:].split(' ')
+    if len(line) != 2:
+        return None
+    notification = notifications_mappings[line[0]]()
+    notification.consume(line[1:])
+    return notification
+
+
 @notification
 class Exit(Notification):
 
     marker = 'exit'
     attributes = ['reason']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         self.reason = line[0] if line else None
@@ -68,6 +139,7 @@ class LayoutChange(Notification):
     marker = 'layout-change'
     attributes = ['window_id', 'window_layout', 'window_visible_layout',
                   'window_flags']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         # attributes not present default to None
@@ -82,23 +154,66 @@ class Output(Notification):
 
     marker = 'output'
     attributes = ['pane_id', 'output']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         pane_id = line[0]
-        output = ' '.join(line[1:])
+        output = unescape(' '.join(line[1:]))
         self.pane_id = pane_id
         self.output = output
 
+    def consume_raw(self, line):
+        """Consume the undivided %output line, skipping the split/join"""
+        self.pane_id, self.output = parse_output_line(line)
+
+@notification
+class ExtendedOutput(Output):
+
+    marker = 'extended-output'
+    attributes = ['pane_id', 'age', 'output']
+    __slots__ = ['age']
+
+    def consume(self, line, *args):
+        separator = line.index(':', 2)
+        self.pane_id = line[0]
+        self.age = int(line[1])
+        self.output = unescape(' '.join(line[separator + 1:]))
+
+    def consume_raw(self, line):
+        self.pane_id, self.age, self.output = parse_extended_output_line(line)
+
+@notification
+class Pause(Notification):
+
+    marker = 'pause'
+    attributes = ['pane_id']
+    __slots__ = attributes
+
+    def consume(self, line, *args):
+        pane_id, = line
+        self.pane_id = pane_id
+
+@notification
+class Continue(Notification):
+
+    marker = 'continue'
+    attributes = ['pane_id']
+    __slots__ = attributes
+
+    def consume(self, line, *args):
+        pane_id, = line
+        self.pane_id = pane_id
+
 @notification
 class SessionChanged(Notification):
 
     marker = 'session-changed'
     attributes = ['session_id', 'session_name']
+    __slots__ = attributes
 
     def consume(self, line, *args):
-        session_id, session_name = line
-        self.session_id = session_id
-        self.session_name = session_name
+        self.session_id = line[0]
+        self.session_name = ' '.join(line[1:])
 
 
 @notification
@@ -106,11 +221,11 @@ class SessionRenamed(Notification):
 
     marker = 'session-renamed'
     attributes = ['session_id', 'session_name']
+    __slots__ = attributes
 
     def consume(self, line, *args):
-        session_id, session_name = line
-        self.session_id = session_id
-        self.session_name = session_name
+        self.session_id = line[0]
+        self.session_name = ' '.join(line[1:])
 
 
 @notification
@@ -118,6 +233,7 @@ class SessionsChanged(Notification):
 
     marker = 'sessions-changed'
     attributes = []
+    __slots__ = attributes
 
 
 @notification
@@ -125,6 +241,7 @@ class UnlinkedWindowAdd(Notification):
 
     marker = 'unlinked-window-add'
     attributes = ['window_id']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         window_id, = line
@@ -136,6 +253,7 @@ class WindowAdd(Notification):
 
     marker = 'window-add'
     attributes = ['window_id']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         window_id, = line
@@ -147,6 +265,7 @@ class UnlinkedWindowClose(Notification):
 
     marker = 'unlinked-window-close'
     attributes = ['window_id']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         window_id, = line
@@ -158,6 +277,7 @@ class WindowClose(Notification):
 
     marker = 'window-close'
     attributes = ['window_id']
+    __slots__ = attributes
 
     def consume(self, line, *args):
         window_id, = line
@@ -169,11 +289,11 @@ class UnlinkedWindowRenamed(Notification):
 
     marker = 'unlinked-window-renamed'
     attributes = ['window_id', 'window_name']
+    __slots__ = attributes
 
     def consume(self, line, *args):
-        window_id, window_name = line
-        self.window_id = window_id
-        self.window_name = window_name
+        self.window_id = line[0]
+        self.window_name = ' '.join(line[1:])
 
 
 @notification
@@ -181,97 +301,602 @@ class WindowRenamed(Notification):
 
     marker = 'window-renamed'
     attributes = ['window_id', 'window_name']
+    __slots__ = attributes
 
     def consume(self, line, *args):
-        window_id, window_name = line
-        self.window_id = window_id
-        self.window_name = window_name
+        self.window_id = line[0]
+        self.window_name = ' '.join(line[1:])
+
+
+@notification
+class SubscriptionChanged(Notification):
+
+    marker = 'subscription-changed'
+    attributes = ['name', 'session_id', 'window_id', 'window_index',
+                  'pane_id', 'value']
+    __slots__ = attributes
+
+    def consume(self, line, *args):
+        self.name, self.session_id, self.window_id, self.window_index, \
+            self.pane_id = line[:5]
+        # more arguments may come before the separator in later versions
+        self.value = ' '.join(line[line.index(':', 5) + 1:])
 
 
 class NotificationsHandler(object):
 
     def __init__(self, terminator):
         self.terminator = terminator
+        # the TmuxControl connection this handler reads for
+        self.control = None
         self.layout_parser = layout.LayoutParser()
+        self.window_layouts = {}
+        # windows the initial layout was made of, they get their tabs then
+        self.initial_window_ids = set()
+        self.layout_operations = {
+            layout.PaneRemoved: self.remove_pane,
+            layout.PaneAdded: self.add_pane,
+            layout.RatioChanged: self.set_split_ratio,
+        }
+        self.output_queue = OutputQueue(
+            self.feed_output,
+            max_bytes_per_tick=terminator.config['tmux_output_max_bytes_per_tick'],
+            reset=self.reset_terminal)
+        self.scrollback = ScrollbackLoader(
+            self, tail=terminator.config['tmux_scrollback_tail'],
+            chunk_size=terminator.config['tmux_scrollback_chunk'],
+            mode=terminator.config['tmux_scrollback_hydration'])
+        # flow control: panes tmux stopped sending output for, and panes
+        # we asked it to pause
+        self.throttle_age = terminator.config['tmux_throttle_age']
+        self.paused_panes = set()
+        self.pausing_panes = set()
+        # pane id -> PaneModes, fed from the reader
+        self.pane_modes = {}
+        # pane id -> {format: value}, pushed by tmux for PANE_METADATA
+        self.pane_metadata = {}
+        self.local_echo = LocalEcho(terminator.config['tmux_predictive_echo'])
+        # tmux said goodbye with %exit, the connection isn't just lost
+        self.exited = False
+        # marker -> handler method, notifications we have no handler for
+        # are dropped
+        self.dispatch = {}
+        for marker, cls in notifications_mappings.iteritems():
+            handler_method = getattr(self, cls.handler_name, None)
+            if handler_method is not None:
+                self.dispatch[marker] = handler_method
+
+    def handle_batch(self, notifications):
+        """Handle notifications parsed from one read of the control pipe"""
+        dispatch = self.dispatch
+        for notification in notifications:
+            handler_method = dispatch.get(notification.marker)
+            if handler_method is not None:
+                try:
+                    handler_method(notification)
+                except Exception:
+                    self.handle_failed(notification)
+
+    def handle_failed(self, notification):
+        """Log the exception handling notification raised"""
+        err('NotificationsHandler::handle_failed: {} failed:\n{}'.format(
+            notification, traceback.format_exc()))
 
     def handle(self, notification):
-        try:
-            handler_method = getattr(self, 'handle_{}'.format(
-                    notification.marker.replace('-', '_')))
+        handler_method = self.dispatch.get(notification.marker)
+        if handler_method is not None:
             handler_method(notification)
-        except AttributeError:
-            pass
 
     def handle_begin(self, notification):
         dbg('### {}'.format(notification))
         assert isinstance(notification, Result)
-        callback = self.terminator.tmux_control.requests.get()
+        for embedded in notification.embedded:
+            self.handle(embedded)
+        request = self.control.requests.complete(notification)
         if notification.error:
             dbg('Request error: {}'.format(notification))
-            if notification.result[0] in ATTACH_ERROR_STRINGS:
+            if notification.result and \
+               notification.result[0].startswith(tuple(ATTACH_ERROR_STRINGS)):
+                self.control.reset()
+                if self.control.reconnecting:
+                    # the session ended while we were away
+                    self.control.reconnect_done('session gone')
+                    self.exited = True
+                    self.terminate()
+                    return
                 # if we got here it means that attaching to an existing session
                 # failed, invalidate the layout so the Terminator initialization
                 # can pick up from where we left off
-                self.terminator.initial_layout = {}
-                self.terminator.tmux_control.reset()
+                self.control.initial_layout = {}
+                self.terminator.collect_tmux_layouts()
             return
-        callback(notification.result)
+        if request is not None and request.callback is not None:
+            request.callback(request.result)
+
+    def handle_end(self, notification):
+        assert isinstance(notification, BlockEnd)
+        dbg('Block without a begin: {}'.format(notification))
+        self.control.requests.lost(notification.code, notification.flags)
+
+    handle_error = handle_end
+
+    def handle_exit(self, notification):
+        assert isinstance(notification, Exit)
+        self.exited = True
+
+    def connection_lost(self):
+        """Forget the state of the client we lost, before reconnecting"""
+        self.exited = False
+        self.paused_panes.clear()
+        self.pausing_panes.clear()
 
     def handle_output(self, notification):
         assert isinstance(notification, Output)
-        pane_id = notification.pane_id
         output = notification.output
-        terminal = self.terminator.pane_id_to_terminal.get(pane_id)
-        if not terminal:
-            return
-        for code in ALTERNATE_SCREEN_ENTER_CODES:
-            if code in output:
-                self.terminator.tmux_control.alternate_on = True
-        for code in ALTERNATE_SCREEN_EXIT_CODES:
-            if code in output:
-                self.terminator.tmux_control.alternate_on = False
+        modes = self.pane_modes.get(notification.pane_id)
+        if modes is None:
+            modes = self.pane_modes[notification.pane_id] = PaneModes()
+        modes.feed(output)
         # NOTE: using neovim, enabling visual-bell and setting t_vb empty results in incorrect
         # escape sequences (C-g) being printed in the neovim window; remove them until we can
         # figure out the root cause
-        terminal.vte.feed(output.decode('string_escape').replace("\033g",""))
+        self.output_queue.put(notification.pane_id, output.replace("\033g",""))
+
+    def handle_extended_output(self, notification):
+        assert isinstance(notification, ExtendedOutput)
+        pane_id = notification.pane_id
+        if self.throttle_age and notification.age > self.throttle_age and \
+           pane_id not in self.pausing_panes and \
+           pane_id not in self.paused_panes and \
+           pane_id != self.focused_pane_id():
+            # a background pane is flooding the control pipe, stop it
+            # until the user looks at it so the other panes keep up
+            dbg('Pausing {}, output is {}ms behind'.format(
+                pane_id, notification.age))
+            self.pausing_panes.add(pane_id)
+            self.control.pause_pane(pane_id)
+        self.handle_output(notification)
+
+    def handle_pause(self, notification):
+        assert isinstance(notification, Pause)
+        pane_id = notification.pane_id
+        self.pausing_panes.discard(pane_id)
+        self.paused_panes.add(pane_id)
+        self.output_queue.discard(pane_id)
+        if pane_id == self.focused_pane_id():
+            # tmux gave up on the pane being looked at, skip to its
+            # current contents rather than leave it frozen
+            self.control.continue_pane(pane_id)
+        else:
+            GObject.idle_add(self.show_paused, pane_id, True)
+
+    def handle_continue(self, notification):
+        assert isinstance(notification, Continue)
+        pane_id = notification.pane_id
+        self.paused_panes.discard(pane_id)
+        GObject.idle_add(self.show_paused, pane_id, False)
+        # whatever was produced while paused is gone, redraw the screen
+        self.control.refresh_pane(pane_id)
+
+    def handle_subscription_changed(self, notification):
+        assert isinstance(notification, SubscriptionChanged)
+        pane_id = notification.pane_id
+        if notification.name not in PANE_METADATA or \
+           not pane_id.startswith('%'):
+            return
+        metadata = self.pane_metadata.setdefault(pane_id, {})
+        if metadata.get(notification.name) == notification.value:
+            return
+        metadata[notification.name] = notification.value
+        GObject.idle_add(self.apply_pane_metadata, pane_id)
+
+    def pane_registered(self, pane_id):
+        """Catch a new terminal up with what tmux pushed about its pane
+        before we knew which terminal that is"""
+        if pane_id in self.pane_metadata:
+            GObject.idle_add(self.apply_pane_metadata, pane_id)
+
+    def apply_pane_metadata(self, pane_id):
+        terminal = self.control.pane_id_to_terminal.get(pane_id)
+        metadata = self.pane_metadata.get(pane_id)
+        if not terminal or not metadata:
+            return False
+        terminal.set_cwd(metadata.get('pane_current_path'))
+        terminal.pid = metadata.get('pane_pid', terminal.pid)
+        title = (metadata.get('pane_title', terminal.pane_title),
+                 metadata.get('pane_current_command', terminal.command))
+        if title != (terminal.pane_title, terminal.command):
+            terminal.pane_title, terminal.command = title
+            terminal.emit('title-change', terminal.get_window_title())
+        return False
+
+    def focused_pane_id(self):
+        """The pane of the focused terminal, if it is one of ours"""
+        terminal = self.terminator.last_focused_term
+        if getattr(terminal, 'control', None) is not self.control:
+            return None
+        return terminal.pane_id
+
+    def resume_pane(self, pane_id):
+        """Continue a paused pane, called when it gets the focus"""
+        if pane_id in self.paused_panes or pane_id in self.pausing_panes:
+            self.pausing_panes.discard(pane_id)
+            self.control.continue_pane(pane_id)
+
+    def show_paused(self, pane_id, paused):
+        terminal = self.control.pane_id_to_terminal.get(pane_id)
+        if terminal:
+            terminal.titlebar.icon_paused(paused)
+        return False
+
+    def modes_of(self, pane_id):
+        return self.pane_modes.get(pane_id, DEFAULT_MODES)
+
+    def pane_modes_result(self, pane_id):
+        def result_callback(result):
+            modes = self.pane_modes.get(pane_id)
+            if modes is None:
+                modes = self.pane_modes[pane_id] = PaneModes()
+            modes.seed(result[0])
+        return result_callback
+
+    def refresh_pane_result(self, pane_id):
+        def result_callback(result):
+            cursor, screen = result[0], result[1:]
+            row, column = cursor.split(' ')
+            output = '\r\n'.join(screen).decode('string_escape')
+            self.output_queue.put(pane_id, '\033[H\033[2J{}\033[{};{}H'.format(
+                output, int(row) + 1, int(column) + 1))
+        return result_callback
+
+    def feed_output(self, pane_id, output):
+        """Feed queued output to a pane's terminal, runs in the main loop"""
+        terminal = self.control.pane_id_to_terminal.get(pane_id)
+        if not terminal:
+            return
+        if self.local_echo.enabled:
+            self.local_echo.feed(pane_id, terminal.vte, output)
+        else:
+            terminal.vte.feed(output)
+
+    def predict_keys(self, pane_id, keys):
+        """Show keys typed into a pane before tmux echoes them, if asked
+        to, runs in the main loop"""
+        if self.local_echo.enabled:
+            terminal = self.control.pane_id_to_terminal.get(pane_id)
+            self.local_echo.predict(pane_id, keys,
+                                    terminal and terminal.vte,
+                                    self.modes_of(pane_id))
+
+    def reset_terminal(self, pane_id):
+        """Clear a pane's terminal before it is fed its whole history,
+        keeping the view at the same distance from the bottom"""
+        terminal = self.control.pane_id_to_terminal.get(pane_id)
+        if not terminal:
+            return
+        adjustment = terminal.vte.get_vadjustment()
+        distance = adjustment.get_upper() - adjustment.get_value()
+        self.local_echo.discard(pane_id)
+        terminal.vte.reset(True, True)
+        def restore():
+            adjustment.set_value(max(adjustment.get_upper() - distance,
+                                     adjustment.get_lower()))
+            return False
+        GObject.idle_add(restore)
 
     def handle_layout_change(self, notification):
         assert isinstance(notification, LayoutChange)
-        GObject.idle_add(self.terminator.tmux_control.garbage_collect_panes)
+        window_id = notification.window_id
+        try:
+            window_layout = self.layout_parser.parse(notification.window_layout)
+        except ValueError:
+            dbg('Unparsable layout: {}'.format(notification))
+            window_layout = None
+        self.update_window_layout(window_id, window_layout)
+
+    def update_window_layout(self, window_id, window_layout):
+        """Make our terminals follow the new layout of a window"""
+        previous = self.window_layouts.get(window_id)
+        self.window_layouts[window_id] = window_layout
+        if previous is None or window_layout is None:
+            GObject.idle_add(self.control.garbage_collect_panes)
+            return
+        if previous is window_layout:
+            # the parser cache handed back the very same tree
+            return
+        operations = layout.diff_layouts(previous, window_layout)
+        if operations:
+            GObject.idle_add(self.apply_layout_operations, operations,
+                             window_layout)
+
+    def push_layouts(self, terminals):
+        """Have tmux lay out the windows of these resized terminals like we
+        do, one select-layout per window, or one resize-pane per terminal
+        whose window we can't describe"""
+        # the reader thread changes window_layouts, work from a copy
+        window_layouts = dict(self.window_layouts.items())
+        pane_windows = dict((pane.pane_id, window_id)
+                            for window_id, window_layout
+                            in window_layouts.iteritems()
+                            if window_layout is not None
+                            for pane in layout.iter_panes(window_layout))
+        windows = {}
+        for terminal in terminals:
+            window_id = pane_windows.get(terminal.pane_id)
+            windows.setdefault(window_id, []).append(terminal)
+        for window_id, resized in windows.iteritems():
+            if window_id is not None and \
+               self.push_layout(window_id, window_layouts[window_id],
+                                tab_root(resized[0])):
+                continue
+            for terminal in resized:
+                columns, rows = terminal.get_size()
+                self.control.resize_pane(terminal.pane_id, rows, columns)
+
+    def push_layout(self, window_id, window_layout, widget):
+        tree = widget_layout(widget)
+        if tree is None or \
+           set(pane.pane_id for pane in layout.iter_panes(tree)) != \
+           set(pane.pane_id for pane in layout.iter_panes(window_layout)):
+            dbg('Terminals of {} do not match its panes'.format(window_id))
+            return False
+        try:
+            tree = layout.fit_layout(tree, window_layout.width,
+                                     window_layout.height)
+        except ValueError as e:
+            dbg('Cannot lay out {}: {}'.format(window_id, e))
+            return False
+        if layout.layouts_close(tree, window_layout):
+            # the terminals follow the last layout tmux sent, pushing what
+            # GTK rounded it to would only have tmux send it back
+            dbg('{} is laid out as tmux has it'.format(window_id))
+            return True
+        self.control.select_layout(window_id, layout.dump_layout(tree))
+        return True
+
+    def pane_sizes(self):
+        """The (columns, rows) of every pane, as of the last layouts tmux
+        sent"""
+        # values() copies, the reader thread may change window_layouts
+        return dict((pane.pane_id, (pane.width, pane.height))
+                    for window_layout in self.window_layouts.values()
+                    if window_layout is not None
+                    for pane in layout.iter_panes(window_layout))
+
+    def handle_window_add(self, notification):
+        assert isinstance(notification, WindowAdd)
+        # answered after whatever we sent before, so a window we made
+        # ourselves has its pane registered by then
+        self.control.describe_window(notification.window_id)
+
+    def window_add_result(self, window_id):
+        def result_callback(result):
+            window_layout, window_name = (result[0].split(' ', 1) + [''])[:2]
+            self.add_window(window_id, window_layout, window_name)
+        return result_callback
+
+    def add_window(self, window_id, window_layout, window_name):
+        if window_id in self.initial_window_ids:
+            return
+        try:
+            window_layout = self.layout_parser.parse(window_layout)
+        except ValueError:
+            dbg('Unparsable layout of {}: {}'.format(window_id,
+                                                     window_layout))
+            return
+        self.window_layouts[window_id] = window_layout
+        pane_id_to_terminal = self.control.pane_id_to_terminal
+        if any(pane.pane_id in pane_id_to_terminal
+               for pane in layout.iter_panes(window_layout)):
+            return
+        GObject.idle_add(self.add_window_tab, window_id, window_layout,
+                         window_name)
+
+    def add_window_tab(self, window_id, window_layout, window_name):
+        """Show a window made by another client as a new tab, built from
+        its first pane the way its other panes would be split off"""
+        if window_id not in self.window_layouts:
+            # closed before we got to it
+            return False
+        pane_id_to_terminal = self.control.pane_id_to_terminal
+        neighbour = next(pane_id_to_terminal.itervalues(), None)
+        if neighbour is None:
+            dbg('No Terminator window to add {} to'.format(window_id))
+            return False
+        window = neighbour.get_toplevel()
+        if not window.is_child_notebook():
+            Factory().make('Notebook', window=window)
+        notebook = window.get_child()
+        current_page = notebook.get_current_page()
+
+        first = layout.iter_panes(window_layout).next()
+        terminal = Factory().make('Terminal')
+        terminal.control = self.control
+        terminal.pane_id = first.pane_id
+        pane_id_to_terminal[first.pane_id] = terminal
+        self.pane_registered(first.pane_id)
+        notebook.newtab(widget=terminal)
+        if window_name:
+            notebook.get_tab_label(terminal).set_custom_label(window_name)
+        # leave the tab the user is looking at in front
+        notebook.set_current_page(current_page)
+        self.control.initial_output(first.pane_id)
+        self.apply_layout_operations(
+            layout.diff_layouts(first, window_layout), window_layout)
+        return False
+
+    def handle_window_renamed(self, notification):
+        assert isinstance(notification, WindowRenamed)
+        GObject.idle_add(self.rename_window_tab, notification.window_id,
+                         notification.window_name)
+
+    def rename_window_tab(self, window_id, window_name):
+        window_layout = self.window_layouts.get(window_id)
+        if window_layout is None:
+            return False
+        pane_id_to_terminal = self.control.pane_id_to_terminal
+        for pane in layout.iter_panes(window_layout):
+            terminal = pane_id_to_terminal.get(pane.pane_id)
+            if terminal is not None:
+                break
+        else:
+            return False
+        notebook = terminal.get_toplevel().get_child()
+        if not Factory().isinstance(notebook, 'Notebook'):
+            # a single tmux window has no tab to rename
+            return False
+        label = notebook.get_tab_label(notebook.find_tab_root(terminal))
+        if label:
+            label.set_custom_label(window_name)
+        return False
 
     def handle_window_close(self, notification):
         assert isinstance(notification, WindowClose)
-        GObject.idle_add(self.terminator.tmux_control.garbage_collect_panes)
+        self.close_window(notification.window_id)
+
+    def close_window(self, window_id):
+        window_layout = self.window_layouts.pop(window_id, None)
+        if window_layout is None:
+            GObject.idle_add(self.control.garbage_collect_panes)
+            return
+        # closing the last terminal of a tab closes the tab
+        GObject.idle_add(self.apply_layout_operations,
+                         [layout.PaneRemoved(pane.pane_id)
+                          for pane in layout.iter_panes(window_layout)],
+                         window_layout)
+
+    # %unlinked-window-* are about windows of other sessions, there is
+    # nothing to show for them
+
+    def handle_session_changed(self, notification):
+        assert isinstance(notification, SessionChanged)
+        if notification.session_name == self.control.session_name:
+            # the session we attached to
+            return
+        dbg('Switched from session {} to {}'.format(
+            self.control.session_name, notification.session_name))
+        self.control.session_name = notification.session_name
+        self.control.list_session_windows()
+
+    def session_windows_result(self, result):
+        """Turn the tabs of the session we left into those of the session
+        we are in now, keeping windows linked into both"""
+        window_ids = set()
+        for line in result:
+            window_id, window_layout, window_name = \
+                (line.split(' ', 2) + [''])[:3]
+            window_ids.add(window_id)
+            if window_id not in self.window_layouts:
+                self.add_window(window_id, window_layout, window_name)
+                continue
+            try:
+                window_layout = self.layout_parser.parse(window_layout)
+            except ValueError:
+                dbg('Unparsable layout: {}'.format(line))
+                continue
+            self.update_window_layout(window_id, window_layout)
+        for window_id in set(self.window_layouts) - window_ids:
+            self.close_window(window_id)
+
+    def apply_layout_operations(self, operations, window_layout):
+        """Update our terminals to match a changed tmux layout"""
+        panes = dict((pane.pane_id, pane)
+                     for pane in layout.iter_panes(window_layout))
+        for operation in operations:
+            # PaneResized needs no work, terminals follow their allocation
+            apply_operation = self.layout_operations.get(type(operation))
+            if apply_operation:
+                apply_operation(operation, panes)
+        return False
+
+    def remove_pane(self, operation, panes):
+        self.output_queue.discard(operation.pane_id)
+        self.scrollback.discard(operation.pane_id)
+        self.pane_modes.pop(operation.pane_id, None)
+        self.pane_metadata.pop(operation.pane_id, None)
+        self.local_echo.discard(operation.pane_id)
+        terminal = self.control.pane_id_to_terminal.pop(operation.pane_id,
+                                                           None)
+        if terminal:
+            terminal.close()
+
+    def add_pane(self, operation, panes):
+        pane_id_to_terminal = self.control.pane_id_to_terminal
+        if operation.pane_id in pane_id_to_terminal:
+            # we split this one ourselves, pane_id_result already knows it
+            return
+        neighbour = pane_id_to_terminal.get(operation.neighbour)
+        if not neighbour:
+            dbg('No terminal next to new pane {}'.format(operation.pane_id))
+            return
+        terminal = Factory().make('Terminal')
+        terminal.control = self.control
+        terminal.pane_id = operation.pane_id
+        pane_id_to_terminal[operation.pane_id] = terminal
+        self.pane_registered(operation.pane_id)
+        # another client split it, leave the focus where the user has it
+        neighbour.get_parent().split_axis(neighbour, operation.vertical,
+                                          sibling=terminal,
+                                          widgetfirst=not operation.before,
+                                          focus=False)
+        self.control.initial_output(operation.pane_id)
+
+    def set_split_ratio(self, operation, panes):
+        pane_id_to_terminal = self.control.pane_id_to_terminal
+        first = pane_id_to_terminal.get(operation.first)
+        second = pane_id_to_terminal.get(operation.second)
+        if not first or not second:
+            return
+        paned = common_ancestor(first, second)
+        paned_type = 'VPaned' if operation.vertical else 'HPaned'
+        if paned is None or not Factory().isinstance(paned, paned_type):
+            return
+        # Paneds that were split one pane at a time may not nest the same
+        # way tmux containers do, so work from the extents of what each
+        # side of this Paned actually holds
+        child1, child2 = paned.get_children()
+        start1, end1 = pane_extent(child1, panes, operation.vertical)
+        start2, end2 = pane_extent(child2, panes, operation.vertical)
+        if start1 is None or start2 is None:
+            return
+        size1, size2 = end1 - start1, end2 - start2
+        paned.ratio = float(size1) / (size1 + size2)
+        paned.set_position_by_ratio()
 
     def pane_id_result(self, result):
         pane_id, marker = result[0].split(' ')
-        terminal = self.terminator.find_terminal_by_pane_id(marker)
+        terminal = self.terminator.find_terminal_by_pane_id(self.control,
+                                                          marker)
+        self.control.pane_id_to_terminal[pane_id] = terminal
+        # setting it updates the registry, which the main loop reads
+        GObject.idle_add(self.set_pane_id, terminal, pane_id)
+        self.pane_registered(pane_id)
+
+    def set_pane_id(self, terminal, pane_id):
         terminal.pane_id = pane_id
-        self.terminator.pane_id_to_terminal[pane_id] = terminal
-
-    # NOTE: UNUSED; if we ever end up needing this, create the tty property in
-    # the Terminal class first
-    def pane_tty_result(self, result):
-        dbg(result)
-        pane_id, pane_tty = result[0].split(' ')
-        # self.terminator.pane_id_to_terminal[pane_id].tty = pane_tty
+        return False
 
     def garbage_collect_panes_result(self, result):
-        pane_id_to_terminal = self.terminator.pane_id_to_terminal
-        removed_pane_ids = pane_id_to_terminal.keys()
+        pane_id_to_terminal = self.control.pane_id_to_terminal
+        removed_pane_ids = set(pane_id_to_terminal)
 
         for line in result:
             pane_id, pane_pid = line.split(' ')
-            try:
-                removed_pane_ids.remove(pane_id)
-                pane_id_to_terminal[pane_id].pid = pane_pid
-            except ValueError:
+            terminal = pane_id_to_terminal.get(pane_id)
+            if terminal is None:
                 dbg("Pane already reaped, keep going.")
                 continue
+            removed_pane_ids.discard(pane_id)
+            terminal.pid = pane_pid
 
         if removed_pane_ids:
             def callback():
                 for pane_id in removed_pane_ids:
+                    self.output_queue.discard(pane_id)
+                    self.scrollback.discard(pane_id)
+                    self.pane_modes.pop(pane_id, None)
+                    self.pane_metadata.pop(pane_id, None)
+                    self.local_echo.discard(pane_id)
                     terminal = pane_id_to_terminal.pop(pane_id, None)
                     if terminal:
                         terminal.close()
@@ -281,30 +906,127 @@ class NotificationsHandler(object):
     def initial_layout_result(self, result):
         window_layouts = []
         for line in result:
-            window_layout = line.strip()
-            window_layouts.extend(layout.parse_layout(self.layout_parser.parse(window_layout)[0]))
-            # window_layouts.append(layout.parse_layout(window_layout))
+            window_id, window_layout = line.strip().split(' ', 1)
+            window_layout = self.layout_parser.parse(window_layout)
+            self.window_layouts[window_id] = window_layout
+            self.initial_window_ids.add(window_id)
+            window_layouts.append(window_layout)
         terminator_layout = layout.convert_to_terminator_layout(
                 window_layouts)
         import pprint
         dbg(pprint.pformat(terminator_layout))
-        self.terminator.initial_layout = terminator_layout
-
-    def initial_output_result_callback(self, pane_id):
-        def result_callback(result):
-            terminal = self.terminator.pane_id_to_terminal.get(pane_id)
-            if not terminal:
-                return
-            output = '\r\n'.join(l for l in result if l)
-            terminal.vte.feed(output.decode('string_escape'))
-        return result_callback
+        self.control.initial_layout = terminator_layout
+        self.terminator.collect_tmux_layouts()
+
+    def reconcile_result(self, result):
+        """Catch up with the session after reconnecting: apply the layouts
+        that changed and redraw the panes of windows that had output while
+        we were away. Closed panes are left to garbage_collect_panes."""
+        since = self.control.disconnected_at - RECONNECT_ACTIVITY_MARGIN
+        window_ids = set()
+        for line in result:
+            window_id, activity, window_layout = line.strip().split(' ', 2)
+            window_ids.add(window_id)
+            try:
+                window_layout = self.layout_parser.parse(window_layout)
+            except ValueError:
+                dbg('Unparsable layout: {}'.format(line))
+                window_layout = None
+            self.update_window_layout(window_id, window_layout)
+            if window_layout is None or int(activity) < since:
+                continue
+            for pane in layout.iter_panes(window_layout):
+                if pane.pane_id in self.control.pane_id_to_terminal:
+                    self.control.refresh_pane(pane.pane_id)
+        for window_id in set(self.window_layouts) - window_ids:
+            del self.window_layouts[window_id]
 
     def terminate(self):
+        if not self.exited and self.control.reconnect():
+            # keep the terminals, they come back once we are attached again
+            return
         def callback():
+            if any(control.tmux for control in self.terminator.tmux_controls
+                   if control is not self.control):
+                # other connections are still up, only drop our panes
+                for terminal in self.control.pane_id_to_terminal.values():
+                    terminal.close()
+                self.control.pane_id_to_terminal.clear()
+                return False
             for window in self.terminator.windows:
                 window.emit('destroy')
         GObject.idle_add(callback)
 
 
+def common_ancestor(first, second):
+    """Return the innermost widget containing both widgets"""
+    ancestors = set()
+    widget = first.get_parent()
+    while widget is not None:
+        ancestors.add(widget)
+        widget = widget.get_parent()
+    widget = second.get_parent()
+    while widget is not None and widget not in ancestors:
+        widget = widget.get_parent()
+    return widget
+
+
+def pane_extent(widget, panes, vertical):
+    """Return the first and last cell, along one axis, of the tmux panes
+    shown by the terminals in widget"""
+    if Factory().isinstance(widget, 'Terminal'):
+        terminals = [widget]
+    else:
+        terminals = enumerate_descendants(widget)[1]
+    start = end = None
+    for terminal in terminals:
+        pane = panes.get(terminal.pane_id)
+        if pane is None:
+            continue
+        if vertical:
+            offset, size = pane.y, pane.height
+        else:
+            offset, size = pane.x, pane.width
+        start = offset if start is None else min(start, offset)
+        end = offset + size if end is None else max(end, offset + size)
+    return start, end
+
+
+def tab_root(terminal):
+    """Return the outermost Paned holding terminal, or terminal itself,
+    i.e. what shows one tmux window"""
+    maker = Factory()
+    widget = terminal
+    parent = widget.get_parent()
+    while parent is not None and maker.isinstance(parent, 'Paned'):
+        widget = parent
+        parent = widget.get_parent()
+    return widget
+
+
+def widget_layout(widget):
+    """Return the layout tree of a Terminal or Paned, with the terminals'
+    sizes for the panes, or None if a terminal has no pane yet"""
+    maker = Factory()
+    if maker.isinstance(widget, 'Terminal'):
+        if not widget.pane_id or not widget.pane_id.startswith('%'):
+            return None
+        columns, rows = widget.get_size()
+        return layout.Pane(columns, rows, 0, 0, widget.pane_id)
+    container_type = layout.Horizontal if maker.isinstance(widget, 'HPaned') \
+        else layout.Vertical
+    children = []
+    for child in widget.get_children():
+        child = widget_layout(child)
+        if child is None:
+            return None
+        if type(child) is container_type:
+            # tmux has one container for consecutive splits along an axis
+            children.extend(child.children)
+        else:
+            children.append(child)
+    return container_type(0, 0, 0, 0, children)
+
+
 def noop(result):
     pass
@@ -0,0 +1,163 @@
+"""Decoding of the data carried by tmux %output notifications.
+
+In control mode tmux replaces every byte below 0x20 and every backslash with
+a backslash followed by three octal digits; everything else is passed through
+untouched. Since a backslash is never sent unescaped, the C escape decoder
+gives exactly the original bytes, and it can be run over a buffer of the raw
+line so the data is only copied once, into its decoded form.
+
+Decoded output is handed from the reader thread to the GTK main thread
+through an OutputQueue, which coalesces it per pane.
+"""
+
+import threading
+import time
+from codecs import escape_decode
+from collections import OrderedDict
+
+from gi.repository import GObject
+
+# feed each pane at most this often (in seconds) while output keeps coming
+FRAME_INTERVAL = 1.0 / 60
+
+OUTPUT_PREFIX = '%output '
+# sent instead of %output once flow control (pause-after) is enabled
+EXTENDED_OUTPUT_PREFIX = '%extended-output '
+
+
+def unescape(data, start=0):
+    """Decode tmux octal escapes in data[start:]"""
+    if data.find('\\', start) == -1:
+        return data[start:] if start else data
+    return escape_decode(buffer(data, start))[0]
+
+
+def parse_output_line(line):
+    """Return the pane id and decoded data of a raw %output line"""
+    start = len(OUTPUT_PREFIX)
+    end = line.find(' ', start)
+    if end == -1:
+        return line[start:], ''
+    return line[start:end], unescape(line, end + 1)
+
+
+def parse_extended_output_line(line):
+    """Return the pane id, age (ms) and decoded data of a raw
+    `%extended-output pane-id age ... : data` line"""
+    start = len(EXTENDED_OUTPUT_PREFIX)
+    end = line.find(' ', start)
+    age_end = line.find(' ', end + 1)
+    data = line.find(' : ', end)
+    if data == -1:
+        return line[start:end], int(line[end + 1:age_end]), ''
+    return line[start:end], int(line[end + 1:age_end]), unescape(line, data + 3)
+
+
+class OutputQueue(object):
+    """Thread safe, per pane queue of decoded output.
+
+    The reader thread put()s data, a single main loop source drains it,
+    feeding each pane at most once per frame with everything that arrived
+    in the meantime. No more than max_bytes_per_tick bytes are fed to one
+    pane per drain; the rest waits for the next frame so that a flooding
+    pane cannot starve the UI or the other panes.
+
+    replace() drops what is queued for a pane and has reset() called for it
+    right before its new contents are fed.
+    """
+
+    def __init__(self, feed, max_bytes_per_tick=0, reset=None):
+        self.feed = feed
+        self.reset = reset
+        self.max_bytes_per_tick = max_bytes_per_tick
+        self.lock = threading.Lock()
+        self.panes = OrderedDict()
+        self.resets = set()
+        self.source = None
+        self.last_drain = 0
+        # counters
+        self.queued_bytes = 0
+        self.total_bytes = 0
+        self.fed_bytes = 0
+        self.feed_calls = 0
+        self.drains = 0
+
+    def put(self, pane_id, data):
+        if not data:
+            return
+        with self.lock:
+            chunks = self.panes.get(pane_id)
+            if chunks is None:
+                self.panes[pane_id] = [data]
+            else:
+                chunks.append(data)
+            self.queued_bytes += len(data)
+            self.total_bytes += len(data)
+            self._schedule()
+
+    def replace(self, pane_id, data):
+        """Reset the pane, then feed data instead of anything queued"""
+        with self.lock:
+            chunks = self.panes.pop(pane_id, None)
+            if chunks:
+                self.queued_bytes -= sum(len(chunk) for chunk in chunks)
+            self.panes[pane_id] = [data]
+            self.resets.add(pane_id)
+            self.queued_bytes += len(data)
+            self.total_bytes += len(data)
+            self._schedule()
+
+    def _schedule(self):
+        """Arrange for a drain, call with the lock held"""
+        if self.source is not None:
+            return
+        delay = self.last_drain + FRAME_INTERVAL - time.time()
+        if delay > 0:
+            self.source = GObject.timeout_add(int(delay * 1000) + 1,
+                                              self.drain)
+        else:
+            self.source = GObject.idle_add(self.drain)
+
+    def drain(self):
+        limit = self.max_bytes_per_tick
+        batch = []
+        with self.lock:
+            self.source = None
+            self.last_drain = time.time()
+            self.drains += 1
+            panes = self.panes
+            self.panes = OrderedDict()
+            resets, self.resets = self.resets, set()
+            for pane_id, chunks in panes.iteritems():
+                data = chunks[0] if len(chunks) == 1 else ''.join(chunks)
+                if limit and len(data) > limit:
+                    self.panes[pane_id] = [data[limit:]]
+                    data = data[:limit]
+                self.queued_bytes -= len(data)
+                batch.append((pane_id, data, pane_id in resets))
+            if self.panes:
+                self._schedule()
+        for pane_id, data, reset in batch:
+            if reset and self.reset is not None:
+                self.reset(pane_id)
+            self.feed_calls += 1
+            self.fed_bytes += len(data)
+            self.feed(pane_id, data)
+        return False
+
+    def discard(self, pane_id):
+        """Drop anything still queued for a pane"""
+        with self.lock:
+            chunks = self.panes.pop(pane_id, None)
+            if chunks:
+                self.queued_bytes -= sum(len(chunk) for chunk in chunks)
+            self.resets.discard(pane_id)
+
+    def stats(self):
+        return {
+            'queued_bytes': self.queued_bytes,
+            'total_bytes': self.total_bytes,
+            'fed_bytes': self.fed_bytes,
+            'feed_calls': self.feed_calls,
+            'drains': self.drains,
+        }
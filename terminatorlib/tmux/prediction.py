@@ -0,0 +1,208 @@
+"""Predictive local echo for tmux panes.
+
+Over a slow link a typed character only shows up once it went to tmux and
+came back as %output. With tmux_predictive_echo on, LocalEcho shows
+printable keys right away, underlined, and takes them back right before
+the pane's real output is fed, so that the terminal only ever holds what
+tmux sent:
+
+    keypress --predict()--> shown --feed()--> confirmed (echo matches)
+                                          \\-> rolled back (output differs,
+                                              or no echo within the timeout)
+
+Predictions are only shown once an echo was seen to take long enough to
+be noticed, and stop being shown as soon as one is rolled back, e.g. at a
+password prompt or in a program that reads keys without echoing them,
+until an echo matches again. Panes on the alternate screen or with mouse
+reporting on, i.e. full screen programs, are never predicted for.
+"""
+
+import time
+import unicodedata
+
+from gi.repository import GObject
+
+from terminatorlib.util import dbg
+
+UNDERLINE_ON = '\033[4m'
+UNDERLINE_OFF = '\033[24m'
+# predictions not echoed within this many seconds are taken back
+PREDICTION_TIMEOUT = 1.0
+# echoes faster than this (in seconds) are not worth predicting
+NOTICEABLE_LATENCY = 0.03
+# characters from here on may take two cells
+WIDE_CHARACTERS = u'\u1100'
+
+
+def printable(key):
+    """Whether a key as sent to tmux shows up as one character cell"""
+    try:
+        char = key.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    return len(char) == 1 and char < WIDE_CHARACTERS and \
+        unicodedata.category(char)[0] != 'C'
+
+
+class PanePredictions(object):
+    """Keys of one pane waiting for their echo"""
+
+    __slots__ = ['vte', 'keys', 'times', 'shown', 'trusted', 'blocked']
+
+    def __init__(self, vte):
+        self.vte = vte
+        self.keys = []
+        self.times = []
+        # number of predicted cells in front of the cursor
+        self.shown = 0
+        self.trusted = False
+        # a key that can't be predicted was sent after the pending ones
+        self.blocked = False
+
+    def retract(self):
+        """The sequence that takes back the shown predictions"""
+        shown, self.shown = self.shown, 0
+        if not shown:
+            return ''
+        return '\033[{0}D\033[{0}X'.format(shown)
+
+    def clear(self):
+        count = len(self.keys)
+        del self.keys[:]
+        del self.times[:]
+        self.blocked = False
+        return count
+
+
+class LocalEcho(object):
+    """Predictions of the panes of one tmux connection, main loop only"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.panes = {}
+        self.timer = None
+        # counters
+        self.predicted = 0
+        self.confirmed = 0
+        self.rolled_back = 0
+        # seconds between showing predictions and their echo
+        self.hidden_latency = 0.0
+
+    def predict(self, pane_id, key, vte, modes):
+        """Called with every key sent to a pane"""
+        if not self.enabled or vte is None:
+            return
+        state = self.panes.get(pane_id)
+        if modes.alternate_screen or modes.mouse:
+            if state is not None and state.keys:
+                vte.feed(state.retract())
+                self.rolled_back += state.clear()
+            return
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        if not printable(key):
+            if state is not None and state.keys:
+                state.blocked = True
+            return
+        if state is None:
+            state = self.panes[pane_id] = PanePredictions(vte)
+        elif state.blocked:
+            return
+        state.vte = vte
+        state.keys.append(key)
+        state.times.append(time.time())
+        self.predicted += 1
+        if state.trusted:
+            self.show(state, [key])
+        if self.timer is None:
+            self.timer = GObject.timeout_add(int(PREDICTION_TIMEOUT * 1000),
+                                             self.expire)
+
+    def show(self, state, keys):
+        """Show keys at the cursor, as long as they stay on its line"""
+        vte = state.vte
+        column = vte.get_cursor_position()[0]
+        keys = keys[:max(vte.get_column_count() - column - 1, 0)]
+        if keys:
+            vte.feed('{}{}{}'.format(UNDERLINE_ON, ''.join(keys),
+                                     UNDERLINE_OFF))
+            state.shown += len(keys)
+
+    def feed(self, pane_id, vte, output):
+        """Feed a pane's real output, settling its predictions"""
+        state = self.panes.get(pane_id)
+        if state is None or not state.keys:
+            vte.feed(output)
+            return
+        now = time.time()
+        position = matched = 0
+        for key in state.keys:
+            if not output.startswith(key, position):
+                break
+            position += len(key)
+            matched += 1
+        if matched:
+            latency = now - state.times[matched - 1]
+            self.confirmed += matched
+            # only the first keys are shown, the rest didn't fit the line
+            self.hidden_latency += sum(
+                now - typed for typed in state.times[:min(matched,
+                                                          state.shown)])
+            del state.keys[:matched]
+            del state.times[:matched]
+            state.trusted = latency >= NOTICEABLE_LATENCY
+        if state.keys and position < len(output):
+            # the pane did something else than echo what was typed
+            dbg('Rolling back {} prediction(s) for {}'.format(
+                len(state.keys), pane_id))
+            self.rolled_back += state.clear()
+            state.trusted = False
+        vte.feed(state.retract() + output)
+        if state.keys:
+            if state.trusted:
+                self.show(state, state.keys)
+        else:
+            state.blocked = False
+
+    def expire(self):
+        """Take back predictions tmux did not echo in time"""
+        deadline = time.time() - PREDICTION_TIMEOUT
+        pending = False
+        for pane_id, state in self.panes.iteritems():
+            if not state.keys:
+                continue
+            if state.times[0] > deadline:
+                pending = True
+                continue
+            dbg('No echo for {} prediction(s) in {}'.format(len(state.keys),
+                                                            pane_id))
+            state.vte.feed(state.retract())
+            self.rolled_back += state.clear()
+            state.trusted = False
+        if not pending:
+            self.timer = None
+        return pending
+
+    def discard(self, pane_id):
+        """Forget a pane, its terminal is reset or gone"""
+        self.panes.pop(pane_id, None)
+
+    def stats(self):
+        return {
+            'predicted': self.predicted,
+            'confirmed': self.confirmed,
+            'rolled_back': self.rolled_back,
+            'hidden_latency': self.hidden_latency,
+        }
+
+    def report(self):
+        """How well predictions did, e.g. for the debug console"""
+        if not self.enabled:
+            return 'off'
+        average = self.hidden_latency / self.confirmed \
+            if self.confirmed else 0.0
+        return ('{} predicted, {} confirmed, {} rolled back, {:.1f}s hidden '
+                '({:.0f}ms per key)'.format(self.predicted, self.confirmed,
+                                            self.rolled_back,
+                                            self.hidden_latency,
+                                            average * 1000))
@@ -0,0 +1,166 @@
+"""Non-blocking reader for the tmux control mode pipe.
+
+The threaded consumer in TmuxControl reads one line at a time, with a
+waitpid() per line. ControlReader instead waits on the pipe from the GTK
+main loop, reads whatever is available in large chunks, splits it into lines
+in a buffer and parses notifications incrementally, so a %begin/%end block
+may span any number of reads. Everything parsed from a read is handed to
+NotificationsHandler.handle_batch() in one go.
+
+Since the pipe is only drained while the main loop runs, tmux blocks on a
+full pipe when Terminator can't keep up instead of piling output up in
+memory.
+"""
+
+import os
+import errno
+import fcntl
+
+from gi.repository import GLib
+
+from terminatorlib.util import dbg
+from terminatorlib.tmux import notifications
+from terminatorlib.tmux.output import OUTPUT_PREFIX, EXTENDED_OUTPUT_PREFIX
+
+READ_SIZE = 65536
+# stop reading and give the main loop a chance after this many bytes
+MAX_BYTES_PER_WAKEUP = 1048576
+
+
+class NotificationParser(object):
+    """Turn a stream of control mode data into notifications"""
+
+    def __init__(self, handled=None):
+        self.buffer = ''
+        self.block = None
+        self.block_lines = None
+        # the markers there is a handler for, None for all of them
+        self.handled = handled
+        # marker -> number of lines with that marker we could not parse or
+        # had no handler for, '' counting lines that aren't notifications
+        self.unknown = {}
+
+    def feed(self, data):
+        """Parse data, return the list of notifications it completes"""
+        if self.buffer:
+            data = self.buffer + data
+        lines = data.split('\n')
+        self.buffer = lines.pop()
+        parsed = []
+        parse_line = self.parse_line
+        for line in lines:
+            notification = parse_line(line)
+            if notification is not None:
+                parsed.append(notification)
+        return parsed
+
+    def parse_line(self, line):
+        if self.block is not None:
+            if notifications.is_block_end(line):
+                block, self.block = self.block, None
+                block.finish(self.block_lines, line)
+                self.block_lines = None
+                return block
+            notification = notifications.flow_control_notification(line)
+            if notification is None:
+                self.block_lines.append(line)
+            else:
+                self.block.embedded.append(notification)
+            return None
+        if not line:
+            return None
+        if line.startswith(OUTPUT_PREFIX):
+            notification = notifications.Output()
+            notification.consume_raw(line)
+            return notification
+        if line.startswith(EXTENDED_OUTPUT_PREFIX):
+            notification = notifications.ExtendedOutput()
+            notification.consume_raw(line)
+            return notification
+        fields = line[1:].split(' ')
+        cls = notifications.notifications_mappings.get(fields[0])
+        if cls is None:
+            # skip MOTD, anything that isn't coming from tmux control mode
+            self.count_unknown(fields[0] if line[0] == '%' else '')
+            return None
+        if self.handled is not None and fields[0] not in self.handled:
+            self.count_unknown(fields[0])
+            return None
+        notification = cls()
+        line = fields[1:]
+        if isinstance(notification, notifications.Result):
+            notification.start(line)
+            self.block = notification
+            self.block_lines = []
+            return None
+        notification.consume(line, None)
+        return notification
+
+    def count_unknown(self, marker):
+        count = self.unknown.get(marker, 0)
+        if not count:
+            dbg('Discarding invalid output from the control terminal: '
+                '"{}"'.format(marker))
+        self.unknown[marker] = count + 1
+
+
+class ControlReader(object):
+    """Read notifications from the control pipe with a main loop IO watch"""
+
+    def __init__(self, output, handler):
+        self.output = output
+        self.fd = output.fileno()
+        self.handler = handler
+        self.parser = NotificationParser(handler.dispatch)
+        self.source = None
+        # counters
+        self.reads = 0
+        self.bytes_read = 0
+        self.batches = 0
+
+    def start(self):
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.source = GLib.io_add_watch(
+            self.fd, GLib.PRIORITY_DEFAULT,
+            GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_readable)
+
+    def stop(self):
+        """Stop reading, without tearing down the windows"""
+        if self.source is not None:
+            GLib.source_remove(self.source)
+            self.source = None
+
+    def on_readable(self, fd=None, condition=None):
+        budget = MAX_BYTES_PER_WAKEUP
+        eof = False
+        chunks = []
+        while budget > 0:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                dbg('Reading from tmux failed: {}'.format(e))
+                eof = True
+                break
+            self.reads += 1
+            if not data:
+                eof = True
+                break
+            chunks.append(data)
+            budget -= len(data)
+        if chunks:
+            data = ''.join(chunks)
+            self.bytes_read += len(data)
+            parsed = self.parser.feed(data)
+            if parsed:
+                self.batches += 1
+                self.handler.handle_batch(parsed)
+        if eof and self.source is not None:
+            dbg('Tmux control pipe closed.')
+            self.source = None
+            self.handler.terminate()
+            return False
+        # handling the batch may have reset the connection
+        return self.source is not None
@@ -0,0 +1,195 @@
+"""Lazy loading of the tmux scrollback of attached panes.
+
+On attach only the visible screen and the last tmux_scrollback_tail lines of
+history are captured and fed, so panes show up right away no matter how much
+history they have. Older history is fetched afterwards in chunks of
+tmux_scrollback_chunk rows, newest first, either at idle priority or when the
+user scrolls to the top of a terminal (tmux_scrollback_hydration).
+
+VTE can only append, so once history has been fetched the terminal is reset
+and fed the older rows followed by a fresh capture of everything since.
+
+Rows are addressed by their index in the history at attach time (0 being
+the oldest row), which stays valid while new output scrolls more rows into
+the history. tmux addresses them relative to the current history size, so
+every capture also asks for the history size, in the same command line, to
+find out which rows were really returned. Rebuilding captures a few rows
+more than needed, so that rows scrolling into the history in the meantime
+only eat into this overlap.
+"""
+
+import threading
+
+from gi.repository import GObject
+
+from terminatorlib.util import dbg
+
+# rows captured ahead of the anchor when rebuilding
+REBUILD_OVERLAP = 100
+# rebuilding is given up after this many captures raced with more output
+# than the overlap
+MAX_REBUILD_RETRIES = 3
+
+
+class PaneHistory(object):
+    """What is known about the history of one pane"""
+
+    __slots__ = ['pane_id', 'anchor', 'top', 'history_size', 'chunks',
+                 'pending', 'dirty', 'retries']
+
+    def __init__(self, pane_id, anchor, history_size):
+        self.pane_id = pane_id
+        # the oldest row captured on attach, everything from here on is
+        # captured again when rebuilding
+        self.anchor = anchor
+        # the oldest row fetched so far
+        self.top = anchor
+        self.history_size = history_size
+        # fetched rows, newest chunk first
+        self.chunks = []
+        self.pending = False
+        self.dirty = False
+        self.retries = 0
+
+    def offset(self, row):
+        """tmux's (negative) line number for a row"""
+        return row - self.history_size
+
+
+class ScrollbackLoader(object):
+    """Fetch the history of attached panes in the background"""
+
+    def __init__(self, handler, tail, chunk_size, mode):
+        self.handler = handler
+        self.tail = tail
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.panes = {}
+
+    def initial_output_result(self, pane_id):
+        def result_callback(result):
+            history_size = int(result[0])
+            output = '\r\n'.join(l for l in result[1:] if l)
+            self.handler.output_queue.put(pane_id,
+                                          output.decode('string_escape'))
+            anchor = max(history_size - self.tail, 0)
+            if not anchor or self.mode not in ('idle', 'scroll'):
+                return
+            with self.lock:
+                self.panes[pane_id] = PaneHistory(pane_id, anchor,
+                                                  history_size)
+            if self.mode == 'idle':
+                self.schedule(pane_id)
+            else:
+                GObject.idle_add(self.watch_scrolling, pane_id)
+        return result_callback
+
+    def discard(self, pane_id):
+        with self.lock:
+            self.panes.pop(pane_id, None)
+
+    def schedule(self, pane_id, delay=0):
+        if delay:
+            GObject.timeout_add(delay, self.fetch, pane_id,
+                                priority=GObject.PRIORITY_LOW)
+        else:
+            GObject.idle_add(self.fetch, pane_id,
+                             priority=GObject.PRIORITY_LOW)
+
+    def watch_scrolling(self, pane_id):
+        terminal = self.handler.control.pane_id_to_terminal.get(pane_id)
+        if terminal:
+            terminal.vte.get_vadjustment().connect(
+                'value-changed', self.on_scrolled, pane_id)
+        return False
+
+    def on_scrolled(self, adjustment, pane_id):
+        if pane_id in self.panes and adjustment.get_value() <= \
+           adjustment.get_lower() + adjustment.get_page_size():
+            self.fetch(pane_id)
+
+    def fetch(self, pane_id):
+        """Ask for the next chunk of history, or rebuild the terminal"""
+        with self.lock:
+            history = self.panes.get(pane_id)
+            if history is None or history.pending:
+                return False
+            history.pending = True
+        control = self.handler.control
+        if history.dirty and (history.top == 0 or self.mode == 'scroll'):
+            overlap = min(REBUILD_OVERLAP, history.anchor)
+            control.capture_history(
+                pane_id, history.offset(history.anchor - overlap), '-',
+                callback=self.rebuild_result(history, overlap))
+        else:
+            start = max(history.top - self.chunk_size, 0)
+            # the oldest chunk starts at the top of the history, however
+            # many rows were added since
+            control.capture_history(
+                pane_id, history.offset(start) if start else '-',
+                history.offset(history.top - 1),
+                callback=self.chunk_result(history, start))
+        return False
+
+    def chunk_result(self, history, start):
+        def result_callback(result):
+            history_size = int(result[0].split(' ')[0])
+            shift = history_size - history.history_size
+            history.history_size = history_size
+            history.pending = False
+            if shift < 0:
+                dbg('History of {} was cleared'.format(history.pane_id))
+                self.discard(history.pane_id)
+                return
+            # rows that scrolled into the history since the last capture
+            # moved the range towards the present, drop what we already have
+            lines = result[1:]
+            if shift:
+                lines = lines[:max(len(lines) - shift, 0)]
+            if lines:
+                history.chunks.append(lines)
+                history.top = min(start + shift if start else 0,
+                                  history.top)
+                history.dirty = True
+            if self.mode == 'idle' or history.dirty:
+                self.schedule(history.pane_id)
+        return result_callback
+
+    def rebuild_result(self, history, overlap):
+        def result_callback(result):
+            history_size, alternate_on, cursor_y, cursor_x = \
+                result[0].split(' ')
+            shift = int(history_size) - history.history_size
+            history.history_size = int(history_size)
+            history.pending = False
+            if shift < 0:
+                self.discard(history.pane_id)
+                return
+            if alternate_on == '1':
+                # the history belongs to the normal screen, wait for it
+                self.schedule(history.pane_id, 1000)
+                return
+            if shift > overlap:
+                # more rows scrolled into the history before the capture
+                # ran than were captured ahead of the anchor
+                if history.retries < MAX_REBUILD_RETRIES:
+                    history.retries += 1
+                    self.schedule(history.pane_id)
+                    return
+                dbg('Giving up on the history of {}'.format(
+                    history.pane_id))
+                self.discard(history.pane_id)
+                return
+            history.retries = 0
+            history.dirty = False
+            lines = [line for chunk in reversed(history.chunks)
+                     for line in chunk]
+            lines.extend(result[1 + overlap - shift:])
+            output = '\r\n'.join(lines).decode('string_escape')
+            self.handler.output_queue.replace(
+                history.pane_id, '{}\033[{};{}H'.format(
+                    output, int(cursor_y) + 1, int(cursor_x) + 1))
+            if history.top == 0:
+                self.discard(history.pane_id)
+        return result_callback
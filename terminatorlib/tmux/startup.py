@@ -0,0 +1,99 @@
+"""Starting Terminator in tmux mode without blocking the main loop.
+
+What Terminator shows depends on the windows of the sessions it attaches to,
+which tmux only tells us some round trips later. Rather than wait for that
+before entering the main loop, TmuxStartup shows a placeholder window, and
+builds the layout once every connection reported its windows, failed to
+attach (then terminals start new sessions), or tmux_command_timeout passed.
+
+    connecting --layout_ready()/timeout--> building --> done
+"""
+
+import time
+
+from gi.repository import Gtk, GObject
+
+from terminatorlib.translation import _
+from terminatorlib.util import dbg
+from terminatorlib.version import APP_NAME
+
+
+class TmuxStartup(object):
+
+    def __init__(self, terminator, layoutname, timeout):
+        self.terminator = terminator
+        self.layoutname = layoutname
+        self.timeout = timeout
+        self.state = 'connecting'
+        self.started = time.time()
+        self.timed_out = False
+        self.timer = None
+        self.placeholder = None
+        # seconds from starting until a frame was drawn, per window kind
+        self.first_frames = {}
+
+    def start(self):
+        """Show the placeholder, called before connecting to tmux"""
+        self.placeholder = Gtk.Window(title=APP_NAME)
+        self.placeholder.set_default_size(400, 100)
+        self.placeholder.add(Gtk.Label(label=_('Attaching to tmux...')))
+        self.placeholder.connect('delete-event', self.on_placeholder_closed)
+        self.watch_first_frame(self.placeholder, 'placeholder')
+        self.placeholder.show_all()
+        self.timer = GObject.timeout_add(int(self.timeout * 1000),
+                                         self.on_timeout)
+
+    def watch_first_frame(self, widget, kind):
+        def on_draw(widget, _cairo):
+            widget.disconnect(handler_id)
+            self.first_frames[kind] = time.time() - self.started
+            dbg('First {} frame after {:.1f}ms'.format(
+                kind, self.first_frames[kind] * 1000))
+            return False
+        handler_id = widget.connect('draw', on_draw)
+
+    def on_placeholder_closed(self, _widget, _event):
+        self.state = 'done'
+        Gtk.main_quit()
+        return False
+
+    def layout_ready(self):
+        """Every connection has reported, may be called from the reader"""
+        GObject.idle_add(self.build)
+
+    def on_timeout(self):
+        self.timer = None
+        if self.state != 'connecting':
+            return False
+        dbg('tmux did not report its windows within {}s'.format(self.timeout))
+        self.timed_out = True
+        for control in self.terminator.tmux_controls:
+            if control.initial_layout is None:
+                # as if attaching failed, the terminals start a new session
+                control.disconnect()
+                control.initial_layout = {}
+        self.terminator.collect_tmux_layouts()
+        return False
+
+    def build(self):
+        if self.state != 'connecting':
+            return False
+        self.state = 'building'
+        if self.timer is not None:
+            GObject.source_remove(self.timer)
+            self.timer = None
+        self.terminator.build_layout(self.layoutname)
+        if self.terminator.windows:
+            self.watch_first_frame(self.terminator.windows[0], 'layout')
+        self.placeholder.destroy()
+        self.placeholder = None
+        self.state = 'done'
+        return False
+
+    def report(self):
+        """How long it took to show something, e.g. for the debug console"""
+        frames = ', '.join('{} after {:.1f}ms'.format(kind, seconds * 1000)
+                           for kind, seconds in sorted(
+                               self.first_frames.iteritems()))
+        return '{}{}{}'.format(self.state, frames and ': ' + frames,
+                               ' (timed out)' if self.timed_out else '')
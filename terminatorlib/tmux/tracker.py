@@ -0,0 +1,273 @@
+"""Tracking of the commands sent to a tmux control mode client.
+
+tmux answers every command it runs with a %begin/%end (or %error) block,
+tagged with a command number and with flag 1 set when the command came from
+this client. tmux numbers the commands of all its clients with one counter,
+so the number of a request is only known once its block arrives, but the
+commands of one client run in the order they were sent and with growing
+numbers. A client block newer than the last one is matched to the oldest
+request still waiting for one; a block numbered no higher than that was
+already accounted for and is handed to nobody. An %end or %error whose
+%begin never arrived still carries the number and the client flag: the
+oldest waiting request lost that block, and gives up its place rather than
+take the next request's answer. The number pairs an %end with its %begin.
+Blocks without the client flag (the initial attach-session/new-session,
+hooks) are only matched to a request explicitly waiting for one. A line
+holding several ';' separated commands gets one block per command.
+
+Requests that take too long are timed out: their callback is dropped but
+they keep their place in the queue, so a late answer can't be handed to the
+next request. Round trip times are kept in a histogram per command.
+"""
+
+import threading
+import time
+from collections import deque
+
+from terminatorlib.util import dbg
+
+CLIENT_FLAG = 1
+# upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def count_commands(command):
+    """Count the commands in a ';' separated tmux command line"""
+    count = 1
+    quote = None
+    escaped = False
+    length = len(command)
+    for index, char in enumerate(command):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == ';' and (index + 1 == length or
+                              command[index + 1] in ' \t'):
+            if command[index + 1:].strip():
+                count += 1
+    return count
+
+
+class Request(object):
+    """A command line waiting for its result blocks"""
+
+    __slots__ = ['command', 'kind', 'callback', 'blocks', 'initial',
+                 'sent', 'numbers', 'result', 'error', 'timed_out', 'lost']
+
+    def __init__(self, command, callback, blocks, initial):
+        self.command = command
+        self.kind = command.split(' ', 1)[0]
+        self.callback = callback
+        self.blocks = blocks
+        self.initial = initial
+        self.sent = time.time()
+        self.numbers = []
+        self.result = []
+        self.error = False
+        self.timed_out = False
+        # one of its blocks never arrived
+        self.lost = False
+
+    def __str__(self):
+        return 'Request[command="{}", numbers={}]'.format(self.command,
+                                                         self.numbers)
+
+
+class LatencyHistogram(object):
+    """Round trip times of one kind of command"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.timeouts = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, milliseconds):
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                if index < len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[index]
+                return self.maximum
+        return 0
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class RequestTracker(object):
+    """Match tmux result blocks to the requests that caused them"""
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.waiting = deque()
+        self.running = {}
+        self.histograms = {}
+        self.unmatched = 0
+        # number of the last client block
+        self.last_number = None
+
+    def __len__(self):
+        with self.lock:
+            return len(set(self.waiting).union(self.running.itervalues()))
+
+    def add(self, command, callback=None, initial=False):
+        """Register a command that was just sent.
+
+        initial marks the command tmux was started with, whose block does
+        not carry the client flag.
+        """
+        request = Request(command, callback, count_commands(command), initial)
+        with self.lock:
+            self.waiting.append(request)
+        return request
+
+    def clear(self):
+        """Forget the requests of a lost connection, the next one may be to
+        a new server numbering its commands from 0"""
+        with self.lock:
+            self.waiting.clear()
+            self.running.clear()
+            self.last_number = None
+
+    def next_request(self, number, flags):
+        """The request the block with number and flags belongs to, or None;
+        call with the lock held"""
+        client = int(flags) & CLIENT_FLAG
+        if client:
+            if self.last_number is not None and \
+               int(number) <= self.last_number:
+                dbg('Block {} arrived after block {}'.format(
+                    number, self.last_number))
+                return None
+            self.last_number = int(number)
+        if not self.waiting or number in self.running:
+            return None
+        request = self.waiting[0]
+        if not client and not request.initial:
+            return None
+        request.numbers.append(number)
+        if len(request.numbers) == request.blocks:
+            self.waiting.popleft()
+        return request
+
+    def begin(self, number, flags):
+        """A %begin arrived, return the request it answers, if any"""
+        with self.lock:
+            request = self.next_request(number, flags)
+            if request is None:
+                self.unmatched += 1
+                return None
+            self.running[number] = request
+            return request
+
+    def lost(self, number, flags):
+        """An %end or %error arrived without its %begin, the request it
+        answered loses its callback"""
+        with self.lock:
+            request = self.next_request(number, flags)
+            if request is None:
+                self.unmatched += 1
+                return None
+            complete = not any(pending in self.running
+                               for pending in request.numbers)
+        dbg('Lost block {} of {}'.format(number, request))
+        if not request.lost and not request.timed_out:
+            self.histogram(request.kind).timeouts += 1
+        request.lost = True
+        request.callback = None
+        if complete and len(request.numbers) == request.blocks:
+            self.record(request)
+        return request
+
+    def end(self, number, result, error):
+        """An %end or %error arrived, return the request if it is complete"""
+        with self.lock:
+            request = self.running.pop(number, None)
+            if request is None:
+                return None
+            request.result.extend(result)
+            request.error = request.error or error
+            if len(request.numbers) < request.blocks or \
+               any(pending in self.running for pending in request.numbers):
+                return None
+        self.record(request)
+        if request.timed_out:
+            dbg('Late answer for timed out {}'.format(request))
+            return None
+        if request.lost:
+            return None
+        return request
+
+    def complete(self, notification):
+        """Handle a whole Result notification"""
+        request = self.begin(notification.code, notification.flags)
+        if request is None:
+            return None
+        return self.end(notification.code, notification.result,
+                        notification.error)
+
+    def histogram(self, kind):
+        histogram = self.histograms.get(kind)
+        if histogram is None:
+            histogram = self.histograms[kind] = LatencyHistogram()
+        return histogram
+
+    def record(self, request):
+        histogram = self.histogram(request.kind)
+        if request.error:
+            histogram.errors += 1
+        histogram.add((time.time() - request.sent) * 1000)
+
+    def check_timeouts(self):
+        """Time out overdue requests, returns whether any are left"""
+        deadline = time.time() - self.timeout
+        with self.lock:
+            requests = list(self.waiting) + self.running.values()
+        for request in requests:
+            if request.sent < deadline and not request.timed_out:
+                dbg('Timed out: {}'.format(request))
+                request.timed_out = True
+                request.callback = None
+                if not request.lost:
+                    self.histogram(request.kind).timeouts += 1
+        return bool(requests)
+
+    def report(self):
+        """Describe the round trip times seen so far, for the debug console"""
+        lines = ['{:<20} {:>7} {:>9} {:>7} {:>7} {:>9} {:>6} {:>6}'.format(
+            'command', 'count', 'mean ms', 'p50', 'p99', 'max ms',
+            'errors', 'lost')]
+        for kind in sorted(self.histograms):
+            histogram = self.histograms[kind]
+            lines.append(
+                '{:<20} {:>7} {:>9.1f} {:>7} {:>7} {:>9.1f} {:>6} {:>6}'
+                .format(kind, histogram.count, histogram.mean(),
+                        histogram.percentile(0.5), histogram.percentile(0.99),
+                        histogram.maximum, histogram.errors,
+                        histogram.timeouts))
+        lines.append('{} in flight, {} unmatched blocks'.format(
+            len(self), self.unmatched))
+        return '\n'.join(lines)
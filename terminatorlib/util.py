@@ -20,7 +20,8 @@ import sys
 import cairo
 import os
 import pwd
-import inspect
+import json
+import time
 import uuid
 import subprocess
 import gi
@@ -32,41 +33,77 @@ except ImportError:
     print('You need Gtk 3.0+ to run Remotinator.')
     sys.exit(1)
 
-# set this to true to enable debugging output
-DEBUG = True
+# set this to true to enable debugging output, see set_debug()
+DEBUG = False
 # set this to true to additionally list filenames in debugging
 DEBUGFILES = False
 # list of classes to show debugging for. empty list means show all classes
 DEBUGCLASSES = []
 # list of methods to show debugging for. empty list means show all methods
 DEBUGMETHODS = []
-
-def dbg(log = ""):
-    """Print a message if debugging is enabled"""
-    if DEBUG:
-        stackitem = inspect.stack()[1]
-        parent_frame = stackitem[0]
-        method = parent_frame.f_code.co_name
-        names, varargs, keywords, local_vars = inspect.getargvalues(parent_frame)
+# set this to true to write debugging output as JSON lines, with timestamps
+DEBUGSTRUCTURED = False
+
+# DEBUGCLASSES and DEBUGMETHODS as sets, see set_debug()
+_debug_classes = frozenset()
+_debug_methods = frozenset()
+
+def set_debug(enabled=True, files=False, classes=(), methods=(),
+              structured=False):
+    """Configure debugging output, limited to the given classes and methods
+    if there are any"""
+    global DEBUG, DEBUGFILES, DEBUGSTRUCTURED, _debug_classes, _debug_methods
+    DEBUG = enabled
+    DEBUGFILES = files
+    DEBUGSTRUCTURED = structured
+    DEBUGCLASSES[:] = classes
+    DEBUGMETHODS[:] = methods
+    _debug_classes = frozenset(DEBUGCLASSES)
+    _debug_methods = frozenset(DEBUGMETHODS)
+
+def dbg(log = "", *args):
+    """Print a message if debugging is enabled. Any args are %-formatted
+    into log only if the message is printed, so that hot paths can log
+    without building strings nobody reads:
+
+        dbg('%s found in profile %s', key, profile)
+    """
+    if not DEBUG:
+        return
+    parent_frame = sys._getframe(1)
+    code = parent_frame.f_code
+    method = code.co_name
+    if _debug_methods and method not in _debug_methods:
+        return
+    # the class of the first argument, normally self
+    classname = "noclass"
+    if code.co_argcount:
         try:
-            self_name = names[0]
-            classname = local_vars[self_name].__class__.__name__
-        except IndexError:
-            classname = "noclass"
+            classname = parent_frame.f_locals[code.co_varnames[0]].__class__.__name__
+        except KeyError:
+            pass
+    if _debug_classes and classname not in _debug_classes:
+        return
+    if args:
+        log = log % args
+    try:
+        if DEBUGSTRUCTURED:
+            if not isinstance(log, unicode):
+                log = str(log).decode('utf-8', 'replace')
+            record = {'time': time.time(), 'class': classname,
+                      'method': method, 'message': log}
+            if DEBUGFILES:
+                record['file'] = code.co_filename
+                record['line'] = parent_frame.f_lineno
+            print >> sys.stderr, json.dumps(record)
+            return
         if DEBUGFILES:
-            line = stackitem[2]
-            filename = parent_frame.f_code.co_filename
-            extra = " (%s:%s)" % (filename, line)
+            extra = " (%s:%s)" % (code.co_filename, parent_frame.f_lineno)
         else:
             extra = ""
-        if DEBUGCLASSES != [] and classname not in DEBUGCLASSES:
-            return
-        if DEBUGMETHODS != [] and method not in DEBUGMETHODS:
-            return
-        try:
-            print >> sys.stderr, "%s::%s: %s%s" % (classname, method, log, extra)
-        except IOError:
-            pass
+        print >> sys.stderr, "%s::%s: %s%s" % (classname, method, log, extra)
+    except IOError:
+        pass
 
 def err(log = ""):
     """Print an error message"""
@@ -356,10 +393,10 @@ def inject_uuid(target):
     """Inject a UUID into an existing object"""
     uuid = make_uuid()
     if not hasattr(target, "uuid") or target.uuid == None:
-        dbg("Injecting UUID %s into: %s" % (uuid, target))
+        dbg("Injecting UUID %s into: %s", uuid, target)
         target.uuid = uuid
     else:
-        dbg("Object already has a UUID: %s" % target)
+        dbg("Object already has a UUID: %s", target)
 
 def spawn_new_terminator(cwd, args):
     """Start a new terminator instance with the given arguments"""
@@ -10,13 +10,14 @@ import gi
 from gi.repository import GObject
 from gi.repository import Gtk, Gdk, GdkX11
 
-from util import dbg, err, make_uuid, display_manager
+from util import dbg, err, make_uuid, display_manager, get_column_row_count
 import util
 from translation import _
 from version import APP_NAME
 from container import Container
 from factory import Factory
 from terminator import Terminator
+from registry import indexed_property
 
 if display_manager() == 'X11':
     try:
@@ -55,6 +56,9 @@ class Window(Container, Gtk.Window):
                             GObject.PARAM_READWRITE)
     }
 
+    # Terminator finds windows by it
+    uuid = indexed_property('uuid', 'update_window')
+
     def __init__(self):
         """Class initialiser"""
         self.terminator = Terminator()
@@ -96,6 +100,8 @@ class Window(Container, Gtk.Window):
 
         self.apply_icon(icon_to_apply)
         self.pending_set_rough_geometry_hint = False
+        self.pending_tmux_resize = False
+        self.tmux_resized_terminals = set()
 
     def do_get_property(self, prop):
         """Handle gobject getting a property"""
@@ -452,7 +458,8 @@ class Window(Container, Gtk.Window):
         Container.closeterm(self, widget)
         self.hoover()
 
-    def split_axis(self, widget, vertical=True, cwd=None, sibling=None, widgetfirst=True):
+    def split_axis(self, widget, vertical=True, cwd=None, sibling=None,
+            widgetfirst=True, focus=True):
         """Split the window"""
         if self.get_property('term_zoomed') == True:
             err("You can't split while a terminal is maximised/zoomed")
@@ -495,7 +502,8 @@ class Window(Container, Gtk.Window):
         
         while Gtk.events_pending():
             Gtk.main_iteration_do(False)
-        sibling.grab_focus()
+        if focus:
+            sibling.grab_focus()
         self.set_pos_by_ratio = False
 
 
@@ -614,6 +622,42 @@ class Window(Container, Gtk.Window):
         self.pending_set_rough_geometry_hint = False
         self.set_rough_geometry_hints()
 
+    def deferred_tmux_resize(self, terminal):
+        """Tell tmux about a terminal's new size once the layout has settled,
+        together with every other terminal resized in the meantime"""
+        self.tmux_resized_terminals.add(terminal)
+        if self.pending_tmux_resize == True:
+            return
+        self.pending_tmux_resize = True
+        GObject.idle_add(self.do_deferred_tmux_resize)
+
+    def do_deferred_tmux_resize(self):
+        self.pending_tmux_resize = False
+        terminals = self.tmux_resized_terminals
+        self.tmux_resized_terminals = set()
+        column_count, row_count = map(int, get_column_row_count(self))
+        controls = set(terminal.control for terminal in terminals
+                       if terminal.control)
+        for control in controls:
+            if column_count != control.width or row_count != control.height:
+                # tmux lays the panes out again to fit the new client size
+                control.refresh_client(column_count, row_count)
+                continue
+            # the client size is unchanged, so the user moved a divider or
+            # rotated: send the layouts of windows with panes tmux doesn't
+            # have at our size
+            pane_sizes = control.notifications_handler.pane_sizes()
+            resized = []
+            for terminal in terminals:
+                if terminal.control is not control or not terminal.pane_id:
+                    continue
+                size = terminal.get_size()
+                if pane_sizes.get(terminal.pane_id, size) != size:
+                    resized.append(terminal)
+            if resized:
+                control.notifications_handler.push_layouts(resized)
+        return False
+
     def set_rough_geometry_hints(self):
         """Walk all the terminals along the top and left edges to fake up how
         many columns/rows we sort of have"""
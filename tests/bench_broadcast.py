@@ -0,0 +1,87 @@
+#!/usr/bin/env python2
+"""Benchmark broadcasting a key press to 10, 50 and 200 terminals.
+
+Times the per key fan-out latency of re-emitting key-press-event on every
+target VTE, each running a keybinding lookup like Terminal.on_keypress
+does (before), against the Broadcaster writing the translated bytes
+straight to every target's pty (after). The targets are bare VTE widgets
+running `cat`, so that their ptys have a reader.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('Vte', '2.91')
+from gi.repository import Gtk, Gdk, GLib, Vte
+
+from terminatorlib.broadcast import Broadcaster, eventkey2gdkevent
+from terminatorlib.keybindings import Keybindings
+from terminatorlib.config import Config
+
+TEXT = 'echo hello broadcast world\r'
+TARGETS = [10, 50, 200]
+
+
+class Target(object):
+
+    def __init__(self, keybindings):
+        self.vte = Vte.Terminal()
+        self.vte.spawn_sync(Vte.PtyFlags.DEFAULT, None, ['/bin/cat'], None,
+                            GLib.SpawnFlags.DEFAULT, None, None, None)
+        self.vte.connect('key-press-event', self.on_keypress)
+        self.keybindings = keybindings
+        self.control = None
+        self.pane_id = None
+
+    def on_keypress(self, _widget, event):
+        # what every receiver did before handing the key to VTE
+        self.keybindings.lookup(event)
+        return False
+
+
+def key_event(char):
+    event = Gdk.Event.new(Gdk.EventType.KEY_PRESS)
+    event.key.keyval = Gdk.unicode_to_keyval(ord(char))
+    event.key.string = char
+    event.key.length = 1
+    event.key.state = 0
+    event.key.is_modifier = False
+    return event.key
+
+
+def emitted(source, targets, event):
+    for target in targets:
+        if target is not source:
+            target.vte.emit('key-press-event', eventkey2gdkevent(event))
+
+
+def run(name, targets, method):
+    events = [key_event(char) for char in TEXT]
+    start = time.time()
+    for event in events:
+        method(targets[0], targets, event)
+    elapsed = time.time() - start
+    while Gtk.events_pending():
+        Gtk.main_iteration_do(False)
+    print '{:<24} {:>4} targets {:>10.3f} ms/key'.format(
+        name, len(targets), elapsed / len(events) * 1000)
+
+
+def main():
+    keybindings = Keybindings()
+    keybindings.configure(Config()['keybindings'])
+    broadcaster = Broadcaster()
+    for count in TARGETS:
+        targets = [Target(keybindings) for _ in xrange(count)]
+        run('emitted (before)', targets, emitted)
+        run('direct to pty', targets, broadcaster.broadcast)
+        for target in targets:
+            target.vte.destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+"""Benchmark config lookups on the paths Terminal.reconfigure takes.
+
+Times looking up every item Terminal.reconfigure and Titlebar.update read,
+through Config with the per-profile view (after) and through the
+has_key chain ConfigBase.get_item used to walk (before), with debugging
+off and with it on but filtered out by DEBUGCLASSES.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+from terminatorlib import util
+from terminatorlib.config import Config
+
+ROUNDS = 2000
+KEYS = [
+    # Terminal.reconfigure
+    'allow_bold', 'audible_bell', 'background_color', 'background_darkness',
+    'background_type', 'backspace_binding', 'cursor_blink', 'cursor_shape',
+    'delete_binding', 'encoding', 'exit_action', 'font', 'force_no_bell',
+    'foreground_color', 'icon_bell', 'inactive_color_offset',
+    'mouse_autohide', 'palette', 'rewrap_on_resize', 'scroll_on_keystroke',
+    'scroll_on_output', 'scrollback_infinite', 'scrollback_lines',
+    'scrollbar_position', 'urgent_bell', 'use_system_font',
+    'use_theme_colors', 'visible_bell', 'word_chars',
+    # Titlebar.update and get_desired_visibility
+    'title_hide_sizetext', 'show_titlebar',
+]
+
+
+def chain_get_item(base, key, profile='default', plugin=None, default=None):
+    """ConfigBase.get_item as it was"""
+    if not base.profiles.has_key(profile):
+        profile = 'default'
+
+    if base.global_config.has_key(key):
+        util.dbg('ConfigBase::get_item: %s found in globals: %s', key,
+                 base.global_config[key])
+        return(base.global_config[key])
+    elif base.profiles[profile].has_key(key):
+        util.dbg('ConfigBase::get_item: %s found in profile %s: %s', key,
+                 profile, base.profiles[profile][key])
+        return(base.profiles[profile][key])
+    elif key == 'keybindings':
+        return(base.keybindings)
+    elif plugin and plugin in base.plugins and key in base.plugins[plugin]:
+        return(base.plugins[plugin][key])
+    elif default:
+        return default
+    else:
+        raise KeyError('ConfigBase::get_item: unknown key %s' % key)
+
+
+def run(name, lookup):
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        for key in KEYS:
+            lookup(key)
+    elapsed = time.time() - start
+    print '{:<36} {:>10.3f} us/lookup'.format(
+        name, elapsed / (ROUNDS * len(KEYS)) * 1e6)
+
+
+def main():
+    config = Config()
+    before = lambda key: chain_get_item(config.base, key, config.profile)
+    after = config.__getitem__
+    util.set_debug(enabled=False)
+    run('debugging off, has_key chain', before)
+    run('debugging off, profile view', after)
+    util.set_debug(classes=['Nothing'])
+    run('filtered out, has_key chain', before)
+    run('filtered out, profile view', after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+"""Benchmark the cost of dbg() on a hot path.
+
+Times a ConfigBase.get_item style lookup that logs every call: with
+debugging off, with debugging on but filtered out by DEBUGCLASSES, and,
+for both, with the message built eagerly by the caller (`dbg(msg % args)`)
+and deferred (`dbg(msg, *args)`). The inspect based dbg() this replaced is
+timed too for the filtered case, which used to read the whole stack.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import inspect
+import time
+from terminatorlib import util
+
+CALLS = 100000
+
+
+def inspect_dbg(log=""):
+    """dbg() as it was, up to the filters"""
+    if util.DEBUG:
+        stackitem = inspect.stack()[1]
+        parent_frame = stackitem[0]
+        method = parent_frame.f_code.co_name
+        names, varargs, keywords, local_vars = inspect.getargvalues(parent_frame)
+        try:
+            self_name = names[0]
+            classname = local_vars[self_name].__class__.__name__
+        except IndexError:
+            classname = "noclass"
+        if util.DEBUGCLASSES != [] and classname not in util.DEBUGCLASSES:
+            return
+
+
+class Lookup(object):
+
+    def __init__(self):
+        self.config = {'scrollback_lines': 500, 'font': 'Mono 10'}
+
+    def eager(self, key):
+        util.dbg('Lookup::eager: %s found in globals: %s' %
+                 (key, self.config[key]))
+        return self.config[key]
+
+    def deferred(self, key):
+        util.dbg('Lookup::deferred: %s found in globals: %s', key,
+                 self.config[key])
+        return self.config[key]
+
+    def inspected(self, key):
+        inspect_dbg('Lookup::inspected: %s found in globals: %s' %
+                    (key, self.config[key]))
+        return self.config[key]
+
+    def silent(self, key):
+        return self.config[key]
+
+
+def run(name, method, calls=CALLS):
+    start = time.time()
+    for _ in xrange(calls):
+        method('scrollback_lines')
+    elapsed = time.time() - start
+    print '{:<36} {:>10.3f} us/call'.format(name, elapsed / calls * 1e6)
+
+
+def main():
+    lookup = Lookup()
+    run('no logging', lookup.silent)
+    util.set_debug(enabled=False)
+    run('debugging off, eager message', lookup.eager)
+    run('debugging off, deferred message', lookup.deferred)
+    util.set_debug(classes=['Nothing'])
+    run('filtered out, eager message', lookup.eager)
+    run('filtered out, deferred message', lookup.deferred)
+    run('filtered out, inspect (before)', lookup.inspected, CALLS // 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+"""Benchmark the control pipe cost of typing into a tmux pane.
+
+Compares the one-command-per-key path (send_content) with the batched
+`send-keys -H` pipeline (queue_keys/flush_keys), reporting commands,
+bytes written per typed character and commands generated per second.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+from terminatorlib.tmux.control import TmuxControl
+
+TEXT = "for f in *.py; do echo \"$f\"; grep -n 'import' $f; done\r" * 200
+PANES = ['%0', '%1', '%2', '%3']
+
+
+class CountingPipe(object):
+
+    def __init__(self):
+        self.commands = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.commands += data.count('\n')
+        self.bytes += len(data)
+
+
+def make_control():
+    control = TmuxControl('bench', notifications_handler=None)
+    control.input = CountingPipe()
+    return control
+
+
+def per_key(control, burst):
+    for char in TEXT:
+        for pane_id in PANES:
+            control.send_content(char, pane_id)
+
+
+def batched(control, burst):
+    for start in xrange(0, len(TEXT), burst):
+        for char in TEXT[start:start + burst]:
+            for pane_id in PANES:
+                control.queue_keys(char, pane_id)
+        # one main loop iteration
+        control.flush_keys()
+
+
+def run(name, method, burst):
+    control = make_control()
+    start = time.time()
+    method(control, burst)
+    elapsed = time.time() - start
+    typed = len(TEXT) * len(PANES)
+    pipe = control.input
+    print '{:<28} {:>8} cmds {:>8.2f} bytes/char {:>12.0f} cmds/s'.format(
+        name, pipe.commands, float(pipe.bytes) / typed,
+        pipe.commands / elapsed if elapsed else 0)
+
+
+def main():
+    print '{} characters typed into {} broadcast panes'.format(
+        len(TEXT), len(PANES))
+    run('per key (before)', per_key, 1)
+    for burst in (1, 4, 16):
+        run('batched, {} keys/tick'.format(burst), batched, burst)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+"""Benchmark parsing of large tmux layout strings.
+
+Generates deeply nested layouts with 50+ panes and times the layout parser
+with and without its cache. If pyparsing is installed, the grammar that was
+previously used for tmux layouts is timed as well.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+from terminatorlib.tmux.layout import LayoutParser, parse_layout, layout_checksum
+
+REPEAT = 200
+
+
+def split(width, height, x, y, panes, depth, counter):
+    """Describe a width x height cell at x,y holding `panes` panes, splitting
+    alternately left/right and top/bottom"""
+    if panes == 1:
+        counter[0] += 1
+        return '{}x{},{},{},{}'.format(width, height, x, y, counter[0] - 1)
+    first = panes // 2
+    if depth % 2:
+        top = height * first // panes
+        children = [split(width, top, x, y, first, depth + 1, counter),
+                    split(width, height - top - 1, x, y + top + 1,
+                          panes - first, depth + 1, counter)]
+        start, end = '[', ']'
+    else:
+        left = width * first // panes
+        children = [split(left, height, x, y, first, depth + 1, counter),
+                    split(width - left - 1, height, x + left + 1, y,
+                          panes - first, depth + 1, counter)]
+        start, end = '{', '}'
+    return '{}x{},{},{}{}{}{}'.format(width, height, x, y, start,
+                                       ','.join(children), end)
+
+
+def make_layout(panes):
+    body = split(1000, 500, 0, 0, panes, 0, [0])
+    return '{},{}'.format(layout_checksum(body), body)
+
+
+def legacy_parser():
+    try:
+        from pyparsing import (Word, nums, hexnums, Suppress, Literal, Group,
+                               Forward, OneOrMore, Optional)
+    except ImportError:
+        return None
+    decimal = Word(nums)
+    comma = Suppress(Literal(','))
+    start_token = Literal('{') | Literal('[')
+    end_token = Suppress(Literal('}') | Literal(']'))
+    layout_name = Suppress(Word(hexnums, min=4, max=4))
+    size = decimal("width") + Suppress(Literal('x')) + decimal("height")
+    preamble = size + comma + decimal("x") + comma + decimal("y")
+    pane = Group(preamble + comma + decimal("pane_id"))
+    element = Forward()
+    container = Group(preamble + start_token + OneOrMore(element) + end_token)
+    element << (container | pane) + Optional(comma)
+    grammar = layout_name + comma + OneOrMore(element)
+    return lambda layout: grammar.parseString(layout).asList()
+
+
+def run(name, method, layout):
+    start = time.time()
+    for _ in xrange(REPEAT):
+        method(layout)
+    elapsed = time.time() - start
+    print '  {:<16} {:>10.1f} us/parse'.format(name, elapsed / REPEAT * 1e6)
+
+
+def main():
+    legacy = legacy_parser()
+    for panes in (16, 50, 100, 200):
+        layout = make_layout(panes)
+        print '{} panes, {} bytes'.format(panes, len(layout))
+        if legacy:
+            run('pyparsing', legacy, layout)
+        run('single pass', parse_layout, layout)
+        run('cached', LayoutParser().parse, layout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+"""Benchmark the per-notification cost of parsing and dispatching.
+
+Usage: bench_tmux_notifications.py
+
+A stream of COUNT control mode lines mixing the notifications tmux sends
+while windows are busy (%output, %layout-change, %window-renamed, ...) and
+some it has no parser for is parsed by NotificationParser, then dispatched
+the old way (a 'handle_<marker>' getattr per notification) and through
+NotificationsHandler's dispatch table, with handlers that do nothing. The
+cost of each is given per notification and as the share of a CPU it takes
+at RATE notifications/s.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+from terminatorlib.config import Config
+from terminatorlib.tmux import notifications, reader
+
+COUNT = 100000
+RATE = 100000
+SAMPLES = [
+    '%output %1 make[2]: Entering directory \'/src\'\\015\\012',
+    '%output %2 \\033[32mok\\033[0m\\015\\012',
+    '%layout-change @1 b25d,80x24,0,0,0 b25d,80x24,0,0,0 *',
+    '%window-renamed @1 make',
+    '%session-window-changed $1 @1',
+    '%output %1 \\033[1;31merror\\033[0m: missing \\134\\015\\012',
+    '%sessions-changed',
+    '%client-session-changed /dev/pts/3 $1 bench',
+]
+
+
+class Terminator(object):
+    config = Config()
+    last_focused_term = None
+
+
+class NullHandler(notifications.NotificationsHandler):
+
+    def __init__(self):
+        notifications.NotificationsHandler.__init__(self, Terminator())
+
+    def handle_output(self, notification):
+        pass
+
+    def handle_layout_change(self, notification):
+        pass
+
+
+def getattr_dispatch(handler, parsed):
+    for notification in parsed:
+        try:
+            handler_method = getattr(handler, 'handle_{}'.format(
+                    notification.marker.replace('-', '_')))
+            handler_method(notification)
+        except AttributeError:
+            pass
+
+
+def table_dispatch(handler, parsed):
+    handler.handle_batch(parsed)
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def report(name, elapsed, count):
+    print '{:<10} {:>6.2f} us/notification, {:>5.1f}% of a CPU at {}/s'.format(
+        name, elapsed / count * 1e6, elapsed / count * RATE * 100, RATE)
+
+
+def main():
+    data = '\n'.join(SAMPLES[index % len(SAMPLES)]
+                     for index in xrange(COUNT)) + '\n'
+    parser = reader.NotificationParser()
+    elapsed, parsed = timed(parser.feed, data)
+    report('parse', elapsed, COUNT)
+    handler = NullHandler()
+    for name, dispatch in [('getattr', getattr_dispatch),
+                           ('table', table_dispatch)]:
+        elapsed, _ = timed(dispatch, handler, parsed)
+        report(name, elapsed, len(parsed))
+    print '{} notifications, unknown markers: {}'.format(
+        len(parsed), ', '.join('{} x{}'.format(marker, count) for marker, count
+                               in sorted(parser.unknown.iteritems())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+"""Benchmark decoding of recorded tmux %output streams.
+
+Usage: bench_tmux_output.py [recording ...]
+
+Recordings are raw `tmux -C` transcripts; tests/data holds one captured from
+a colourised build log. The old path (split, join, string_escape) is timed
+against terminatorlib.tmux.output, both including the alternate screen scan
+and bell workaround done by NotificationsHandler.handle_output.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+from terminatorlib.tmux.output import OUTPUT_PREFIX, parse_output_line
+
+RECORDING = os.path.join(os.path.dirname(__file__), 'data',
+                         'tmux-control-build.log')
+ENTER, EXIT = '\033[?1049h', '\033[?1049l'
+ESCAPED_ENTER, ESCAPED_EXIT = '\\033[?1049h', '\\033[?1049l'
+REPEAT = 200
+
+
+def load(paths):
+    lines = []
+    for path in paths:
+        with open(path) as recording:
+            lines.extend(line[:-1] for line in recording
+                         if line.startswith(OUTPUT_PREFIX))
+    return lines
+
+
+def split_join(lines):
+    decoded = 0
+    for line in lines:
+        fields = line[1:].split(' ')
+        output = ' '.join(fields[2:])
+        ESCAPED_ENTER in output
+        ESCAPED_EXIT in output
+        decoded += len(output.decode('string_escape').replace('\033g', ''))
+    return decoded
+
+
+def single_pass(lines):
+    decoded = 0
+    for line in lines:
+        pane_id, output = parse_output_line(line)
+        ENTER in output
+        EXIT in output
+        decoded += len(output.replace('\033g', ''))
+    return decoded
+
+
+def run(name, method, lines):
+    start = time.time()
+    for _ in xrange(REPEAT):
+        decoded = method(lines)
+    elapsed = time.time() - start
+    print '{:<14} {:>8.1f} MB/s decoded, {:>9.0f} lines/s'.format(
+        name, decoded * REPEAT / elapsed / 1e6, len(lines) * REPEAT / elapsed)
+
+
+def main():
+    lines = load(sys.argv[1:] or [RECORDING])
+    print '{} %output lines, {} bytes raw'.format(
+        len(lines), sum(len(line) for line in lines))
+    run('split/join', split_join, lines)
+    run('single pass', single_pass, lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python2
+"""Benchmark the tmux pipeline end to end, against a fake tmux.
+
+Usage: bench_tmux_pipeline.py [recording ...]
+
+TmuxControl and NotificationsHandler run in a GLib main loop, as in
+Terminator, connected to tests/fake_tmux.py instead of tmux, once with each
+reader (tmux_reader). Decoded output is queued and drained as usual, only
+there are no terminals to feed it to.
+
+replay    the recordings are replayed REPEAT times as fast as the pipe
+          takes them; notifications/s and MB/s of output drained
+latency   command round trips, one at a time and PIPELINED at once, with
+          nothing else going on and while the recordings are replayed at
+          LOADED_RATE bytes/s
+
+Every run also reports how late a TICK_MS timer fired, i.e. for how long the
+main loop was kept from redrawing and handling input.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import tempfile
+import time
+from gi.repository import GLib
+from terminatorlib.config import Config
+from terminatorlib.tmux import control, notifications
+
+FAKE_TMUX = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         'fake_tmux.py')
+RECORDING = os.path.join(os.path.dirname(__file__), 'data',
+                         'tmux-control-build.log')
+REPEAT = 200
+LOADED_RATE = 2000000
+ROUND_TRIPS = 500
+PIPELINED = 500
+TICK_MS = 5
+PING = 'display -p -t %0 "#{cursor_x} #{cursor_y}"'
+
+
+class StallMeter(object):
+    """Measure how late a periodic timer runs"""
+
+    def __init__(self):
+        self.last = None
+        self.ticks = 0
+        self.stalled = 0.0
+        self.worst = 0.0
+        self.source = None
+
+    def start(self):
+        self.last = time.time()
+        self.source = GLib.timeout_add(TICK_MS, self.tick)
+
+    def stop(self):
+        GLib.source_remove(self.source)
+
+    def tick(self):
+        now = time.time()
+        late = now - self.last - TICK_MS / 1000.0
+        self.last = now
+        self.ticks += 1
+        if late > 0:
+            self.stalled += late
+            self.worst = max(self.worst, late)
+        return True
+
+    def __str__(self):
+        return 'main loop stalled {:.0f} ms in total, {:.1f} ms at worst'.format(
+            self.stalled * 1000, self.worst * 1000)
+
+
+class BenchTerminator(object):
+
+    def __init__(self, attached):
+        self.config = Config()
+        self.last_focused_term = None
+        self.tmux_controls = []
+        self.windows = []
+        self.attached = attached
+
+    def collect_tmux_layouts(self):
+        self.attached()
+
+
+class BenchHandler(notifications.NotificationsHandler):
+    """Count notifications and stop the main loop once tmux exits and the
+    output queue is drained"""
+
+    def __init__(self, terminator, loop):
+        notifications.NotificationsHandler.__init__(self, terminator)
+        self.loop = loop
+        self.count = 0
+
+    def handle(self, notification):
+        self.count += 1
+        notifications.NotificationsHandler.handle(self, notification)
+
+    def handle_batch(self, batch):
+        self.count += len(batch)
+        notifications.NotificationsHandler.handle_batch(self, batch)
+
+    def terminate(self):
+        def finish():
+            if self.output_queue.queued_bytes:
+                return True
+            self.loop.quit()
+            return False
+        GLib.timeout_add(10, finish)
+
+
+def write_script(lines):
+    script = tempfile.NamedTemporaryFile(suffix='.fake-tmux')
+    script.write(''.join('{}\n'.format(line) for line in lines))
+    script.flush()
+    return script
+
+
+def run(reader, script_lines, attached=None):
+    """Attach to the fake tmux and run the main loop until it exits"""
+    Config()['tmux_reader'] = reader
+    control.TMUX_BINARY = FAKE_TMUX
+    script = write_script(script_lines)
+    os.environ['FAKE_TMUX_SCRIPT'] = script.name
+    loop = GLib.MainLoop()
+    stalls = StallMeter()
+    terminator = BenchTerminator(lambda: attached and attached(tmux_control))
+    handler = BenchHandler(terminator, loop)
+    tmux_control = control.TmuxControl('bench', handler)
+    terminator.tmux_controls.append(tmux_control)
+    stalls.start()
+    start = time.time()
+    tmux_control.attach_session()
+    loop.run()
+    elapsed = time.time() - start
+    stalls.stop()
+    tmux_control.tmux.wait()
+    return handler, elapsed, stalls
+
+
+def bench_replay(reader, recordings):
+    handler, elapsed, stalls = run(
+        reader, ['replay {} 0 {}'.format(path, REPEAT) for path in recordings] +
+        ['exit'])
+    print '{:<8} replay   {:>8.1f} MB/s, {:>9.0f} notifications/s, {}'.format(
+        reader, handler.output_queue.fed_bytes / elapsed / 1e6,
+        handler.count / elapsed, stalls)
+
+
+class Pinger(object):
+    """Send PING one at a time, then PIPELINED at once, then kill the
+    session"""
+
+    def __init__(self):
+        self.round_trips = []
+        self.pipelined = []
+        self.sent = None
+
+    def start(self, tmux_control):
+        self.control = tmux_control
+        self.ping()
+
+    def ping(self):
+        self.sent = time.time()
+        self.control._run_command(PING, callback=self.pong)
+
+    def pong(self, result):
+        self.round_trips.append(time.time() - self.sent)
+        if len(self.round_trips) < ROUND_TRIPS:
+            self.ping()
+            return
+        self.sent = time.time()
+        self.control._run_commands([(PING, self.pipelined_pong)] * PIPELINED)
+
+    def pipelined_pong(self, result):
+        self.pipelined.append(time.time() - self.sent)
+        if len(self.pipelined) == PIPELINED:
+            self.control._run_command('kill-session')
+
+
+def percentiles(times):
+    times = sorted(times)
+    return 'p50 {:>6.2f} ms, p99 {:>6.2f} ms, max {:>6.2f} ms'.format(
+        times[len(times) // 2] * 1000, times[len(times) * 99 // 100] * 1000,
+        times[-1] * 1000)
+
+
+def bench_latency(reader, recordings, loaded):
+    pinger = Pinger()
+    script = []
+    if loaded:
+        script = ['replay {} {} 1000'.format(path, LOADED_RATE)
+                  for path in recordings]
+    _, _, stalls = run(reader, script, attached=pinger.start)
+    name = 'loaded' if loaded else 'idle'
+    print '{:<8} {:<8} one at a time: {}'.format(
+        reader, name, percentiles(pinger.round_trips))
+    print '{:<8} {:<8} pipelined:     {}'.format(
+        '', '', percentiles(pinger.pipelined))
+    print '{:<8} {:<8} {}'.format('', '', stalls)
+
+
+def main():
+    recordings = [os.path.realpath(path)
+                  for path in sys.argv[1:] or [RECORDING]]
+    for reader in ('thread', 'watch'):
+        bench_replay(reader, recordings)
+        bench_latency(reader, recordings, loaded=False)
+        bench_latency(reader, recordings, loaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+"""Benchmark the tmux control mode readers by replaying a recording.
+
+Usage: bench_tmux_reader.py [recording ...]
+
+The recordings (raw `tmux -C` transcripts, tests/data holds one) are written
+REPEAT times by a child process standing in for tmux, and read back through
+a pipe by the threaded line reader (TmuxControl.consume_notifications) and
+by the non-blocking, buffered ControlReader, driven by select() the way the
+main loop would. Handling is reduced to counting notifications.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import fcntl
+import select
+import subprocess
+import tempfile
+import time
+from terminatorlib.tmux import control, reader
+
+RECORDING = os.path.join(os.path.dirname(__file__), 'data',
+                         'tmux-control-build.log')
+REPEAT = 500
+
+
+class CountingHandler(object):
+
+    def __init__(self, expected, tmux):
+        self.expected = expected
+        self.tmux = tmux
+        self.count = 0
+        self.batches = 0
+
+    def handle(self, notification):
+        self.count += 1
+        if self.count == self.expected:
+            # let the fake tmux exit
+            self.tmux.stdin.close()
+
+    handle_output = handle
+
+    def handle_batch(self, notifications):
+        self.batches += 1
+        for notification in notifications:
+            self.handle(notification)
+
+    def terminate(self):
+        pass
+
+
+def spawn(path):
+    return subprocess.Popen(['sh', '-c', 'cat "$0"; exec cat >/dev/null',
+                             path],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+def thread_reader(path, expected):
+    tmux = spawn(path)
+    handler = CountingHandler(expected, tmux)
+    tmux_control = control.TmuxControl('bench', handler)
+    tmux_control.tmux = tmux
+    tmux_control.output = tmux.stdout
+    tmux_control.consume_notifications()
+    return handler
+
+
+def watch_reader(path, expected):
+    tmux = spawn(path)
+    handler = CountingHandler(expected, tmux)
+    control_reader = reader.ControlReader(tmux.stdout, handler)
+    flags = fcntl.fcntl(control_reader.fd, fcntl.F_GETFL)
+    fcntl.fcntl(control_reader.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    control_reader.source = 'bench'
+    while handler.count < expected:
+        select.select([control_reader.fd], [], [])
+        if not control_reader.on_readable():
+            break
+    tmux.wait()
+    return handler
+
+
+def run(name, method, path, expected, size):
+    start = time.time()
+    handler = method(path, expected)
+    elapsed = time.time() - start
+    assert handler.count == expected, (handler.count, expected)
+    print '{:<8} {:>8.1f} MB/s, {:>9.0f} notifications/s, {:>6} batches'.format(
+        name, size / elapsed / 1e6, expected / elapsed, handler.batches)
+
+
+def main():
+    data = ''
+    for path in sys.argv[1:] or [RECORDING]:
+        with open(path) as recording:
+            data += recording.read()
+    data *= REPEAT
+    expected = len(reader.NotificationParser().feed(data))
+    replay = tempfile.NamedTemporaryFile(suffix='.log')
+    replay.write(data)
+    replay.flush()
+    print '{} notifications, {} bytes'.format(expected, len(data))
+    run('thread', thread_reader, replay.name, expected, len(data))
+    run('watch', watch_reader, replay.name, expected, len(data))
+
+
+if __name__ == '__main__':
+    main()
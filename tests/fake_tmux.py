@@ -0,0 +1,456 @@
+#!/usr/bin/env python2
+"""A stand-in for `tmux -C`, for tests and benchmarks without a real tmux.
+
+Usage: fake_tmux.py [-2] -C attach-session|new-session [options]
+
+Point TmuxControl at it by setting terminatorlib.tmux.control.TMUX_BINARY
+to this file. It serves one session holding one window with pane %0 and
+speaks enough of the control protocol for Terminator: every command gets a
+%begin/%end (or %error) block, list-windows, list-panes, display -p and
+capture-pane answer from the fake panes, split-window and new-window add
+panes and send %layout-change/%window-add, and send-keys echoes what was
+typed as %output. `refresh-client -B name:%*:format` subscriptions get a
+%subscription-changed for every pane, when made and when a pane is added.
+Other commands succeed without output. %exit is sent when the session is
+killed, or when stdin is closed and the script below is done.
+
+FAKE_TMUX_SCRIPT names a file of directives run once attached, one per
+line:
+
+    sleep SECONDS
+    output PANE TEXT            TEXT may hold Python string escapes
+    history PANE ROWS           fill the screen and ROWS lines of history,
+                                before attaching wherever the directive is
+    replay PATH [RATE [REPEAT]] write a recorded `tmux -C` transcript, minus
+                                its blocks, REPEAT times at RATE bytes/s
+                                (0: as fast as the pipe takes it)
+    exit [REASON]
+    %...                        written as is
+
+While a script runs, commands are still answered.
+"""
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import shlex
+import threading
+import time
+from terminatorlib.tmux.layout import layout_checksum
+
+WIDTH, HEIGHT = 80, 24
+CHUNK_SIZE = 65536
+
+
+def escape(data):
+    """Escape output the way tmux does in control mode"""
+    return ''.join(['\\{:03o}'.format(ord(char))
+                    if char < ' ' or char == '\\' else char
+                    for char in data])
+
+
+def split_commands(line):
+    """Split a command line into commands, each a list of arguments"""
+    commands = [[]]
+    for argument in shlex.split(line):
+        if argument == ';':
+            commands.append([])
+        elif argument.endswith(';') and not argument.endswith('\\;'):
+            commands[-1].append(argument[:-1])
+            commands.append([])
+        else:
+            commands[-1].append(argument)
+    return [command for command in commands if command]
+
+
+def parse_args(args, with_value):
+    """Return the options and the positional arguments of a command"""
+    options = {}
+    positional = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '--':
+            positional.extend(args)
+            break
+        if arg.startswith('-') and len(arg) > 1 and not arg[1:].isdigit():
+            for index, flag in enumerate(arg[1:]):
+                if flag in with_value:
+                    value = arg[index + 2:] or (args.pop(0) if args else '')
+                    options[flag] = value
+                    break
+                options[flag] = True
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+class Pane(object):
+
+    def __init__(self, pane_id):
+        self.pane_id = pane_id
+        self.lines = []
+        self.cursor_x = 0
+        self.cursor_y = 0
+
+    def history_size(self):
+        return max(len(self.lines) - HEIGHT, 0)
+
+    def formats(self):
+        return {
+            'pane_id': self.pane_id,
+            'pane_pid': str(10000 + int(self.pane_id[1:])),
+            'pane_tty': '/dev/pts/{}'.format(self.pane_id[1:]),
+            'history_size': str(self.history_size()),
+            'pane_current_path': '/home/fake',
+            'pane_current_command': 'bash',
+            'pane_title': 'fake',
+            'alternate_on': '0',
+            'mouse_standard_flag': '0',
+            'mouse_button_flag': '0',
+            'mouse_any_flag': '0',
+            'mouse_sgr_flag': '0',
+            'cursor_x': str(self.cursor_x),
+            'cursor_y': str(self.cursor_y),
+        }
+
+    def line_number(self, value, default, oldest):
+        """Resolve a -S/-E argument to an index into lines"""
+        last = max(len(self.lines) - 1, 0)
+        if value in (None, True):
+            return default
+        if value == '-':
+            return 0 if oldest else last
+        return min(max(self.history_size() + int(value), 0), last)
+
+    def capture(self, start, end):
+        history_size = self.history_size()
+        start = self.line_number(start, history_size, True)
+        end = self.line_number(end, max(len(self.lines) - 1, history_size),
+                               False)
+        rows = self.lines[start:end + 1]
+        if start >= history_size and len(rows) < HEIGHT:
+            rows += [''] * (HEIGHT - len(rows))
+        return rows
+
+
+class Window(object):
+
+    def __init__(self, window_id, pane, vertical=True):
+        self.window_id = window_id
+        self.panes = [pane]
+        self.vertical = vertical
+
+    def layout(self):
+        if len(self.panes) == 1:
+            body = '{}x{},0,0,{}'.format(WIDTH, HEIGHT,
+                                         self.panes[0].pane_id[1:])
+            return '{},{}'.format(layout_checksum(body), body)
+        cells = []
+        count = len(self.panes)
+        size = ((HEIGHT if self.vertical else WIDTH) + 1) // count
+        for index, pane in enumerate(self.panes):
+            offset = index * size
+            extent = size - 1 if index < count - 1 else \
+                (HEIGHT if self.vertical else WIDTH) - offset
+            if self.vertical:
+                cells.append('{}x{},0,{},{}'.format(WIDTH, extent, offset,
+                                                    pane.pane_id[1:]))
+            else:
+                cells.append('{}x{},{},0,{}'.format(extent, HEIGHT, offset,
+                                                    pane.pane_id[1:]))
+        opening, closing = '[]' if self.vertical else '{}'
+        body = '{}x{},0,0{}{}{}'.format(WIDTH, HEIGHT, opening,
+                                        ','.join(cells), closing)
+        return '{},{}'.format(layout_checksum(body), body)
+
+
+class FakeTmux(object):
+
+    def __init__(self, out, session_name='terminator'):
+        self.out = out
+        self.lock = threading.Lock()
+        self.session_name = session_name
+        self.number = 1000
+        self.panes = {}
+        self.windows = []
+        self.exited = False
+        # subscription name -> format, for all panes
+        self.subscriptions = {}
+        self.handlers = {
+            'list-windows': self.list_windows,
+            'list-panes': self.list_panes,
+            'display': self.display,
+            'display-message': self.display,
+            'capture-pane': self.capture_pane,
+            'split-window': self.split_window,
+            'new-window': self.new_window,
+            'send-keys': self.send_keys,
+            'refresh-client': self.refresh_client,
+            'kill-server': self.kill,
+            'kill-session': self.kill,
+            'detach-client': self.kill,
+        }
+        self.new_pane(window=True)
+
+    def write(self, data):
+        with self.lock:
+            if self.exited:
+                return
+            try:
+                self.out.write(data)
+                self.out.flush()
+            except IOError:
+                self.exited = True
+
+    def new_pane(self, window=False, vertical=True, target=None):
+        pane = Pane('%{}'.format(len(self.panes)))
+        self.panes[pane.pane_id] = pane
+        if window:
+            self.windows.append(Window('@{}'.format(len(self.windows)), pane,
+                                       vertical))
+            return pane, self.windows[-1]
+        for window in self.windows:
+            if target in window.panes:
+                if len(window.panes) == 1:
+                    window.vertical = vertical
+                window.panes.insert(window.panes.index(target) + 1, pane)
+                return pane, window
+        raise KeyError(target)
+
+    def target(self, options):
+        target = options.get('t')
+        if target in self.panes:
+            return self.panes[target]
+        return self.windows[0].panes[0]
+
+    def expand(self, template, pane):
+        formats = pane.formats()
+        result = template.replace('#D', pane.pane_id)
+        for name, value in formats.iteritems():
+            result = result.replace('#{{{}}}'.format(name), value)
+        return result
+
+    def block(self, lines, flags=1, error=False):
+        self.number += 1
+        timestamp = int(time.time())
+        self.write(''.join(
+            ['%begin {} {} {}\n'.format(timestamp, self.number, flags)] +
+            ['{}\n'.format(line) for line in lines] +
+            ['%{} {} {} {}\n'.format('error' if error else 'end', timestamp,
+                                     self.number, flags)]))
+
+    def start(self, argv):
+        """Answer the command tmux was started with"""
+        args = [arg for arg in argv if arg not in ('-2', '-C', '-CC')]
+        options, _ = parse_args(args[1:], 'cFst')
+        if options.get('s'):
+            self.session_name = options['s']
+        pane, window = self.panes['%0'], self.windows[0]
+        lines = []
+        if args and args[0] == 'new-session' and options.get('P'):
+            lines.append(self.expand(options.get('F', '#D'), pane))
+        self.block(lines, flags=0)
+        self.write('%window-add {0}\n%sessions-changed\n'
+                   '%session-changed $0 {1}\n%layout-change {0} {2}\n'.format(
+                       window.window_id, self.session_name, window.layout()))
+
+    def run(self, line):
+        """Answer a command line, one block per command"""
+        try:
+            commands = split_commands(line)
+        except ValueError as e:
+            self.block(['parse error: {}'.format(e)], error=True)
+            return
+        for command in commands:
+            handler = self.handlers.get(command[0])
+            if handler is None:
+                if command[0] in ('resize-pane',
+                                  'select-pane', 'select-window',
+                                  'set-option', 'set'):
+                    self.block([])
+                else:
+                    self.block(['unknown command: {}'.format(command[0])],
+                               error=True)
+                continue
+            handler(command[1:])
+
+    def list_windows(self, args):
+        options, _ = parse_args(args, 'Ft')
+        template = options.get('F', '#{window_id} #{window_layout}')
+        self.block([template.replace('#{window_id}', window.window_id)
+                            .replace('#{window_layout}', window.layout())
+                    for window in self.windows])
+
+    def list_panes(self, args):
+        options, _ = parse_args(args, 'Ft')
+        template = options.get('F', '#D')
+        self.block([self.expand(template, pane)
+                    for window in self.windows for pane in window.panes])
+
+    def display(self, args):
+        options, positional = parse_args(args, 'Ft')
+        template = options.get('F') or ' '.join(positional)
+        self.block([self.expand(template, self.target(options))])
+
+    def capture_pane(self, args):
+        options, _ = parse_args(args, 'ESt')
+        pane = self.target(options)
+        self.block(pane.capture(options.get('S'), options.get('E')))
+
+    def split_window(self, args):
+        options, _ = parse_args(args, 'cFlpt')
+        pane, window = self.new_pane(vertical=not options.get('h'),
+                                     target=self.target(options))
+        self.pane_created(options, pane, window)
+
+    def new_window(self, args):
+        options, _ = parse_args(args, 'cFnt')
+        pane, window = self.new_pane(window=True)
+        self.pane_created(options, pane, window)
+        self.write('%window-add {}\n'.format(window.window_id))
+
+    def pane_created(self, options, pane, window):
+        lines = []
+        if options.get('P'):
+            lines.append(self.expand(options.get('F', '#D'), pane))
+        self.block(lines)
+        self.write('%layout-change {} {}\n'.format(window.window_id,
+                                                   window.layout()))
+        self.push_subscriptions(pane)
+
+    def refresh_client(self, args):
+        options, _ = parse_args(args, 'ABCfF')
+        self.block([])
+        if 'B' not in options:
+            return
+        name, what, template = (options['B'].split(':', 2) + ['', ''])[:3]
+        if not template or what != '%*':
+            self.subscriptions.pop(name, None)
+            return
+        self.subscriptions[name] = template
+        for pane in sorted(self.panes.values(), key=lambda pane: pane.pane_id):
+            self.push_subscriptions(pane, [name])
+
+    def push_subscriptions(self, pane, names=None):
+        for index, window in enumerate(self.windows):
+            if pane in window.panes:
+                break
+        for name in names or sorted(self.subscriptions):
+            self.write('%subscription-changed {} $0 {} {} {} : {}\n'.format(
+                name, window.window_id, index, pane.pane_id,
+                self.expand(self.subscriptions[name], pane)))
+
+    def send_keys(self, args):
+        options, keys = parse_args(args, 't')
+        pane = self.target(options)
+        if options.get('H'):
+            data = ''.join([chr(int(key, 16)) for key in keys])
+        else:
+            data = ' '.join(keys)
+        self.block([])
+        self.output(pane.pane_id, data)
+
+    def output(self, pane_id, data):
+        self.write('%output {} {}\n'.format(pane_id, escape(data)))
+
+    def kill(self, args):
+        self.block([])
+        self.exit()
+
+    def exit(self, reason=None):
+        self.write('%exit {}\n'.format(reason) if reason else '%exit\n')
+        with self.lock:
+            self.exited = True
+
+    def replay(self, path, rate=0, repeat=1):
+        """Write the notifications of a recording, leaving out its blocks
+        so they can't be taken for answers to our client's commands"""
+        lines = []
+        in_block = False
+        with open(path) as recording:
+            for line in recording:
+                if in_block:
+                    in_block = not line.startswith(('%end', '%error'))
+                elif line.startswith('%begin'):
+                    in_block = True
+                elif not line.startswith('%exit'):
+                    lines.append(line)
+        data = ''.join(lines) * repeat
+        start = time.time()
+        written = 0
+        while written < len(data) and not self.exited:
+            end = data.rfind('\n', written, written + CHUNK_SIZE) + 1
+            if end <= written:
+                end = data.find('\n', written) + 1 or len(data)
+            self.write(data[written:end])
+            written = end
+            if rate:
+                delay = start + float(written) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def load_script(self, path):
+        """Read a script, applying its history directives"""
+        with open(path) as script:
+            directives = script.read().splitlines()
+        for directive in directives:
+            if directive.startswith('history '):
+                pane_id, rows = directive.split(' ')[1:]
+                self.panes[pane_id].lines = [
+                    'line {}'.format(row)
+                    for row in xrange(int(rows) + HEIGHT)]
+        return directives
+
+    def run_script(self, directives):
+        for directive in directives:
+            if self.exited:
+                return
+            if not directive.strip() or directive.startswith('#'):
+                continue
+            if directive.startswith('%'):
+                self.write(directive + '\n')
+                continue
+            name, _, rest = directive.partition(' ')
+            if name == 'sleep':
+                time.sleep(float(rest))
+            elif name == 'output':
+                pane_id, _, text = rest.partition(' ')
+                self.output(pane_id, text.decode('string_escape'))
+            elif name == 'history':
+                # applied by load_script
+                pass
+            elif name == 'replay':
+                args = rest.split(' ')
+                self.replay(args[0], *[int(arg) for arg in args[1:]])
+            elif name == 'exit':
+                self.exit(rest or None)
+            else:
+                sys.stderr.write('Unknown directive: {}\n'.format(directive))
+
+
+def main():
+    tmux = FakeTmux(sys.stdout)
+    script = os.environ.get('FAKE_TMUX_SCRIPT')
+    directives = tmux.load_script(script) if script else None
+    tmux.start(sys.argv[1:])
+    thread = None
+    if directives:
+        thread = threading.Thread(target=tmux.run_script, args=(directives,))
+        thread.daemon = True
+        thread.start()
+    while not tmux.exited:
+        line = sys.stdin.readline()
+        if not line:
+            if thread is not None:
+                thread.join()
+            tmux.exit()
+            break
+        line = line.strip()
+        if line:
+            tmux.run(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+from terminatorlib import broadcast
+
+
+class Event(object):
+    state = 0
+    is_modifier = False
+
+    def __init__(self, keyval, string):
+        self.keyval, self.string = keyval, string
+
+
+class Adjustment(object):
+    value = 0
+    def get_upper(self):
+        return 1000
+    def get_page_size(self):
+        return 24
+    def set_value(self, value):
+        self.value = value
+
+
+class Vte(object):
+    def __init__(self):
+        self.written = []
+        self.emitted = []
+        self.adjustment = Adjustment()
+    def feed_child(self, data, length):
+        self.written.append(data[:length])
+    def emit(self, signal, event):
+        self.emitted.append(signal)
+    def get_scroll_on_keystroke(self):
+        return True
+    def get_vadjustment(self):
+        return self.adjustment
+
+
+class Control(object):
+    def __init__(self):
+        self.sent = []
+    def queue_keys(self, content, pane_id):
+        self.sent.append((pane_id, content))
+
+
+class Terminal(object):
+    def __init__(self, pane_id=None, control=None):
+        self.vte = Vte()
+        self.pane_id, self.control = pane_id, control
+
+
+class BroadcastTests(unittest.TestCase):
+
+    def test_keys_go_straight_to_the_targets(self):
+        terminals = [Terminal() for _ in xrange(50)]
+        source = terminals[0]
+        broadcaster = broadcast.Broadcaster()
+        broadcaster.broadcast(source, terminals, Event(0x61, 'a'))
+        self.assertEqual(source.vte.written, [])
+        for terminal in terminals[1:]:
+            self.assertEqual(terminal.vte.written, ['a'])
+            self.assertEqual(terminal.vte.adjustment.value, 1000 - 24)
+        modifier = Event(0xffe1, '')
+        modifier.is_modifier = True
+        broadcaster.broadcast(source, terminals, modifier)
+        self.assertEqual(broadcaster.stats(), {'keys': 2, 'direct': 49,
+                                               'emitted': 0})
+        self.assertEqual(broadcast.pty_bytes(Event(0x01000000 | 0xe9,
+                                                   u'\xe9')), u'\xe9')
+        # the targets know best what F1 or an arrow key sends
+        self.assertIsNone(broadcast.pty_bytes(Event(0xffbe, '')))
+        self.assertIsNone(broadcast.pty_bytes(Event(0xff52, '')))
+
+    def test_tmux_panes_get_their_keys_queued(self):
+        control = Control()
+        terminals = [Terminal('%{}'.format(n), control) for n in xrange(10)]
+        broadcaster = broadcast.Broadcaster()
+        broadcaster.broadcast(terminals[3], terminals, Event(0x61, 'a'),
+                              tmux=True)
+        self.assertEqual(control.sent, [(terminal.pane_id, 'a')
+                                        for terminal in terminals
+                                        if terminal is not terminals[3]])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
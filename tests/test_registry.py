@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+import uuid
+from terminatorlib.registry import Registry, indexed_property
+
+TERMINALS = 500
+
+
+class Terminator(object):
+    def __init__(self):
+        self.registry = Registry()
+
+
+class Window(object):
+    uuid = indexed_property('uuid', 'update_window')
+
+    def __init__(self, terminator):
+        self.terminator = terminator
+        terminator.registry.add_window(self)
+        self.uuid = uuid.uuid4()
+
+
+class Terminal(object):
+    uuid = indexed_property('uuid', 'update_terminal')
+    group = indexed_property('group', 'update_terminal')
+    pane_id = indexed_property('pane_id', 'update_terminal')
+    control = indexed_property('control', 'update_terminal')
+
+    def __init__(self, terminator):
+        self.terminator = terminator
+        terminator.registry.add_terminal(self)
+        self.uuid = uuid.uuid4()
+
+
+class RegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.terminator = Terminator()
+        self.windows = [Window(self.terminator) for _ in xrange(5)]
+        self.terminals = [Terminal(self.terminator)
+                          for _ in xrange(TERMINALS)]
+        for n, terminal in enumerate(self.terminals):
+            terminal.pane_id = '%{}'.format(n)
+            terminal.group = 'group {}'.format(n % 10) if n % 2 else None
+
+    def test_lookups_at_scale(self):
+        registry = self.terminator.registry
+        self.assertEqual(registry.terminals, self.terminals)
+        for n, terminal in enumerate(self.terminals):
+            self.assertIs(registry.terminal_by_uuid[terminal.uuid.urn],
+                          terminal)
+            self.assertIs(registry.terminal_by_pane_id[
+                (None, '%{}'.format(n))], terminal)
+        for window in self.windows:
+            self.assertIs(registry.window_by_uuid[window.uuid.urn], window)
+        self.assertEqual(len(registry.group_terminals('group 1')),
+                         TERMINALS / 10)
+        self.assertEqual(len(registry.group_terminals(None)), TERMINALS / 2)
+
+    def test_indexes_follow_changes(self):
+        registry = self.terminator.registry
+        terminal = self.terminals[1]
+        terminal.pane_id = '%1000'
+        terminal.group = 'other'
+        self.assertNotIn((None, '%1'), registry.terminal_by_pane_id)
+        self.assertIs(registry.terminal_by_pane_id[(None, '%1000')], terminal)
+        self.assertEqual(registry.group_terminals('other'), [terminal])
+        self.assertNotIn(terminal, registry.group_terminals('group 1'))
+        for terminal in registry.group_terminals('other'):
+            terminal.group = None
+        self.assertFalse(registry.has_group('other'))
+        registry.remove_window(self.windows[0])
+        self.assertNotIn(self.windows[0].uuid.urn, registry.window_by_uuid)
+        for terminal in self.terminals[:TERMINALS / 2]:
+            registry.remove_terminal(terminal)
+        self.assertEqual(len(registry.terminal_by_uuid), TERMINALS / 2)
+        self.assertNotIn((None, '%0'), registry.terminal_by_pane_id)
+        self.assertEqual(len(registry.group_terminals(None)), TERMINALS / 4)
+        self.assertFalse(registry.remove_terminal(self.terminals[0]))
+
+    def test_pane_ids_are_per_connection(self):
+        registry = self.terminator.registry
+        first, second = object(), object()
+        # the same pane ids, on two tmux servers
+        ones = self.terminals[:10]
+        twos = self.terminals[10:20]
+        for n, (one, two) in enumerate(zip(ones, twos)):
+            one.control, two.control = first, second
+            one.pane_id = two.pane_id = '%{}'.format(n)
+        for n, (one, two) in enumerate(zip(ones, twos)):
+            pane_id = '%{}'.format(n)
+            self.assertIs(registry.terminal_by_pane_id[(first, pane_id)], one)
+            self.assertIs(registry.terminal_by_pane_id[(second, pane_id)],
+                          two)
+        # one of them going leaves the other
+        registry.remove_terminal(twos[0])
+        ones[1].pane_id = None
+        self.assertIs(registry.terminal_by_pane_id[(first, '%0')], ones[0])
+        self.assertNotIn((second, '%0'), registry.terminal_by_pane_id)
+        self.assertIs(registry.terminal_by_pane_id[(second, '%1')], twos[1])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
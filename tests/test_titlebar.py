@@ -0,0 +1,122 @@
+#!/usr/bin/env python2
+
+import os
+import sys, os.path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+from terminatorlib import titlebar
+
+TERMINALS = 50
+GROUPSEND_TYPE = {'all': 0, 'group': 1, 'off': 2}
+
+
+class ConfigBase(object):
+    generation = 0
+
+
+class Config(dict):
+    base = ConfigBase()
+
+
+CONFIG = Config({
+    'title_use_system_font': False,
+    'title_font': 'Sans 9',
+    'title_transmit_fg_color': '#ffffff',
+    'title_transmit_bg_color': '#c80003',
+    'title_receive_fg_color': '#ffffff',
+    'title_receive_bg_color': '#0076c9',
+    'title_inactive_fg_color': '#000000',
+    'title_inactive_bg_color': '#c0bebf',
+})
+
+
+class Terminator(object):
+    groupsend = GROUPSEND_TYPE['off']
+    groupsend_type = GROUPSEND_TYPE
+
+    def focus_changed(self, widget):
+        for terminal in self.terminals:
+            terminal.titlebar.update_state(widget)
+
+
+class Titlebar(titlebar.Titlebar):
+    # state changes actually drawn, across all titlebars
+    applied = 0
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.terminator = terminal.terminator
+        self.config = CONFIG
+
+    def apply_state(self, state, style):
+        Titlebar.applied += 1
+        self.state, self.style = state, style
+
+
+class Terminal(object):
+    def __init__(self, terminator, group=None):
+        self.terminator = terminator
+        self.group = group
+        self.titlebar = Titlebar(self)
+
+
+class TitlebarTests(unittest.TestCase):
+
+    def setUp(self):
+        self.terminator = Terminator()
+        self.terminals = [Terminal(self.terminator,
+                                   'group' if n < 5 else None)
+                          for n in xrange(TERMINALS)]
+        self.terminator.terminals = self.terminals
+        Titlebar.applied = 0
+
+    def test_states(self):
+        off, on = GROUPSEND_TYPE['off'], GROUPSEND_TYPE['all']
+        focused, grouped, other = (self.terminals[0], self.terminals[1],
+                                   self.terminals[10])
+        state = titlebar.titlebar_state
+        self.assertEqual(state(focused, focused, off, GROUPSEND_TYPE),
+                         ('transmit', 'transmit', '_active_broadcast_off'))
+        self.assertEqual(state(grouped, focused, off, GROUPSEND_TYPE),
+                         ('inactive', 'receive', '_receive_off'))
+        self.assertEqual(state(other, focused, on, GROUPSEND_TYPE),
+                         ('receive', 'inactive', '_receive_on'))
+        self.assertEqual(state(other, 'window-focus-out', on, GROUPSEND_TYPE),
+                         ('inactive', 'inactive', '_receive_off'))
+
+    def test_only_changed_titlebars_are_updated(self):
+        terminator = self.terminator
+        terminator.focus_changed(self.terminals[20])
+        self.assertEqual(Titlebar.applied, TERMINALS)
+        # moving between ungrouped terminals recolours just those two
+        Titlebar.applied = 0
+        terminator.focus_changed(self.terminals[21])
+        self.assertEqual(Titlebar.applied, 2)
+        terminator.focus_changed(self.terminals[21])
+        self.assertEqual(Titlebar.applied, 2)
+        # into a group: the new focus, the old one and the group members
+        Titlebar.applied = 0
+        terminator.focus_changed(self.terminals[0])
+        self.assertEqual(Titlebar.applied, 6)
+        # broadcasting to all changes everybody's
+        Titlebar.applied = 0
+        terminator.groupsend = GROUPSEND_TYPE['all']
+        terminator.focus_changed(self.terminals[0])
+        self.assertEqual(Titlebar.applied, TERMINALS)
+        # and so does a new config generation, with its own parsed style
+        style = self.terminals[0].titlebar.style
+        Titlebar.applied = 0
+        CONFIG.base.generation += 1
+        terminator.focus_changed(self.terminals[0])
+        self.assertEqual(Titlebar.applied, TERMINALS)
+        self.assertIsNot(self.terminals[0].titlebar.style, style)
+        self.assertIs(self.terminals[1].titlebar.style,
+                      self.terminals[0].titlebar.style)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,80 @@ import os
 import sys, os.path
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
 
+import subprocess
+import tempfile
 import unittest
-from terminatorlib.tmux import notifications
+from StringIO import StringIO
+from terminatorlib.tmux import notifications, control, output, layout, tracker, \
+    reader, scrollback, modes, startup, prediction
 
-class NotificationsTests(unittest.TestCase):
+RECORDING = os.path.join(os.path.dirname(__file__), 'data',
+                         'tmux-control-build.log')
+FAKE_TMUX = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         'fake_tmux.py')
+# the tmux items of the config
+TMUX_CONFIG = {'tmux_output_max_bytes_per_tick': 0,
+               'tmux_throttle_age': 500,
+               'tmux_scrollback_tail': 1000,
+               'tmux_scrollback_chunk': 5000,
+               'tmux_scrollback_hydration': 'idle',
+               'tmux_predictive_echo': False}
+
+
+class FakeTerminator(object):
+    """Terminator, as far as the tmux modules use it"""
+
+    def __init__(self, **attributes):
+        self.config = dict(TMUX_CONFIG)
+        self.last_focused_term = None
+        self.__dict__.update(attributes)
+
+
+class FakeGObject(object):
+    """GObject running idle callbacks at once, and keeping timeouts for the
+    test to fire"""
+
+    def __init__(self):
+        self.delays = []
+        self.timers = []
+
+    def idle_add(self, callback, *args):
+        callback(*args)
+
+    def timeout_add(self, delay, callback, *args):
+        self.delays.append(delay)
+        self.timers.append(lambda: callback(*args))
+        return len(self.timers)
+
+    def source_remove(self, source):
+        pass
+
+
+class TmuxTestCase(unittest.TestCase):
+
+    def patch(self, module, name, value):
+        """Replace a global of module until the test is over"""
+        self.addCleanup(setattr, module, name, getattr(module, name))
+        setattr(module, name, value)
+        return value
+
+    def fake_gobject(self, *modules):
+        """Have modules use one FakeGObject until the test is over"""
+        gobject = FakeGObject()
+        for module in modules:
+            self.patch(module, 'GObject', gobject)
+        return gobject
+
+    def make_handler(self, control=None, **attributes):
+        """A NotificationsHandler of a FakeTerminator with attributes"""
+        handler = notifications.NotificationsHandler(
+            FakeTerminator(**attributes))
+        if control is not None:
+            handler.control = control
+        return handler
+
+
+class NotificationsTests(TmuxTestCase):
 
     def test_layout_changed_parsing(self):
         layouts = [
@@ -21,6 +91,1006 @@ class NotificationsTests(unittest.TestCase):
             notification.consume(['', layout])
             print notification.window_layout
 
+    def test_flow_control_parsing(self):
+        line = '%extended-output %3 1500 : a \\134b\\015\\012'
+        notification = notifications.ExtendedOutput()
+        notification.consume_raw(line)
+        self.assertEqual((notification.pane_id, notification.age,
+                          notification.output), ('%3', 1500, 'a \\b\r\n'))
+        split = notifications.ExtendedOutput()
+        split.consume(line[1:].split(' ')[1:])
+        self.assertEqual(str(split), str(notification))
+        stream = StringIO('%continue %3\n%end 1 268 1\n')
+        result = notifications.Result()
+        result.consume(['1', '268', '1'], stream)
+        self.assertEqual(result.result, [])
+        self.assertEqual([str(n) for n in result.embedded],
+                         ['continue[pane_id="%3"]'])
+
+    def test_flooding_pane_is_paused_until_focused(self):
+        class Control(object):
+            def __init__(self):
+                self.commands = []
+                self.pane_id_to_terminal = {}
+            def pause_pane(self, pane_id):
+                self.commands.append(('pause', pane_id))
+            def continue_pane(self, pane_id):
+                self.commands.append(('continue', pane_id))
+            def refresh_pane(self, pane_id):
+                self.commands.append(('refresh', pane_id))
+        class Focused(object):
+            pane_id = '%1'
+        handler = self.make_handler(Control(), last_focused_term=Focused())
+        handler.terminator.last_focused_term.control = handler.control
+        commands = handler.control.commands
+        for pane_id in ['%1', '%2', '%2']:
+            notification = notifications.ExtendedOutput()
+            notification.consume_raw(
+                '%extended-output {} 900 : x'.format(pane_id))
+            handler.handle(notification)
+        self.assertEqual(commands, [('pause', '%2')])
+        pause = notifications.Pause()
+        pause.consume(['%2'])
+        handler.handle(pause)
+        self.assertEqual(handler.paused_panes, set(['%2']))
+        handler.resume_pane('%1')
+        handler.resume_pane('%2')
+        resumed = notifications.Continue()
+        resumed.consume(['%2'])
+        handler.handle(resumed)
+        self.assertEqual(commands, [('pause', '%2'), ('continue', '%2'),
+                                    ('refresh', '%2')])
+        self.assertEqual(handler.paused_panes, set())
+
+    def test_layouts_are_merged_per_connection(self):
+        from terminatorlib.terminator import Terminator
+        class Control(object):
+            def __init__(self, initial_layout):
+                self.initial_layout = initial_layout
+        class Fake(object):
+            initial_layout = None
+            tmux_startup = None
+            merge_tmux_layouts = Terminator.merge_tmux_layouts.__func__
+        fake = Fake()
+        attached = layout.convert_to_terminator_layout(
+            [layout.parse_layout('f91d,120x40,0,0{60x40,0,0,0,59x40,61,0,1}')])
+        fake.tmux_controls = [Control(attached), Control(None)]
+        collect = Terminator.collect_tmux_layouts.__func__
+        collect(fake)
+        self.assertIsNone(fake.initial_layout)
+        fake.tmux_controls[1].initial_layout = {}
+        collect(fake)
+        merged = fake.initial_layout
+        self.assertEqual(len(merged), len(attached) + 2)
+        self.assertEqual(merged['0.terminal1']['tmux']['pane_id'], '%1')
+        self.assertEqual(merged['0.terminal1']['tmux']['connection'], 0)
+        self.assertEqual(merged['0.terminal1']['parent'], '0.pane0')
+        self.assertEqual(merged['1.terminal0']['tmux'], {'connection': 1})
+        self.assertNotIn('connection', attached['terminal1']['tmux'])
+        fake.tmux_controls[0].initial_layout = {}
+        collect(fake)
+        self.assertEqual(fake.initial_layout, {})
+
+    def test_connections_share_pane_ids(self):
+        from terminatorlib import terminator
+        from terminatorlib.registry import Registry, indexed_property
+        class Terminator(FakeTerminator):
+            find_terminal_by_pane_id = \
+                terminator.Terminator.find_terminal_by_pane_id.__func__
+        class Control(object):
+            def __init__(self):
+                self.commands = []
+                self.pane_id_to_terminal = {}
+            def continue_pane(self, pane_id):
+                self.commands.append(('continue', pane_id))
+        class Terminal(object):
+            uuid = group = paused = None
+            pane_id = indexed_property('pane_id', 'update_terminal')
+            control = indexed_property('control', 'update_terminal')
+            def __init__(self, control, marker):
+                self.terminator = fake
+                fake.registry.add_terminal(self)
+                self.control, self.pane_id = control, marker
+                self.fed = []
+                self.vte = self.titlebar = self
+            def feed(self, data):
+                self.fed.append(data)
+            def icon_paused(self, paused):
+                self.paused = paused
+        fake = Terminator(registry=Registry())
+        gobject = self.fake_gobject(notifications)
+        idle = []
+        gobject.idle_add = lambda callback, *args: idle.append(
+            (callback, args))
+        # two tmux servers, each with its own %0
+        handlers = [notifications.NotificationsHandler(fake)
+                    for _ in xrange(2)]
+        terminals = []
+        for handler, marker in zip(handlers, ['marker1', 'marker2']):
+            handler.control = Control()
+            terminals.append(Terminal(handler.control, marker))
+            handler.pane_id_result(['%0 {}'.format(marker)])
+        # the reader knows the panes at once, the registry is the main
+        # loop's
+        self.assertIsNone(fake.find_terminal_by_pane_id(handlers[0].control,
+                                                        '%0'))
+        del gobject.idle_add
+        for callback, args in idle:
+            callback(*args)
+        for handler, terminal in zip(handlers, terminals):
+            self.assertIs(handler.control.pane_id_to_terminal['%0'], terminal)
+            self.assertIs(fake.find_terminal_by_pane_id(handler.control, '%0'),
+                          terminal)
+        handlers[1].feed_output('%0', 'x')
+        self.assertEqual([terminal.fed for terminal in terminals], [[], ['x']])
+        # the focused %0 is the first server's, the second one's stays paused
+        fake.last_focused_term = terminals[0]
+        for handler in handlers:
+            pause = notifications.Pause()
+            pause.consume(['%0'])
+            handler.handle(pause)
+        self.assertEqual(handlers[0].control.commands, [('continue', '%0')])
+        self.assertEqual(handlers[1].control.commands, [])
+        self.assertTrue(terminals[1].paused)
+        self.assertIsNone(terminals[0].paused)
+
+    def test_tmux_windows_map_to_tabs(self):
+        class Label(object):
+            text = None
+            def set_custom_label(self, text):
+                self.text = text
+        class Notebook(object):
+            def __init__(self, window):
+                self.tabs = [window.child]
+                self.labels = {}
+                self.window = window
+                window.child = self
+            def get_parent(self):
+                return self.window
+            def newtab(self, widget):
+                self.tabs.append(widget)
+                widget.parent = self
+            def get_current_page(self):
+                return 0
+            def set_current_page(self, page):
+                self.current = page
+            def find_tab_root(self, terminal):
+                while terminal.parent is not self:
+                    terminal = terminal.parent
+                return terminal
+            def get_tab_label(self, widget):
+                return self.labels.setdefault(widget, Label())
+            def split_axis(self, widget, vertical, sibling, widgetfirst,
+                           focus):
+                paned = Terminal(self)
+                self.tabs[self.tabs.index(widget)] = paned
+                widget.parent = sibling.parent = paned
+                paned.split = (vertical, widgetfirst, focus)
+        class Window(object):
+            child = None
+            def is_child_notebook(self):
+                return isinstance(self.child, Notebook)
+            def get_child(self):
+                return self.child
+            def get_parent(self):
+                return None
+        window = Window()
+        class Terminal(object):
+            def __init__(self, parent=window):
+                self.parent = parent
+                self.closed = False
+            def get_toplevel(self):
+                return window
+            def get_parent(self):
+                return self.parent
+            def close(self):
+                self.closed = True
+        class Factory(object):
+            def make(self, kind, window=None):
+                return Notebook(window) if kind == 'Notebook' else Terminal()
+            def isinstance(self, widget, kind):
+                return type(widget).__name__ == kind
+        class Control(object):
+            session_name = 'one'
+            def __init__(self):
+                self.pane_id_to_terminal = {}
+            def describe_window(self, window_id):
+                self.described = window_id
+            def initial_output(self, pane_id):
+                pass
+            def list_session_windows(self):
+                self.listed = True
+        control = Control()
+        handler = self.make_handler(control,
+                                    collect_tmux_layouts=lambda: None)
+        ours = Terminal()
+        window.child = ours
+        control.pane_id_to_terminal['%0'] = ours
+        handler.initial_layout_result(['@0 b25d,80x24,0,0,0'])
+        self.fake_gobject(notifications)
+        self.patch(notifications, 'Factory', Factory)
+        added = notifications.WindowAdd()
+        added.consume(['@1'])
+        handler.handle(added)
+        self.assertEqual(control.described, '@1')
+        handler.window_add_result('@1')(
+            ['f91d,80x24,0,0{40x24,0,0,1,39x24,41,0,2} my window'])
+        renamed = notifications.WindowRenamed()
+        renamed.consume(['@1', 'build', 'logs'])
+        handler.handle(renamed)
+        switched = notifications.SessionChanged()
+        switched.consume(['$1', 'two'])
+        handler.handle(switched)
+        # @1 is linked into both sessions, @0 is gone, @2 is new
+        handler.session_windows_result(['@1 f91d,80x24,0,0{40x24,0,0,1,'
+                                        '39x24,41,0,2} build logs',
+                                        '@2 b25f,80x24,0,0,3 other'])
+        notebook = window.child
+        first, second = [control.pane_id_to_terminal[pane_id]
+                         for pane_id in ['%1', '%2']]
+        paned = notebook.tabs[1]
+        self.assertIs(first.parent, paned)
+        self.assertIs(second.parent, paned)
+        # split by another client, the focus stays where it was
+        self.assertEqual(paned.split, (False, True, False))
+        self.assertEqual(notebook.labels[paned].text, 'build logs')
+        self.assertEqual(control.session_name, 'two')
+        self.assertTrue(ours.closed)
+        self.assertNotIn('%0', control.pane_id_to_terminal)
+        third = control.pane_id_to_terminal['%3']
+        self.assertIs(notebook.tabs[2], third)
+        self.assertEqual(notebook.labels[third].text, 'other')
+        self.assertEqual(sorted(handler.window_layouts), ['@1', '@2'])
+
+    def test_resizes_are_sent_once_per_frame(self):
+        from terminatorlib.window import Window
+        class Handler(object):
+            window_layouts = {'@1': layout.parse_layout(
+                'f91d,120x40,0,0{60x40,0,0,0,59x40,61,0,1}')}
+            pane_sizes = notifications.NotificationsHandler.pane_sizes.__func__
+            def push_layouts(self, terminals):
+                control.commands.append(('push-layouts', sorted(
+                    terminal.pane_id for terminal in terminals)))
+        class Control(object):
+            width = height = None
+            notifications_handler = Handler()
+            def __init__(self):
+                self.commands = []
+            def refresh_client(self, width, height):
+                self.commands.append(('refresh-client', width, height))
+                self.width, self.height = width, height
+            def resize_pane(self, pane_id, rows, cols):
+                self.commands.append(('resize-pane', pane_id, cols, rows))
+        class Allocation(object):
+            def __init__(self, x):
+                self.x, self.y = x, 0
+        class Terminal(object):
+            def __init__(self, pane_id, x, size):
+                self.pane_id, self.x, self.size = pane_id, x, size
+                self.control = control
+            def get_allocation(self):
+                return Allocation(self.x)
+            def get_size(self):
+                return self.size
+        class Fake(object):
+            pending_tmux_resize = False
+            def get_visible_terminals(self):
+                return dict((terminal, None) for terminal in terminals)
+        control = Control()
+        terminals = [Terminal('%0', 0, (60, 40)), Terminal('%1', 600, (59, 40))]
+        fake = Fake()
+        resize = Window.do_deferred_tmux_resize.__func__
+        fake.tmux_resized_terminals = set(terminals)
+        resize(fake)
+        self.assertEqual(control.commands, [('refresh-client', 119, 40)])
+        # a divider was moved, only the panes tmux has another size for
+        terminals[0].size, terminals[1].size = (50, 40), (69, 40)
+        fake.tmux_resized_terminals = set(terminals[:1])
+        resize(fake)
+        self.assertEqual(control.commands[1:], [('push-layouts', ['%0'])])
+        # panes tmux already has at our size are left alone
+        body = '129x40,0,0{50x40,0,0,0,69x40,51,0,1}'
+        Handler.window_layouts['@1'] = layout.parse_layout(
+            '{},{}'.format(layout.layout_checksum(body), body))
+        fake.tmux_resized_terminals = set(terminals)
+        resize(fake)
+        self.assertEqual(len(control.commands), 2)
+
+    def test_layouts_are_pushed_per_window(self):
+        class Widget(object):
+            parent = None
+            def get_parent(self):
+                return self.parent
+        class Terminal(Widget):
+            def __init__(self, pane_id, size):
+                self.pane_id, self.size = pane_id, size
+            def get_size(self):
+                return self.size
+        class Paned(Widget):
+            def __init__(self, *children):
+                self.children = children
+                for child in children:
+                    child.parent = self
+            def get_children(self):
+                return self.children
+        class HPaned(Paned):
+            pass
+        class VPaned(Paned):
+            pass
+        class Factory(object):
+            def isinstance(self, widget, kind):
+                return kind in [cls.__name__ for cls in type(widget).__mro__]
+        class Control(object):
+            def __init__(self):
+                self.commands = []
+            def select_layout(self, window_id, window_layout):
+                self.commands.append(('select-layout', window_id,
+                                      window_layout))
+            def resize_pane(self, pane_id, rows, cols):
+                self.commands.append(('resize-pane', pane_id, cols, rows))
+        handler = notifications.NotificationsHandler.__new__(
+            notifications.NotificationsHandler)
+        handler.control = control = Control()
+        handler.window_layouts = {
+            '@1': layout.parse_layout('5154,120x40,0,0{30x40,0,0,0,29x40,31,'
+                                      '0,3,59x40,61,0[59x20,61,0,1,59x19,61,'
+                                      '21,2]}'),
+            '@2': layout.parse_layout('b261,80x24,0,0,4')}
+        # rotated and resized, the same panes in one HPaned over a VPaned
+        panes = [Terminal('%0', (50, 20)), Terminal('%3', (69, 20)),
+                 Terminal('%1', (60, 19)), Terminal('%2', (59, 19))]
+        VPaned(HPaned(panes[0], panes[1]), HPaned(panes[2], panes[3]))
+        lone = Terminal('%4', (70, 24))
+        self.patch(notifications, 'Factory', Factory)
+        handler.push_layouts(panes[:2] + [lone])
+        pushed = sorted(control.commands)
+        # a window whose terminals are not all there is resized pane by pane
+        del control.commands[:]
+        HPaned(panes[0], panes[1])
+        handler.push_layouts(panes[:1])
+        body = '120x40,0,0[120x20,0,0{50x20,0,0,0,69x20,51,0,3},' \
+               '120x19,0,21{60x19,0,21,1,59x19,61,21,2}]'
+        # a lone pane always has the size of its window, @2 is left alone
+        self.assertEqual(pushed, [
+            ('select-layout', '@1',
+             '{},{}'.format(layout.layout_checksum(body), body))])
+        self.assertEqual(control.commands, [('resize-pane', '%0', 50, 20)])
+        # following the layout tmux sent, GTK rounds a split a cell off
+        del control.commands[:]
+        panes = [Terminal('%0', (30, 40)), Terminal('%3', (28, 40)),
+                 Terminal('%1', (60, 20)), Terminal('%2', (60, 19))]
+        HPaned(panes[0], panes[1], VPaned(panes[2], panes[3]))
+        handler.push_layouts(panes)
+        self.assertEqual(control.commands, [])
+        # moving the divider further is the user's doing
+        panes[0].size, panes[1].size = (27, 40), (31, 40)
+        handler.push_layouts(panes[:2])
+        body = '120x40,0,0{27x40,0,0,0,31x40,28,0,3,' \
+               '60x40,60,0[60x20,60,0,1,60x19,60,21,2]}'
+        self.assertEqual(control.commands, [
+            ('select-layout', '@1',
+             '{},{}'.format(layout.layout_checksum(body), body))])
+
+
+class StartupTests(TmuxTestCase):
+
+    def test_layout_is_built_once_without_waiting(self):
+        class Control(object):
+            def __init__(self, initial_layout):
+                self.initial_layout = initial_layout
+                self.disconnected = False
+            def disconnect(self):
+                self.disconnected = True
+        class Terminator(object):
+            windows = []
+            def __init__(self):
+                self.tmux_controls = [Control({'window0': {}}), Control(None)]
+                self.built = []
+            def collect_tmux_layouts(self):
+                if all(control.initial_layout is not None
+                       for control in self.tmux_controls):
+                    tmux_startup.layout_ready()
+            def build_layout(self, layoutname):
+                self.built.append(layoutname)
+        terminator = Terminator()
+        gobject = self.fake_gobject(startup)
+        tmux_startup = startup.TmuxStartup(terminator, 'default', 10)
+        tmux_startup.start()
+        terminator.collect_tmux_layouts()
+        self.assertEqual(terminator.built, [])
+        # the second connection never answers
+        gobject.timers[-1]()
+        self.assertEqual(terminator.built, ['default'])
+        self.assertEqual(terminator.tmux_controls[1].initial_layout, {})
+        self.assertEqual([control.disconnected
+                          for control in terminator.tmux_controls],
+                         [False, True])
+        # a late answer changes nothing
+        tmux_startup.layout_ready()
+        self.assertEqual(terminator.built, ['default'])
+        self.assertEqual(tmux_startup.state, 'done')
+        self.assertIn('timed out', tmux_startup.report())
+
+    def test_timeout_starts_a_new_session(self):
+        class Control(control.TmuxControl):
+            def new_session(self, cwd=None, command=None, marker=''):
+                self.started = marker
+            def new_window(self, cwd=None, command=None, marker=''):
+                self.started = None
+        class Terminator(object):
+            windows = []
+            def collect_tmux_layouts(self):
+                tmux_startup.layout_ready()
+            def build_layout(self, layoutname):
+                # the terminals of the layout ask for their panes
+                tmux_control.run_command(None, 'marker')
+        tmux_control = Control('test', None)
+        # a tmux that never answers
+        tmux = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(60)'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.addCleanup(lambda: tmux.poll() is None and tmux.kill())
+        tmux_control.tmux = tmux
+        tmux_control.input, tmux_control.output = tmux.stdin, tmux.stdout
+        tmux_control.requests.add('attach-session -t test', initial=True)
+        terminator = Terminator()
+        terminator.tmux_controls = [tmux_control]
+        gobject = self.fake_gobject(startup)
+        tmux_startup = startup.TmuxStartup(terminator, 'default', 10)
+        tmux_startup.start()
+        gobject.timers[-1]()
+        self.assertIsNotNone(tmux.poll())
+        self.assertIsNone(tmux_control.input)
+        self.assertEqual(len(tmux_control.requests), 0)
+        self.assertEqual(tmux_control.started, 'marker')
+
+
+class LayoutTests(unittest.TestCase):
+
+    def test_layout_parsing(self):
+        window_layout = ('5154,120x40,0,0{30x40,0,0,0,29x40,31,0,3,'
+                         '59x40,61,0[59x20,61,0,1,59x19,61,21,2]}')
+        self.assertEqual(layout.layout_checksum(window_layout[5:]), '5154')
+        parser = layout.LayoutParser()
+        root = parser.parse(window_layout)
+        self.assertIsInstance(root, layout.Horizontal)
+        self.assertEqual((root.width, root.height), (120, 40))
+        first, second, third = root.children
+        self.assertEqual([first.pane_id, second.pane_id], ['%0', '%3'])
+        self.assertIsInstance(third, layout.Vertical)
+        self.assertEqual([pane.pane_id for pane in third.children],
+                         ['%1', '%2'])
+        self.assertEqual(third.children[1].y, 21)
+        self.assertIs(parser.parse(window_layout), root)
+
+    def test_layout_dumping(self):
+        parse = layout.parse_layout
+        for window_layout in ['b25d,80x24,0,0,0',
+                              '5154,120x40,0,0{30x40,0,0,0,29x40,31,0,3,'
+                              '59x40,61,0[59x20,61,0,1,59x19,61,21,2]}']:
+            self.assertEqual(layout.dump_layout(parse(window_layout)),
+                             window_layout)
+        # panes keep their sizes, the last ones make up for the difference
+        two = parse('f91d,120x40,0,0{60x40,0,0,0,59x40,61,0,1}')
+        fitted = layout.fit_layout(two, 100, 30)
+        self.assertEqual([(pane.width, pane.height, pane.x)
+                          for pane in layout.iter_panes(fitted)],
+                         [(60, 30, 0), (39, 30, 61)])
+        fitted = layout.fit_layout(two, 40, 30)
+        self.assertEqual([(pane.width, pane.x)
+                          for pane in layout.iter_panes(fitted)],
+                         [(38, 0), (1, 39)])
+        self.assertRaises(ValueError, layout.fit_layout, two, 2, 30)
+
+    def test_layout_diff(self):
+        parse = layout.parse_layout
+        one = parse('aafd,120x40,0,0,0')
+        two = parse('f91d,120x40,0,0{60x40,0,0,0,59x40,61,0,1}')
+        moved = parse('0fde,120x40,0,0{89x40,0,0,0,30x40,90,0,1}')
+        scaled = parse('0000,100x40,0,0{50x40,0,0,0,49x40,51,0,1}')
+        self.assertEqual(layout.diff_layouts(one, two), [
+            layout.PaneAdded('%1', '%0', False, False),
+            layout.PaneResized('%0', 60, 40),
+            layout.RatioChanged('%0', '%1', False)])
+        self.assertEqual(layout.diff_layouts(two, one), [
+            layout.PaneRemoved('%1'),
+            layout.PaneResized('%0', 120, 40)])
+        self.assertIn(layout.RatioChanged('%0', '%1', False),
+                      layout.diff_layouts(two, moved))
+        self.assertNotIn(layout.RatioChanged('%0', '%1', False),
+                         layout.diff_layouts(two, scaled))
+        self.assertEqual(layout.diff_layouts(two, two), [])
+
+    def test_invalid_layouts(self):
+        for window_layout in ['', '5154,120x40,0,0',
+                              '5154,120x40,0,0{30x40,0,0,0',
+                              '5154,120x40,0,0{30x40,0,0,0]',
+                              '5154,120x40,0,0,0,80x24,0,0,1']:
+            self.assertRaises(ValueError, layout.parse_layout, window_layout)
+
+
+class OutputTests(unittest.TestCase):
+
+    def test_output_line_decoding(self):
+        with open(RECORDING) as recording:
+            lines = [line[:-1] for line in recording
+                     if line.startswith(output.OUTPUT_PREFIX)]
+        self.assertTrue(lines)
+        for line in lines:
+            fields = line.split(' ')
+            pane_id, data = output.parse_output_line(line)
+            self.assertEqual(pane_id, fields[1])
+            self.assertEqual(data,
+                             ' '.join(fields[2:]).decode('string_escape'))
+
+    def test_output_queue_coalesces_per_pane(self):
+        fed = []
+        queue = output.OutputQueue(lambda pane_id, data: fed.append(
+            (pane_id, data)), max_bytes_per_tick=8)
+        for chunk in ['ab', 'cd', 'ef']:
+            queue.put('%1', chunk)
+        queue.put('%2', '0123456789')
+        queue.drain()
+        self.assertEqual(fed, [('%1', 'abcdef'), ('%2', '01234567')])
+        self.assertEqual(queue.queued_bytes, 2)
+        queue.drain()
+        self.assertEqual(fed[-1], ('%2', '89'))
+        self.assertEqual(queue.feed_calls, 3)
+        self.assertEqual(queue.queued_bytes, 0)
+
+
+class ModesTests(unittest.TestCase):
+
+    def test_modes_survive_chunk_splits(self):
+        data = ('\033[?1049h\033[1;1H\033[?1000;1006hvim\033[?2004h'
+                '\033[?1000l\033[?1002h\033[?25h')
+        for size in xrange(1, len(data) + 1):
+            pane_modes = modes.PaneModes()
+            for i in xrange(0, len(data), size):
+                pane_modes.feed(data[i:i + size])
+            self.assertEqual((pane_modes.alternate_screen, pane_modes.mouse,
+                              pane_modes.mouse_sgr, pane_modes.bracketed_paste),
+                             (True, True, True, True))
+            pane_modes.feed('\033[?1049l\033[?1002')
+            self.assertTrue(pane_modes.mouse)
+            pane_modes.feed('l')
+            self.assertFalse(pane_modes.alternate_screen or pane_modes.mouse)
+            pane_modes.feed('\033c')
+            self.assertFalse(pane_modes.bracketed_paste)
+
+    def test_modes_are_seeded_from_tmux(self):
+        pane_modes = modes.PaneModes()
+        pane_modes.feed('\033[?1049h\033[?2004h')
+        pane_modes.seed('0 0 1 0 1')
+        self.assertEqual((pane_modes.alternate_screen, pane_modes.mouse,
+                          pane_modes.mouse_sgr, pane_modes.bracketed_paste),
+                         (False, True, True, True))
+
+
+class PredictionTests(TmuxTestCase):
+
+    def test_predictions_are_confirmed_or_rolled_back(self):
+        class Clock(object):
+            now = 100.0
+            @classmethod
+            def time(cls):
+                return cls.now
+        class Vte(object):
+            def __init__(self):
+                self.fed = []
+            def feed(self, data):
+                self.fed.append(data)
+            def get_cursor_position(self):
+                return 10, 0
+            def get_column_count(self):
+                return 80
+        vte = Vte()
+        gobject = self.fake_gobject(prediction)
+        self.patch(prediction, 'time', Clock)
+        echo = prediction.LocalEcho(enabled=True)
+        # nothing is shown until an echo was seen to be slow
+        echo.predict('%0', 'l', vte, modes.DEFAULT_MODES)
+        Clock.now += 0.15
+        echo.feed('%0', vte, 'l')
+        self.assertEqual(vte.fed, ['l'])
+        del vte.fed[:]
+        echo.predict('%0', 's', vte, modes.DEFAULT_MODES)
+        echo.predict('%0', ' ', vte, modes.DEFAULT_MODES)
+        self.assertEqual(vte.fed, ['\033[4ms\033[24m', '\033[4m \033[24m'])
+        del vte.fed[:]
+        Clock.now += 0.15
+        # half of the echo, the rest is shown again after it
+        echo.feed('%0', vte, 's')
+        self.assertEqual(vte.fed, ['\033[2D\033[2Xs', '\033[4m \033[24m'])
+        del vte.fed[:]
+        # a completion instead of the space
+        echo.feed('%0', vte, 'tat')
+        self.assertEqual(vte.fed, ['\033[1D\033[1Xtat'])
+        # no longer shown, and taken back when the echo doesn't come
+        echo.predict('%0', 'x', vte, modes.DEFAULT_MODES)
+        Clock.now += prediction.PREDICTION_TIMEOUT
+        self.assertFalse(gobject.timers[-1]())
+        # not predicted on the alternate screen
+        alternate = modes.PaneModes()
+        alternate.feed('\033[?1049h')
+        echo.predict('%1', 'q', vte, alternate)
+        self.assertNotIn('%1', echo.panes)
+        stats = echo.stats()
+        self.assertAlmostEqual(stats.pop('hidden_latency'), 0.15)
+        self.assertEqual(stats, {'predicted': 4, 'confirmed': 2,
+                                 'rolled_back': 2})
+
+
+class ReaderTests(TmuxTestCase):
+
+    def test_parser_matches_line_reader(self):
+        with open(RECORDING) as recording:
+            data = recording.read()
+        stream = StringIO(data)
+        expected = []
+        for line in iter(stream.readline, ''):
+            line = line[1:-1].split(' ')
+            notification = notifications.notifications_mappings[line[0]]()
+            notification.consume(line[1:], stream)
+            expected.append(str(notification))
+        parser = reader.NotificationParser()
+        parsed = []
+        for start in xrange(0, len(data), 7):
+            parsed.extend(str(notification) for notification
+                          in parser.feed(data[start:start + 7]))
+        self.assertEqual(parsed, expected)
+        self.assertEqual(parser.buffer, '')
+        self.assertIsNone(parser.block)
+
+    def test_notifications_are_dispatched_by_marker(self):
+        class Handler(notifications.NotificationsHandler):
+            def __init__(self):
+                notifications.NotificationsHandler.__init__(
+                    self, FakeTerminator())
+            def handle_window_renamed(self, notification):
+                renamed.append(notification.window_name)
+            def handle_window_close(self, notification):
+                raise AttributeError(notification.window_id)
+        renamed = []
+        handler = Handler()
+        parser = reader.NotificationParser(handler.dispatch)
+        handler.handle_batch(parser.feed(
+            'Welcome!\n%window-renamed @1 vim\n%sessions-changed\n'
+            '%client-detached x\n%client-detached y\n'))
+        self.assertEqual(renamed, ['vim'])
+        # known markers nothing handles are dropped and counted too
+        self.assertNotIn('sessions-changed', handler.dispatch)
+        self.assertEqual(parser.unknown, {'': 1, 'client-detached': 2,
+                                          'sessions-changed': 1})
+        # errors in handlers are not mistaken for a missing handler
+        close, = parser.feed('%window-close @1\n')
+        self.assertRaises(AttributeError, handler.handle, close)
+        # but don't stop a batch
+        handler.handle_batch(parser.feed('%window-close @1\n'
+                                         '%window-renamed @1 top\n'))
+        self.assertEqual(renamed, ['vim', 'top'])
+        self.assertRaises(AttributeError, lambda: setattr(close, 'x', 1))
+
+
+class ScrollbackTests(unittest.TestCase):
+
+    def test_history_is_loaded_in_chunks(self):
+        rows = ['row{}'.format(row) for row in xrange(100)]
+        screen = 3
+        captures = []
+        class Pane(object):
+            def capture(self, start, end):
+                captures.append((start, end))
+                history_size = len(rows) - screen
+                start = 0 if start == '-' else history_size + start
+                end = len(rows) if end == '-' else history_size + end + 1
+                return ['{} 0 2 4'.format(history_size)] + rows[start:end]
+        class Control(object):
+            def capture_history(self, pane_id, start, end, callback):
+                callback(pane.capture(start, end))
+        class Handler(object):
+            control = Control()
+            output_queue = output.OutputQueue(None)
+        pane = Pane()
+        loader = scrollback.ScrollbackLoader(Handler(), tail=10,
+                                             chunk_size=25, mode='idle')
+        attach = pane.capture(-10, '-')
+        loader.initial_output_result('%1')(
+            [attach[0].split(' ')[0]] + attach[1:])
+        self.assertEqual(Handler.output_queue.panes['%1'],
+                         ['\r\n'.join(rows[87:])])
+        while '%1' in loader.panes:
+            loader.fetch('%1')
+            # output keeps coming while the history loads
+            rows.append('row{}'.format(len(rows)))
+        self.assertEqual(captures[1:], [(-35, -11), (-60, -36), (-85, -61),
+                                        ('-', -86), (-100, '-')])
+        self.assertEqual(Handler.output_queue.panes['%1'],
+                         ['\r\n'.join(rows[:-1]) + '\033[3;5H'])
+        self.assertEqual(Handler.output_queue.resets, set(['%1']))
+
+
+class ControlTests(TmuxTestCase):
+
+    def test_keys_are_batched_per_pane(self):
+        tmux_control = control.TmuxControl('test', None)
+        tmux_control.input = StringIO()
+        for key in ['l', 's', ';', '\r']:
+            tmux_control.queue_keys(key, '%1')
+        tmux_control.queue_keys(u'\u20ac', '%2')
+        tmux_control.flush_keys()
+        self.assertEqual(tmux_control.input.getvalue(),
+                         'send-keys -H -t %1 6c 73 3b 0d\n'
+                         'send-keys -H -t %2 e2 82 ac\n')
+        self.assertEqual(len(tmux_control.requests), 2)
+
+    def test_wheel_and_paste_follow_pane_modes(self):
+        class Event(object):
+            direction = control.Gdk.ScrollDirection.UP
+        handler = self.make_handler()
+        tmux_control = control.TmuxControl('test', handler)
+        tmux_control.input = StringIO()
+        for pane_id, data in [('%1', '\033[?1049h'),
+                              ('%2', '\033[?1000h\033[?1006h\033[?2004h'),
+                              ('%3', '\033[?1000h')]:
+            notification = notifications.Output()
+            notification.pane_id, notification.output = pane_id, data
+            handler.handle_output(notification)
+        self.assertFalse(tmux_control.send_mousewheel(Event(), '%0'))
+        for pane_id in ['%1', '%2', '%3']:
+            self.assertTrue(tmux_control.send_mousewheel(
+                Event(), pane_id, column=3, row=300))
+        tmux_control.send_paste('ls\r', '%0')
+        tmux_control.send_paste('rm\033[201~\r', '%2')
+        self.assertEqual(tmux_control.input.getvalue().splitlines(), [
+            'send-keys -t %1 {}'.format(control.MOUSE_WHEEL[Event.direction]),
+            'send-keys -H -t %2 {}'.format(control.hex_keys('\033[<64;3;300M')),
+            'send-keys -H -t %3 {}'.format(control.hex_keys('\033[M`#\xff')),
+            'send-keys -H -t %0 {}'.format(control.hex_keys('ls\r')),
+            'send-keys -H -t %2 {}'.format(
+                control.hex_keys('\033[200~rm\r\033[201~'))])
+
+    def test_failing_handlers_keep_the_connection(self):
+        class Handler(notifications.NotificationsHandler):
+            def handle_layout_change(self, notification):
+                raise ValueError(notification.window_layout)
+            def handle_window_renamed(self, notification):
+                renamed.append(notification.window_name)
+            def terminate(self):
+                self.terminated = True
+        class Tmux(object):
+            def poll(self):
+                return None if tmux_control.output.tell() < size else 0
+        renamed = []
+        handler = Handler(FakeTerminator())
+        tmux_control = control.TmuxControl('test', handler)
+        data = '%layout-change @1 bogus\n%window-renamed @1 vim\n'
+        size = len(data)
+        tmux_control.output = StringIO(data)
+        tmux_control.tmux = Tmux()
+        tmux_control.consume_notifications()
+        self.assertEqual(renamed, ['vim'])
+        self.assertTrue(handler.terminated)
+
+    def test_reconnects_back_off_then_give_up(self):
+        gobject = self.fake_gobject(control)
+        tmux_control = control.TmuxControl('test', None)
+        attempts = 0
+        while tmux_control.reconnect():
+            attempts += 1
+        config = control.Config()
+        self.assertEqual(attempts, config['tmux_reconnect_attempts'])
+        self.assertEqual(gobject.delays[:3],
+                         [config['tmux_reconnect_delay'] * 2 ** n
+                          for n in xrange(3)])
+        self.assertLessEqual(max(gobject.delays), control.MAX_RECONNECT_DELAY)
+        event, = tmux_control.reconnects
+        self.assertEqual((event.attempts, event.outcome), (attempts, 'gave up'))
+        self.assertFalse(tmux_control.reconnecting)
+        self.assertIn('gave up', tmux_control.reconnect_report())
+
+    def test_reconnect_redraws_only_active_windows(self):
+        class Control(object):
+            disconnected_at = 1000
+            def __init__(self):
+                self.pane_id_to_terminal = {'%0': None, '%1': None,
+                                            '%2': None}
+                self.refreshed = []
+            def refresh_pane(self, pane_id):
+                self.refreshed.append(pane_id)
+        handler = self.make_handler(Control())
+        windows = ['@1 b25d,80x24,0,0,0', '@2 b25e,80x24,0,0,1',
+                   '@3 b25f,80x24,0,0,2']
+        for line in windows:
+            window_id, window_layout = line.split(' ')
+            handler.window_layouts[window_id] = \
+                handler.layout_parser.parse(window_layout)
+        kept = handler.window_layouts['@1']
+        handler.reconcile_result(['@1 900 b25d,80x24,0,0,0',
+                                  '@2 1001 b25e,80x24,0,0,1'])
+        self.assertEqual(handler.control.refreshed, ['%1'])
+        self.assertEqual(sorted(handler.window_layouts), ['@1', '@2'])
+        self.assertIs(handler.window_layouts['@1'], kept)
+
+
+class TrackerTests(unittest.TestCase):
+
+    def test_count_commands(self):
+        self.assertEqual(tracker.count_commands('list-panes'), 1)
+        self.assertEqual(tracker.count_commands('list-panes ; list-windows'), 2)
+        self.assertEqual(tracker.count_commands('send-keys \\; ; kill-pane'),
+                         2)
+        self.assertEqual(tracker.count_commands('display "a ; b"'), 1)
+        self.assertEqual(tracker.count_commands('list-panes ;'), 1)
+
+    def test_requests_are_matched_in_order(self):
+        requests = tracker.RequestTracker()
+        answers = []
+        requests.add('new-session', answers.append, initial=True)
+        requests.add('list-panes ; list-windows', answers.append)
+        requests.add('refresh-client -C 80,24')
+        # initial block, then a hook block that belongs to nobody
+        self.assertTrue(requests.begin('10', '0'))
+        self.assertTrue(requests.end('10', ['%0'], False))
+        self.assertIsNone(requests.begin('11', '0'))
+        self.assertEqual(requests.unmatched, 1)
+        # both blocks of the compound command are needed
+        self.assertTrue(requests.begin('12', '1'))
+        self.assertIsNone(requests.end('12', ['%1'], False))
+        self.assertTrue(requests.begin('13', '1'))
+        request = requests.end('13', ['@1'], False)
+        self.assertEqual(request.result, ['%1', '@1'])
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests.histograms['list-panes'].count, 1)
+
+    def test_timed_out_requests_keep_their_place(self):
+        requests = tracker.RequestTracker(timeout=0)
+        answers = []
+        requests.add('list-panes', answers.append)
+        requests.add('list-windows', answers.append)
+        requests.waiting[0].sent -= 1
+        requests.waiting[1].sent += 60
+        self.assertTrue(requests.check_timeouts())
+        self.assertIsNone(requests.begin('1', '1') and requests.end('1', [], False))
+        request = requests.begin('2', '1') and requests.end('2', ['@1'], False)
+        self.assertEqual(request.command, 'list-windows')
+        self.assertEqual(requests.histograms['list-panes'].timeouts, 1)
+        self.assertIn('list-windows', requests.report())
+
+    def test_missing_blocks_do_not_shift_answers(self):
+        requests = tracker.RequestTracker()
+        answers = []
+        for command in ['list-panes', 'list-windows', 'display -p x']:
+            requests.add(command, answers.append)
+        # the %begin of list-panes never arrived, only its %end
+        parser = reader.NotificationParser()
+        notification, = parser.feed('%end 1 20 1\n')
+        self.assertEqual(notification.marker, 'end')
+        request = requests.lost(notification.code, notification.flags)
+        self.assertEqual(request.command, 'list-panes')
+        self.assertEqual(len(requests), 2)
+        # a stale or repeated block is nobody's answer
+        self.assertIsNone(requests.begin('19', '1'))
+        self.assertIsNone(requests.begin('20', '1'))
+        self.assertEqual(requests.unmatched, 2)
+        # other clients' commands leave gaps in the numbers
+        request = requests.begin('23', '1') and \
+            requests.end('23', ['@1'], False)
+        self.assertEqual(request.command, 'list-windows')
+        request = requests.begin('30', '1') and \
+            requests.end('30', ['x'], False)
+        self.assertEqual(request.kind, 'display')
+        self.assertEqual(len(requests), 0)
+        self.assertEqual(requests.histograms['list-panes'].timeouts, 1)
+        self.assertEqual(requests.histograms['list-windows'].count, 1)
+
+    def test_reconnecting_starts_the_numbers_over(self):
+        requests = tracker.RequestTracker()
+        requests.add('list-panes')
+        self.assertTrue(requests.begin('40', '1'))
+        requests.add('list-windows')
+        # the server went away, the new one counts from 0
+        requests.clear()
+        requests.add('attach-session -t test', initial=True)
+        requests.add('list-windows')
+        self.assertTrue(requests.begin('0', '0'))
+        self.assertTrue(requests.end('0', [], False))
+        request = requests.begin('1', '1') and \
+            requests.end('1', ['@1'], False)
+        self.assertEqual(request.kind, 'list-windows')
+        self.assertEqual(requests.unmatched, 0)
+
+
+class FakeTmuxTests(TmuxTestCase):
+
+    def test_commands_are_answered_in_order(self):
+        script = tempfile.NamedTemporaryFile()
+        script.write('history %0 30\nreplay {} 0 2\n'.format(
+            os.path.realpath(RECORDING)))
+        script.flush()
+        env = dict(os.environ, FAKE_TMUX_SCRIPT=script.name)
+        tmux = subprocess.Popen(
+            [sys.executable, FAKE_TMUX, '-2', '-C', 'new-session', '-s', 't',
+             '-P', '-F', '#D marker'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        requests = tracker.RequestTracker()
+        requests.add('new-session', initial=True)
+        commands = ['display -p -t %0 "#{history_size}" ; '
+                    'capture-pane -p -t %0 -eC -S -2 -E -1',
+                    'split-window -h -t %0 -P -F "#D abc"', 'bogus']
+        for command in commands:
+            requests.add(command)
+        out, _ = tmux.communicate(''.join(c + '\n' for c in commands))
+        results = []
+        layouts = []
+        outputs = 0
+        for notification in reader.NotificationParser().feed(out):
+            if notification.marker == 'begin':
+                request = requests.complete(notification)
+                if request is not None:
+                    results.append((request.kind, request.result,
+                                    request.error))
+            elif notification.marker == 'layout-change':
+                layouts.append(notification.window_layout)
+            elif notification.marker == 'output':
+                outputs += 1
+        self.assertEqual(results, [
+            ('new-session', ['%0 marker'], False),
+            ('display', ['30', 'line 28', 'line 29'], False),
+            ('split-window', ['%1 abc'], False),
+            ('bogus', ['unknown command: bogus'], True)])
+        self.assertEqual(len(requests), 0)
+        self.assertEqual([pane.pane_id for pane in layout.iter_panes(
+            layout.parse_layout(layouts[-1]))], ['%0', '%1'])
+        self.assertEqual(outputs, 2 * open(RECORDING).read().count(
+            '\n%output '))
+        self.assertTrue(out.endswith('%exit\n'))
+
+    def test_pane_metadata_is_pushed(self):
+        tmux_control = control.TmuxControl('test', None)
+        tmux_control.input = StringIO()
+        tmux_control.subscribe_pane_metadata()
+        commands = tmux_control.input.getvalue().splitlines() + [
+            'split-window -v -t %0 -P -F "#D abc"']
+        tmux = subprocess.Popen(
+            [sys.executable, FAKE_TMUX, '-2', '-C', 'attach-session', '-t',
+             'test'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            env=dict(os.environ, FAKE_TMUX_SCRIPT=''))
+        out, _ = tmux.communicate(''.join(c + '\n' for c in commands))
+        class Terminal(object):
+            cwd = pid = pane_title = None
+            command = '/bin/sh'
+            def __init__(self):
+                self.titles = []
+            def set_cwd(self, cwd):
+                self.cwd = cwd
+            def get_window_title(self):
+                return self.pane_title
+            def emit(self, signal, title):
+                self.titles.append(title)
+        class Control(object):
+            def __init__(self):
+                self.pane_id_to_terminal = {'%0': Terminal()}
+        handler = self.make_handler(Control())
+        pane_id_to_terminal = handler.control.pane_id_to_terminal
+        self.fake_gobject(notifications)
+        for notification in reader.NotificationParser().feed(out):
+            if notification.marker == 'subscription-changed':
+                handler.handle(notification)
+        # %1 was split before we knew its terminal
+        pane_id_to_terminal['%1'] = Terminal()
+        handler.pane_registered('%1')
+        # unchanged values aren't applied again
+        handler.handle(notification)
+        for pane_id, pid in [('%0', '10000'), ('%1', '10001')]:
+            terminal = pane_id_to_terminal[pane_id]
+            self.assertEqual((terminal.cwd, terminal.pid, terminal.command),
+                             ('/home/fake', pid, 'bash'))
+            self.assertEqual(terminal.titles[-1], 'fake')
+        self.assertEqual(len(pane_id_to_terminal['%1'].titles), 1)
+        self.assertEqual(sorted(handler.pane_metadata['%1']),
+                         sorted(notifications.PANE_METADATA))
+
 
 def main():
     unittest.main()